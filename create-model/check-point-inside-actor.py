@@ -1,4 +1,5 @@
 import vtkmodules.all as vtk
+from containment_index import ContainmentIndex
 
 # not working
 def is_point_inside_actor_1(actor, point):
@@ -37,6 +38,10 @@ def is_point_inside_actor_2(actor, point):
     # Retrieve the status of the point (1 if inside, 0 if outside)
     return select_enclosed.IsInside(0)
 
+# working, the ContainmentIndex is built once per surface and answers single points or batches
+def is_point_inside_actor_3(index, point):
+    return index.contains(point)
+
 
 
 radius = 10
@@ -184,6 +189,15 @@ is_inside = selector.IsInside(0)
 print("second --- %s seconds ---" % (time.time() - start_time_2))
 print("points 2 is in the side: ", is_inside)
 
+# Build the containment index of the closed sphere once, then query
+start_time = time.time()
+index = ContainmentIndex(appendFilter.GetOutput())
+print("index build --- %s seconds ---" % (time.time() - start_time))
+for p in [check_point, check_point_2, [0, 0.1, 0]]:
+    start_time = time.time()
+    is_inside = is_point_inside_actor_3(index, p)
+    print(f"index query {p} --- {time.time() - start_time} seconds --- inside: {is_inside}")
+
 
 # Create a render window and set the renderer
 renderWindow = vtk.vtkRenderWindow()
@@ -1,4 +1,5 @@
 import vtkmodules.all as vtk
+from containment_index import ContainmentIndex
 
 # ! the vtkPointLocator only check the surface, if the point inside of actor, the result will be incorrect
 # not working
@@ -34,6 +35,10 @@ def is_point_inside_actor_2(polydata, point):
 
     return inside != -1
 
+# working, the ContainmentIndex is built once and tests the inside, not only the surface
+def is_point_inside_actor_3(index, point):
+    return index.contains(point)
+
 
 
 radius = 10
@@ -157,6 +162,14 @@ is_inside = is_point_inside_actor_2(appendFilter.GetOutput(), check_point_2)
 print("second --- %s seconds ---" % (time.time() - start_time_2))
 print("points 2 is in the side: ", is_inside)
 
+index = ContainmentIndex(appendFilter.GetOutput())
+start_time = time.time()
+is_inside = is_point_inside_actor_3(index, check_point)
+print("index --- %s seconds ---" % (time.time() - start_time))
+print('Is point inside append polydata (index):', is_inside)
+is_inside = is_point_inside_actor_3(index, check_point_2)
+print("points 2 is in the side (index): ", is_inside)
+
 
 # Create a render window and set the renderer
 renderWindow = vtk.vtkRenderWindow()
@@ -1,18 +1,17 @@
+import os
+import sys
+import numpy as np
 import vtkmodules.all as vtk
+from phantom import gradient_volume
 
-# Create a vtkImageData object
-image_data = vtk.vtkImageData()
-image_data.SetDimensions(10, 10, 10)  # Set dimensions (x, y, z)
-image_data.SetOrigin(0.0, 0.0, 0.0)  # Set origin (optional)
-image_data.SetSpacing(1.0, 1.0, 1.0)  # Set spacing (optional)
-image_data.AllocateScalars(vtk.VTK_DOUBLE, 1)  # Allocate memory for scalar values
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from image_array import numpy_to_image
 
-# Fill the image with some data (e.g., a simple gradient)
-for z in range(10):
-    for y in range(10):
-        for x in range(10):
-            value = x + y + z
-            image_data.SetScalarComponentFromDouble(x, y, z, 0, value)
+# Fill a (z, y, x) array with some data (e.g., a simple gradient x + y + z), no per-voxel loop
+values = gradient_volume((10, 10, 10), spacing=(1.0, 1.0, 1.0), dtype=np.float64)
+
+# Wrap it as a vtkImageData object without copying
+image_data = numpy_to_image(values, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0), name="ImageScalars")
 
 # Write the vtkImageData object to a VTI file
 writer = vtk.vtkXMLImageDataWriter()
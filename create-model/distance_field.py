@@ -0,0 +1,232 @@
+import json
+import os
+import sys
+import numpy as np
+import vtkmodules.all as vtk
+from vtkmodules.util import numpy_support
+from containment_index import ContainmentIndex
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from label_index import file_stamps, file_hash, write_index
+from image_array import image_to_numpy, numpy_to_image
+
+'''
+Signed distance field of a closed surface (no-fly zone, screw models) for collision checks.
+The surface is voxelized once: ContainmentIndex gives the inside mask, vtkImageEuclideanDistance
+the distance to the other side everywhere, and voxels close to the surface get the exact
+distance from vtkImplicitPolyDataDistance. Queries are trilinear lookups, O(1) per point,
+negative inside: penetration depth inside, clearance outside.
+load_distance_field() keeps the grid in <surface>.sdf.npz next to the surface file, keyed by
+size, mtime and SHA-256 of the file and by the grid settings, like the mask label index.
+'''
+
+FIELD_VERSION = 1
+FIELD_SUFFIX = ".sdf.npz"
+
+
+def read_surface(surface_file):
+    """
+    Reads an STL, VTP or legacy VTK surface.
+    """
+    if surface_file.endswith(".stl"):
+        reader = vtk.vtkSTLReader()
+    elif surface_file.endswith(".vtp"):
+        reader = vtk.vtkXMLPolyDataReader()
+    else:
+        reader = vtk.vtkGenericDataObjectReader()
+    reader.SetFileName(surface_file)
+    reader.Update()
+    return reader.GetOutput()
+
+
+def squared_distance_to_zero(mask, spacing):
+    """
+    Squared distance in mm from every voxel to the nearest voxel where mask is False.
+    """
+    distance = vtk.vtkImageEuclideanDistance()
+    distance.SetInputData(numpy_to_image(mask.astype(np.float64)))
+    distance.SetMaximumDistance(float(np.sum(np.square(mask.shape))))
+    distance.Update()
+    # The filter works in voxel units
+    return np.asarray(image_to_numpy(distance.GetOutput())) * spacing ** 2
+
+
+def to_local(points, matrix):
+    """
+    Maps world points into the surface frame, matrix is the surface pose (vtkMatrix4x4 or 4x4 array).
+    """
+    if matrix is None:
+        return points
+    if isinstance(matrix, vtk.vtkMatrix4x4):
+        matrix = np.array(matrix.GetData(), dtype=np.float64).reshape(4, 4)
+    inverse = np.linalg.inv(matrix)
+    return points @ inverse[:3, :3].T + inverse[:3, 3]
+
+
+class SignedDistanceField:
+    def __init__(self, distances, origin, spacing):
+        """
+        Args:
+            distances: Signed distances (z, y, x) in mm, negative inside.
+            origin: World position of voxel (0, 0, 0).
+            spacing: Isotropic voxel size in mm.
+        """
+        self.distances = np.ascontiguousarray(distances, dtype=np.float32)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.spacing = float(spacing)
+        # (x, y, z) dimensions, flat strides of the (z, y, x) array
+        self.dims = np.array(self.distances.shape[::-1])
+        self.strides = np.array([1, self.dims[0], self.dims[0] * self.dims[1]])
+        self.flat = self.distances.ravel()
+
+    @classmethod
+    def build(cls, polydata, resolution=128, spacing=None, padding=4, exact_band=2.0):
+        """
+        Voxelizes a closed surface.
+
+        Args:
+            polydata: Closed surface.
+            resolution: Number of voxels along the longest side of the surface bounds.
+            spacing: Voxel size in mm, overrides resolution.
+            padding: Voxels added around the bounds, so the grid border lies outside.
+            exact_band: Voxels closer to the surface than this many voxels get the exact distance.
+        """
+        bounds = np.array(polydata.GetBounds()).reshape(3, 2)
+        extent = bounds[:, 1] - bounds[:, 0]
+        if spacing is None:
+            spacing = extent.max() / max(resolution - 1, 1)
+        origin = bounds[:, 0] - padding * spacing
+        dims = np.ceil(extent / spacing).astype(np.int64) + 2 * padding + 1
+
+        inside = ContainmentIndex(polydata).voxelize(origin, (spacing,) * 3, dims)
+        # Distance between voxel centers on either side, the surface lies about half a voxel in between
+        outside_distance = np.sqrt(squared_distance_to_zero(~inside, spacing))
+        inside_distance = np.sqrt(squared_distance_to_zero(inside, spacing))
+        distances = np.where(inside, 0.5 * spacing - inside_distance, outside_distance - 0.5 * spacing)
+
+        if exact_band > 0:
+            band = np.flatnonzero(np.abs(distances) < exact_band * spacing)
+            z, y, x = np.unravel_index(band, distances.shape)
+            points = origin + np.stack([x, y, z], axis=1) * spacing
+            implicit = vtk.vtkImplicitPolyDataDistance()
+            implicit.SetInput(polydata)
+            exact = vtk.vtkDoubleArray()
+            implicit.FunctionValue(numpy_support.numpy_to_vtk(points), exact)
+            # Only the magnitude is used, the sign comes from the inside mask
+            magnitude = np.abs(numpy_support.vtk_to_numpy(exact))
+            distances.ravel()[band] = np.where(inside.ravel()[band], -magnitude, magnitude)
+        return cls(distances, origin, spacing)
+
+    def distance(self, points, matrix=None):
+        """
+        Signed distance of points, trilinear between voxels. Points outside the grid get the
+        value at the nearest grid point plus their distance to it.
+
+        Args:
+            points: Array-like (N, 3) or a single point (3,).
+            matrix: Pose of the surface in the points' frame, e.g. actor.GetMatrix(). None for identity.
+
+        Returns:
+            Float array (N,), or a float for a single point.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        single = points.ndim == 1
+        points = to_local(points.reshape(-1, 3), matrix)
+
+        index = (points - self.origin) / self.spacing
+        clamped = np.clip(index, 0, self.dims - 1)
+        base = np.minimum(np.floor(clamped).astype(np.int64), np.maximum(self.dims - 2, 0))
+        frac = clamped - base
+        first = base @ self.strides
+        value = np.zeros(len(points))
+        for dx in (0, 1):
+            wx = frac[:, 0] if dx else 1 - frac[:, 0]
+            for dy in (0, 1):
+                wy = frac[:, 1] if dy else 1 - frac[:, 1]
+                for dz in (0, 1):
+                    wz = frac[:, 2] if dz else 1 - frac[:, 2]
+                    value += wx * wy * wz * self.flat[first + dx * self.strides[0] + dy * self.strides[1] + dz * self.strides[2]]
+        value += np.linalg.norm(index - clamped, axis=1) * self.spacing
+        return float(value[0]) if single else value
+
+    def contains(self, points, matrix=None):
+        return self.distance(points, matrix) < 0
+
+    def penetration_depth(self, points, matrix=None):
+        """
+        How deep points are inside the surface, 0 outside.
+        """
+        return np.maximum(-self.distance(points, matrix), 0)
+
+    def clearance(self, points, matrix=None):
+        """
+        Distance of points to the surface, 0 inside.
+        """
+        return np.maximum(self.distance(points, matrix), 0)
+
+
+def field_path(surface_file):
+    return surface_file + FIELD_SUFFIX
+
+
+def load_distance_field(surface_file, resolution=128, spacing=None, padding=4, exact_band=2.0):
+    """
+    Loads the signed distance field cached next to a surface file, building it when missing or stale.
+
+    Args:
+        surface_file: STL, VTP or legacy VTK surface.
+        resolution, spacing, padding, exact_band: Grid settings, see SignedDistanceField.build.
+
+    Returns:
+        SignedDistanceField.
+    """
+    path = field_path(surface_file)
+    files = [surface_file]
+    settings = {"resolution": resolution, "spacing": spacing, "padding": padding, "exact_band": exact_band}
+    touched = False
+    if os.path.exists(path):
+        try:
+            with np.load(path, allow_pickle=False) as cached:
+                meta = json.loads(str(cached["meta"]))
+                stale = meta.get("version") != FIELD_VERSION or meta.get("settings") != settings
+                touched = not stale and file_stamps(files) != meta["stamps"]
+                if touched:
+                    # Touched but maybe unchanged, the hash decides
+                    stale = file_hash(files) != meta["sha256"]
+                if not stale:
+                    arrays = {key: cached[key] for key in cached.files}
+                    if touched:
+                        # Same content, refresh the stamps so the next load skips hashing
+                        meta["stamps"] = file_stamps(files)
+                        arrays["meta"] = np.array(json.dumps(meta))
+                        write_index(path, arrays)
+                    return SignedDistanceField(arrays["distances"], arrays["origin"], float(arrays["spacing"]))
+        except (OSError, ValueError, KeyError):
+            pass
+
+    field = SignedDistanceField.build(read_surface(surface_file), resolution, spacing, padding, exact_band)
+    meta = {
+        "version": FIELD_VERSION,
+        "settings": settings,
+        "stamps": file_stamps(files),
+        "sha256": file_hash(files),
+    }
+    write_index(path, {"distances": field.distances, "origin": field.origin,
+                       "spacing": np.array(field.spacing), "meta": np.array(json.dumps(meta))})
+    return field
+
+
+if __name__ == "__main__":
+    import time
+    for surface_file, resolution in [("data/noflyzone.vtk", 256), ("data/36924050.stl", 128)]:
+        start_time = time.time()
+        field = load_distance_field(surface_file, resolution=resolution)
+        print(f"{surface_file}: grid {tuple(int(d) for d in field.dims)}, spacing {field.spacing:.3f} mm "
+              f"--- {time.time() - start_time:.3f} seconds ---")
+
+        bounds = np.array(read_surface(surface_file).GetBounds()).reshape(3, 2)
+        points = np.random.default_rng(0).uniform(bounds[:, 0], bounds[:, 1], (1000000, 3))
+        start_time = time.time()
+        distances = field.distance(points)
+        print(f"1M lookups --- {time.time() - start_time:.3f} seconds ---, "
+              f"{np.count_nonzero(distances < 0)} inside, max penetration {field.penetration_depth(points).max():.2f} mm")
@@ -0,0 +1,266 @@
+import os
+import sys
+import numpy as np
+import vtkmodules.all as vtk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from image_array import ImageArray, numpy_to_image
+
+'''
+Synthetic volumes from analytic fields, for test inputs and benchmarks.
+A Phantom is a list of primitives (linear gradient, sphere, ellipsoid, cylinder, box) painted
+in order onto a background, later primitives over earlier ones. The volume is evaluated one
+z-slab at a time with NumPy broadcasting on open coordinate grids, and every primitive only
+touches the index box around its bounds, so a 512^3 volume takes seconds and the temporary
+memory stays at a few slabs. vertebra_phantom() mimics liver_57_multilabel.nii.gz: a column
+of labelled vertebrae (16-24) with two small structures (1, 15), plus the matching CT image.
+write_image() saves through the VTI, MHD (.zraw) or NIfTI writers by file extension.
+'''
+
+class Phantom:
+    def __init__(self, shape, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0), dtype=np.int16, background=0):
+        """
+        Args:
+            shape: Volume shape (z, y, x).
+            spacing: Voxel size (x, y, z) in mm.
+            origin: World position (x, y, z) of voxel (0, 0, 0).
+            dtype: Scalar type of the volume.
+            background: Value of voxels no primitive covers.
+        """
+        self.shape = tuple(int(n) for n in shape)
+        self.spacing = np.asarray(spacing, dtype=np.float64)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.dtype = np.dtype(dtype)
+        self.background = background
+        self.primitives = []
+
+    def add_gradient(self, direction, scale=1.0, offset=0.0):
+        """
+        Adds value = offset + scale * dot(direction, position) everywhere (position in mm).
+        """
+        self.primitives.append(("gradient", np.asarray(direction, dtype=np.float64), scale, offset))
+        return self
+
+    def add_ellipsoid(self, center, radii, value):
+        center, radii = np.asarray(center, dtype=np.float64), np.asarray(radii, dtype=np.float64)
+        self.primitives.append(("ellipsoid", center, radii, value, center - radii, center + radii))
+        return self
+
+    def add_sphere(self, center, radius, value):
+        return self.add_ellipsoid(center, (radius,) * 3, value)
+
+    def add_cylinder(self, start, end, radius, value):
+        """
+        Solid cylinder of the given radius between the centers of its two caps.
+        """
+        start, end = np.asarray(start, dtype=np.float64), np.asarray(end, dtype=np.float64)
+        axis = end - start
+        length = np.linalg.norm(axis)
+        axis = axis / length
+        # Half extent of the cylinder along each world axis
+        reach = radius * np.sqrt(np.maximum(1 - axis ** 2, 0))
+        lower = np.minimum(start, end) - reach
+        upper = np.maximum(start, end) + reach
+        self.primitives.append(("cylinder", start, axis, length, radius, value, lower, upper))
+        return self
+
+    def add_box(self, lower, upper, value):
+        lower, upper = np.asarray(lower, dtype=np.float64), np.asarray(upper, dtype=np.float64)
+        self.primitives.append(("box", value, lower, upper))
+        return self
+
+    def index_range(self, lower, upper, z_begin, z_end):
+        """
+        Voxel index slices (z, y, x) of a world box, clipped to the volume and the slab.
+        """
+        first = np.ceil((lower - self.origin) / self.spacing - 1e-9).astype(np.int64)
+        last = np.floor((upper - self.origin) / self.spacing + 1e-9).astype(np.int64) + 1
+        first = np.maximum(first, 0)
+        last = np.minimum(last, self.shape[::-1])
+        first[2], last[2] = max(first[2], z_begin), min(last[2], z_end)
+        if np.any(last <= first):
+            return None
+        return slice(first[2], last[2]), slice(first[1], last[1]), slice(first[0], last[0])
+
+    def coordinates(self, region):
+        """
+        Open world coordinate grids (z, y, x) of a region, broadcastable to its shape.
+        """
+        z, y, x = (self.origin[axis] + self.spacing[axis] * np.arange(part.start, part.stop, dtype=np.float64)
+                   for axis, part in zip((2, 1, 0), region))
+        return z[:, None, None], y[None, :, None], x[None, None, :]
+
+    def fill_slab(self, out, z_begin, z_end):
+        """
+        Evaluates the primitives for z slices [z_begin, z_end) into out (z_end - z_begin, y, x).
+        """
+        out[...] = self.background
+        whole = (slice(z_begin, z_end), slice(0, self.shape[1]), slice(0, self.shape[2]))
+        for primitive in self.primitives:
+            kind = primitive[0]
+            if kind == "gradient":
+                _, direction, scale, offset = primitive
+                z, y, x = self.coordinates(whole)
+                field = offset + scale * (direction[0] * x + direction[1] * y + direction[2] * z)
+                out += field.astype(out.dtype, copy=False)
+                continue
+
+            region = self.index_range(primitive[-2], primitive[-1], z_begin, z_end)
+            if region is None:
+                continue
+            z, y, x = self.coordinates(region)
+            if kind == "ellipsoid":
+                _, center, radii, value = primitive[:4]
+                inside = ((x - center[0]) / radii[0]) ** 2 + ((y - center[1]) / radii[1]) ** 2 \
+                    + ((z - center[2]) / radii[2]) ** 2 <= 1
+            elif kind == "cylinder":
+                _, start, axis, length, radius, value = primitive[:6]
+                dx, dy, dz = x - start[0], y - start[1], z - start[2]
+                along = dx * axis[0] + dy * axis[1] + dz * axis[2]
+                squared = dx ** 2 + dy ** 2 + dz ** 2 - along ** 2
+                inside = (along >= 0) & (along <= length) & (squared <= radius ** 2)
+            else:
+                value = primitive[1]
+                inside = np.ones(tuple(part.stop - part.start for part in region), dtype=bool)
+            local = (slice(region[0].start - z_begin, region[0].stop - z_begin), region[1], region[2])
+            np.copyto(out[local], value, where=np.broadcast_to(inside, out[local].shape), casting="unsafe")
+
+    def build(self, slab_size=32, noise=0.0, seed=0):
+        """
+        Evaluates the phantom.
+
+        Args:
+            slab_size: Number of z slices evaluated at once, bounds the temporary memory.
+            noise: Standard deviation of added Gaussian noise, 0 for none (label volumes).
+            seed: Seed of the noise generator.
+
+        Returns:
+            ImageArray (z, y, x) with the phantom geometry, numpy_to_image() wraps it without copying.
+        """
+        volume = np.empty(self.shape, dtype=self.dtype)
+        # Gradients are accumulated in float, integer volumes are rounded once per slab.
+        # float32 is enough for small types, float64 and 32-bit+ integers keep their precision
+        work = np.empty((min(slab_size, self.shape[0]),) + self.shape[1:], dtype=np.result_type(self.dtype, np.float32))
+        rng = np.random.default_rng(seed)
+        for z_begin in range(0, self.shape[0], slab_size):
+            z_end = min(z_begin + slab_size, self.shape[0])
+            slab = work[:z_end - z_begin]
+            self.fill_slab(slab, z_begin, z_end)
+            if noise > 0:
+                slab += rng.normal(0, noise, slab.shape).astype(work.dtype)
+            if self.dtype.kind in "iu":
+                info = np.iinfo(self.dtype)
+                np.clip(np.rint(slab), info.min, info.max, out=slab)
+            volume[z_begin:z_end] = slab
+        return ImageArray(volume, self.spacing, self.origin)
+
+    def to_image(self, **kwargs):
+        return numpy_to_image(self.build(**kwargs))
+
+
+def gradient_volume(shape, spacing=(1.0, 1.0, 1.0), direction=(1.0, 1.0, 1.0), dtype=np.float64):
+    """
+    value = dot(direction, position), the volume create-vti.py used to fill voxel by voxel.
+    """
+    return Phantom(shape, spacing, dtype=dtype).add_gradient(direction).build()
+
+
+def vertebra_phantom(shape=(366, 512, 512), spacing=(0.703125, 0.703125, 1.25), labels=range(16, 25)):
+    """
+    CT-like image and label mask resembling liver_57 and liver_57_multilabel.
+    The labels are stacked along z like vertebrae, the last label at the bottom, each one a
+    vertebral body (cylinder) with a posterior arch, spinous process and pedicles.
+    Labels 1 and 15 are two small blobs on top of the column.
+
+    Returns:
+        Tuple (image Phantom (int16, HU), label Phantom (uint8)).
+    """
+    image = Phantom(shape, spacing, dtype=np.int16, background=-1000)
+    mask = Phantom(shape, spacing, dtype=np.uint8, background=0)
+    size = np.array(shape[::-1]) * np.asarray(spacing)
+    center_x, center_y = size[0] / 2, size[1] * 0.45
+
+    # Body outline, fat and soft tissue
+    image.add_cylinder((center_x, center_y, 0), (center_x, center_y, size[2]), 0.42 * size[0], -90)
+    image.add_cylinder((center_x, center_y, 0), (center_x, center_y, size[2]), 0.38 * size[0], 40)
+
+    labels = sorted(labels, reverse=True)
+    height = 0.8 * size[2] / len(labels)
+    body_radius = 0.045 * size[0]
+    for i, label in enumerate(labels):
+        bottom = 0.06 * size[2] + i * height
+        top = bottom + 0.8 * height
+        middle = (bottom + top) / 2
+        body_y = center_y + 0.25 * body_radius
+        arch_y = body_y + 2.2 * body_radius
+        for phantom, bone, marrow in ((image, 700, 250), (mask, label, label)):
+            phantom.add_cylinder((center_x, body_y, bottom), (center_x, body_y, top), body_radius, bone)
+            phantom.add_cylinder((center_x, body_y, bottom + 1.5), (center_x, body_y, top - 1.5), body_radius - 1.5, marrow)
+            # Pedicles, arch and spinous process
+            for side in (-1, 1):
+                phantom.add_cylinder((center_x + side * 0.6 * body_radius, body_y + 0.7 * body_radius, middle),
+                                     (center_x + side * 0.6 * body_radius, arch_y, middle), 0.25 * body_radius, bone)
+            phantom.add_cylinder((center_x - 0.7 * body_radius, arch_y, middle), (center_x + 0.7 * body_radius, arch_y, middle),
+                                 0.25 * body_radius, bone)
+            phantom.add_cylinder((center_x, arch_y, middle), (center_x, arch_y + 1.3 * body_radius, middle - 0.2 * height),
+                                 0.2 * body_radius, bone)
+
+    top = 0.06 * size[2] + len(labels) * height
+    for label, radius, offset in ((15, 0.35 * body_radius, -0.8), (1, 0.15 * body_radius, 0.8)):
+        center = (center_x + offset * body_radius, center_y, min(top + radius, size[2] - radius))
+        image.add_sphere(center, radius, 500)
+        mask.add_sphere(center, radius, label)
+    return image, mask
+
+
+def write_image(image, path):
+    """
+    Writes a vtkImageData or (z, y, x) array by extension: .vti, .mhd (compressed .zraw), .nii or .nii.gz.
+    """
+    if not isinstance(image, vtk.vtkImageData):
+        image = numpy_to_image(image)
+    if path.endswith(".vti"):
+        writer = vtk.vtkXMLImageDataWriter()
+        writer.SetCompressorTypeToZLib()
+    elif path.endswith(".mhd"):
+        writer = vtk.vtkMetaImageWriter()
+        writer.SetCompression(True)
+    elif path.endswith(".nii") or path.endswith(".nii.gz"):
+        writer = vtk.vtkNIFTIImageWriter()
+        # NIfTI keeps the origin in the qform, the reader reports it there and origin 0
+        origin = image.GetOrigin()
+        qform = vtk.vtkMatrix4x4()
+        for axis in range(3):
+            qform.SetElement(axis, 3, origin[axis])
+        writer.SetQFormMatrix(qform)
+        shifted = vtk.vtkImageData()
+        shifted.ShallowCopy(image)
+        shifted.SetOrigin(0.0, 0.0, 0.0)
+        image = shifted
+    else:
+        raise ValueError("Unsupported file type: " + path)
+    writer.SetFileName(path)
+    writer.SetInputData(image)
+    writer.Write()
+    return path
+
+
+if __name__ == "__main__":
+    import time
+
+    start_time = time.time()
+    image, mask = vertebra_phantom()
+    ct = image.build(noise=20)
+    labels = mask.build()
+    print("phantom %s --- %s seconds ---" % (ct.shape, time.time() - start_time))
+    values, counts = np.unique(labels, return_counts=True)
+    print("label voxels:", dict(zip(values.tolist(), counts.tolist())))
+
+    start_time = time.time()
+    write_image(ct, "data/phantom.mhd")
+    write_image(labels, "data/phantom_multilabel.nii.gz")
+    print("write --- %s seconds ---" % (time.time() - start_time))
+
+    start_time = time.time()
+    big = Phantom((512, 512, 512), dtype=np.float32).add_gradient((1, 1, 1)).add_sphere((256, 256, 256), 120, 0.0).build()
+    print("512^3 gradient + sphere --- %s seconds ---" % (time.time() - start_time))
@@ -0,0 +1,441 @@
+import json
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import vtkmodules.all as vtk
+from image_array import ImageArray, image_to_numpy, numpy_to_image
+from label_index import source_files, file_stamps, file_hash, publish_file
+from raw_cache import load_mhd
+from volume_pyramid import VolumePyramid
+
+'''
+Chunked compressed volume store (<file>.cvol), in the spirit of Zarr.
+A .nii.gz or .zraw is one compressed stream: reading one slice inflates everything before it.
+Here every level of the volume is cut into (z, y, x) chunks of 32^3 voxels by default, and each
+chunk is zlib-compressed on its own, so a slice, a VOI or a coarse pyramid level only decodes
+the chunks it intersects. Edge chunks are clipped, not padded.
+File layout: magic, the compressed chunks, one uint64 offset table per level (chunk k spans
+offsets[k]:offsets[k + 1]), a JSON header, then a trailer (header offset, header size, magic).
+The chunks are written in one pass and the header last, like a zip directory.
+convert_volume() builds a store from .mhd, .nii/.nii.gz or .vti with the pyramid levels of
+volume_pyramid; open_volume() opens the store next to a source, keyed by size, mtime and
+SHA-256 of the source like the label index plus the labels flag (mean or mode levels), and
+converts it when missing or stale.
+'''
+
+# 2: pyramid level origins follow the image direction
+STORE_VERSION = 2
+STORE_SUFFIX = ".cvol"
+MAGIC = b"CHUNKVOL"
+TRAILER = np.dtype([("header_offset", "<u8"), ("header_size", "<u8"), ("magic", "S8")])
+
+
+def read_source(source_file):
+    """
+    Reads a MetaImage, NIfTI or VTK XML image as vtkImageData.
+    """
+    if source_file.endswith(".mhd"):
+        return load_mhd(source_file)
+    if source_file.endswith(".nii") or source_file.endswith(".nii.gz"):
+        reader = vtk.vtkNIFTIImageReader()
+    elif source_file.endswith(".vti"):
+        reader = vtk.vtkXMLImageDataReader()
+    elif source_file.endswith(".mha"):
+        reader = vtk.vtkMetaImageReader()
+    else:
+        raise ValueError("Unsupported volume format: " + source_file)
+    reader.SetFileName(source_file)
+    reader.Update()
+    return reader.GetOutput()
+
+
+def chunk_grid(shape, chunks):
+    """
+    Number of chunks along (z, y, x).
+    """
+    return tuple(-(-n // c) for n, c in zip(shape, chunks))
+
+
+def write_store(path, levels, chunks, geometry, compression_level=3, num_threads=None):
+    """
+    Writes a store, levels maps a factor to its (z, y, x) array and geometry.
+
+    Args:
+        path: Output file, written through a temporary file.
+        levels: {factor: (array, spacing, origin)}.
+        chunks: Chunk shape (z, y, x).
+        geometry: Extra header fields (direction, labels, source...).
+        compression_level: zlib level of the chunks.
+        num_threads: Compression threads, zlib releases the GIL.
+    """
+    header = dict(geometry, version=STORE_VERSION, chunks=list(chunks), compressor="zlib", levels={})
+    # A unique temporary file, processes converting the same source at once do not collide
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp", delete=False) as stream:
+        try:
+            with ThreadPoolExecutor(num_threads) as executor:
+                stream.write(MAGIC)
+                for factor, (array, spacing, origin) in sorted(levels.items()):
+                    grid = chunk_grid(array.shape, chunks)
+                    blocks = (array[z * chunks[0]:(z + 1) * chunks[0],
+                                    y * chunks[1]:(y + 1) * chunks[1],
+                                    x * chunks[2]:(x + 1) * chunks[2]]
+                              for z in range(grid[0]) for y in range(grid[1]) for x in range(grid[2]))
+                    offsets = [stream.tell()]
+                    for blob in executor.map(lambda block: zlib.compress(np.ascontiguousarray(block), compression_level), blocks):
+                        stream.write(blob)
+                        offsets.append(stream.tell())
+                    index_offset = stream.tell()
+                    stream.write(np.array(offsets, dtype="<u8").tobytes())
+                    header["levels"][str(factor)] = {
+                        "shape": list(array.shape),
+                        "spacing": [float(v) for v in spacing],
+                        "origin": [float(v) for v in origin],
+                        "index_offset": index_offset,
+                    }
+            header.setdefault("dtype", levels[1][0].dtype.str)
+            header_offset = stream.tell()
+            encoded = json.dumps(header).encode("utf-8")
+            stream.write(encoded)
+            stream.write(np.array([(header_offset, len(encoded), MAGIC)], dtype=TRAILER).tobytes())
+        except BaseException:
+            stream.close()
+            os.remove(stream.name)
+            raise
+    publish_file(stream.name, path)
+    return path
+
+
+def append_header(path, header):
+    """
+    Appends a new header and trailer to a store, the chunks and offset tables do not move.
+    The previous header stays behind as unused bytes, like an updated zip directory.
+    Open stores keep reading their chunks, the trailer is written with the header in one call.
+    """
+    encoded = json.dumps(header).encode("utf-8")
+    with open(path, "r+b") as stream:
+        header_offset = stream.seek(0, os.SEEK_END)
+        stream.write(encoded + np.array([(header_offset, len(encoded), MAGIC)], dtype=TRAILER).tobytes())
+
+
+def store_path(source_file):
+    return source_file + STORE_SUFFIX
+
+
+def convert_volume(source_file, path=None, labels=False, factors=(2, 4, 8), chunks=(32, 32, 32),
+                   compression_level=3):
+    """
+    Converts a volume file into a chunked store.
+
+    Args:
+        source_file: .mhd, .mha, .nii, .nii.gz or .vti volume.
+        path: Output file, <source_file>.cvol if None.
+        labels: Label mask, the pyramid levels use the block mode instead of the block mean.
+        factors: Pyramid levels stored next to level 1.
+        chunks: Chunk shape (z, y, x).
+        compression_level: zlib level of the chunks.
+
+    Returns:
+        Path of the store.
+    """
+    if path is None:
+        path = store_path(source_file)
+    files = source_files(source_file)
+    stamps = file_stamps(files)
+    digest = file_hash(files)
+    image_data = read_source(source_file)
+    array = image_to_numpy(image_data)
+    if array.ndim != 3:
+        raise ValueError("Only single-component volumes can be chunked!")
+
+    pyramid = VolumePyramid(image_data, factors, labels)
+    levels = {factor: (pyramid.arrays[factor], pyramid.levels[factor].GetSpacing(), pyramid.levels[factor].GetOrigin())
+              for factor in pyramid.factors}
+    geometry = {
+        "dtype": array.dtype.newbyteorder("<").str,
+        "direction": array.direction.ravel().tolist(),
+        "labels": labels,
+        "range": [float(array.min()), float(array.max())],
+        "source": {"files": [os.path.basename(f) for f in files], "stamps": stamps, "sha256": digest},
+    }
+    # Chunks are stored little-endian, a no-op on little-endian machines
+    levels = {factor: (np.asarray(level, dtype=geometry["dtype"]), spacing, origin) for factor, (level, spacing, origin) in levels.items()}
+    return write_store(path, levels, chunks, geometry, compression_level)
+
+
+def open_volume(source_file, labels=False, build=True, **kwargs):
+    """
+    Opens the store next to a source volume, converting it when missing or stale.
+
+    Args:
+        source_file: Source volume, see convert_volume.
+        labels: Label mask, a store built with the other reduction is rebuilt.
+        build: Build a missing or stale store, otherwise return None.
+        kwargs: Passed to ChunkedVolume.
+
+    Returns:
+        ChunkedVolume or None.
+    """
+    path = store_path(source_file)
+    if os.path.exists(path):
+        try:
+            store = ChunkedVolume(path, **kwargs)
+        except (OSError, ValueError, KeyError):
+            store = None
+        if store is not None:
+            files = source_files(source_file)
+            source = store.header.get("source", {})
+            valid = store.header["version"] == STORE_VERSION and store.header.get("labels") == labels
+            touched = valid and file_stamps(files) != source.get("stamps")
+            if touched:
+                # Touched but maybe unchanged, the hash decides
+                valid = file_hash(files) == source.get("sha256")
+            if valid:
+                if touched:
+                    # Same content, refresh the stamps so the next open skips hashing
+                    source["stamps"] = file_stamps(files)
+                    append_header(path, store.header)
+                return store
+            store.close()
+    if not build:
+        return None
+    convert_volume(source_file, labels=labels)
+    return ChunkedVolume(path, **kwargs)
+
+
+class ChunkedVolume:
+    def __init__(self, path, cache_mb=64):
+        """
+        Args:
+            path: Store written by convert_volume / write_store.
+            cache_mb: Budget of the decoded chunk cache in MB.
+        """
+        self.path = path
+        self.file = open(path, "rb")
+        self.file.seek(-TRAILER.itemsize, os.SEEK_END)
+        trailer = np.frombuffer(self.file.read(TRAILER.itemsize), dtype=TRAILER)[0]
+        if trailer["magic"] != MAGIC:
+            self.file.close()
+            raise ValueError("Not a chunked volume: " + path)
+        self.header = json.loads(self.pread(int(trailer["header_size"]), int(trailer["header_offset"])))
+        self.dtype = np.dtype(self.header["dtype"])
+        self.chunks = tuple(self.header["chunks"])
+        self.direction = np.array(self.header["direction"]).reshape(3, 3)
+        self.levels = {}
+        for key, level in self.header["levels"].items():
+            shape = tuple(level["shape"])
+            count = int(np.prod(chunk_grid(shape, self.chunks)))
+            offsets = np.frombuffer(self.pread(8 * (count + 1), level["index_offset"]), dtype="<u8").astype(np.int64)
+            self.levels[int(key)] = dict(level, shape=shape, grid=chunk_grid(shape, self.chunks), offsets=offsets)
+
+        self.cache_bytes = int(cache_mb * 1024 * 1024)
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+        self.bytes_read = 0
+        self.chunks_decoded = 0
+
+    def pread(self, size, offset):
+        # Positional reads share the file between threads without seeking
+        if hasattr(os, "pread"):
+            return os.pread(self.file.fileno(), size, offset)
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(size)
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def factors(self):
+        return sorted(self.levels)
+
+    def shape(self, level=1):
+        return self.levels[level]["shape"]
+
+    def spacing(self, level=1):
+        return self.levels[level]["spacing"]
+
+    def origin(self, level=1):
+        return self.levels[level]["origin"]
+
+    @property
+    def compressed_bytes(self):
+        return sum(int(level["offsets"][-1] - level["offsets"][0]) for level in self.levels.values())
+
+    def chunk(self, level, z, y, x):
+        """
+        Decoded chunk (z, y, x) of a level, from the cache when possible.
+        """
+        key = (level, z, y, x)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        info = self.levels[level]
+        grid, shape = info["grid"], info["shape"]
+        k = (z * grid[1] + y) * grid[2] + x
+        start, end = int(info["offsets"][k]), int(info["offsets"][k + 1])
+        blob = self.pread(end - start, start)
+        chunk_shape = tuple(min(c, n - i * c) for c, n, i in zip(self.chunks, shape, (z, y, x)))
+        block = np.frombuffer(zlib.decompress(blob), dtype=self.dtype).reshape(chunk_shape)
+
+        with self.lock:
+            self.bytes_read += len(blob)
+            self.chunks_decoded += 1
+            if key not in self.cache:
+                self.cache[key] = block
+                self.cached_bytes += block.nbytes
+                # Evict least recently used chunks beyond the budget, always keep the newest
+                while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cached_bytes -= evicted.nbytes
+        return block
+
+    def read_region(self, z, y, x, level=1, num_threads=4):
+        """
+        Reads a box of a level, decoding only the chunks it intersects.
+
+        Args:
+            z, y, x: Slices (step 1) or indices along each axis.
+            level: Pyramid factor.
+            num_threads: Threads decoding the chunks when the box spans several of them.
+
+        Returns:
+            ImageArray (z, y, x) with the geometry of the box.
+        """
+        shape = self.levels[level]["shape"]
+        ranges = []
+        for selection, n in zip((z, y, x), shape):
+            if isinstance(selection, slice):
+                start, stop, step = selection.indices(n)
+                if step != 1:
+                    raise ValueError("Only contiguous regions can be read!")
+            else:
+                start = int(selection) + (n if selection < 0 else 0)
+                stop = start + 1
+                if not 0 <= start < n:
+                    raise IndexError("Index out of range: %d" % selection)
+            ranges.append((start, max(stop, start)))
+
+        result = np.empty([stop - start for start, stop in ranges], dtype=self.dtype)
+        indices = [range(start // c, -(-stop // c)) for (start, stop), c in zip(ranges, self.chunks)]
+        keys = [(cz, cy, cx) for cz in indices[0] for cy in indices[1] for cx in indices[2]]
+
+        def copy(key):
+            block = self.chunk(level, *key)
+            source, target = [], []
+            for (start, stop), c, i in zip(ranges, self.chunks, key):
+                low, high = max(start, i * c), min(stop, (i + 1) * c)
+                source.append(slice(low - i * c, high - i * c))
+                target.append(slice(low - start, high - start))
+            result[tuple(target)] = block[tuple(source)]
+
+        if len(keys) > 1 and num_threads > 1:
+            with ThreadPoolExecutor(num_threads) as executor:
+                list(executor.map(copy, keys))
+        else:
+            for key in keys:
+                copy(key)
+
+        spacing = np.array(self.levels[level]["spacing"])
+        corner = np.array([ranges[2][0], ranges[1][0], ranges[0][0]]) * spacing
+        origin = np.array(self.levels[level]["origin"]) + self.direction @ corner
+        return ImageArray(result, spacing, origin, self.direction)
+
+    def read_slice(self, axis, index, level=1):
+        """
+        One axis-aligned slice, axis in VTK order (0 = x, 1 = y, 2 = z).
+
+        Returns:
+            ImageArray (z, y, x) with a length of 1 along axis.
+        """
+        selection = [slice(None)] * 3
+        selection[2 - axis] = slice(index, index + 1)
+        return self.read_region(*selection, level=level)
+
+    def read_voi(self, extent, level=1):
+        """
+        VOI (xmin, xmax, ymin, ymax, zmin, zmax) as vtkImageData, with the same extent and origin
+        as the vtkExtractVOI output of the full level.
+        """
+        x0, x1, y0, y1, z0, z1 = [int(v) for v in extent]
+        region = self.read_region(slice(z0, z1 + 1), slice(y0, y1 + 1), slice(x0, x1 + 1), level)
+        image = numpy_to_image(region, self.levels[level]["spacing"], self.levels[level]["origin"], self.direction)
+        image.SetExtent(x0, x1, y0, y1, z0, z1)
+        return image
+
+    def level_image(self, level=1):
+        """
+        A whole level as vtkImageData.
+        """
+        return numpy_to_image(self.read_region(slice(None), slice(None), slice(None), level), name="ChunkedVolume")
+
+    def geometry_image(self, level=1):
+        """
+        vtkImageData with the dimensions, spacing, origin and direction of a level but no scalars,
+        for code that only asks the image for its geometry.
+        """
+        shape = self.levels[level]["shape"]
+        image = vtk.vtkImageData()
+        image.SetDimensions(shape[2], shape[1], shape[0])
+        image.SetSpacing(self.levels[level]["spacing"])
+        image.SetOrigin(self.levels[level]["origin"])
+        image.SetDirectionMatrix(*self.direction.ravel())
+        return image
+
+    def array(self, level=1):
+        """
+        Lazy (x, y, z) array of a level, see ChunkedArray.
+        """
+        return ChunkedArray(self, level)
+
+
+class ChunkedArray:
+    """
+    Read-only (x, y, z) view of a store level that decodes on indexing, a stand-in for the
+    mask_to_numpy(image).transpose(2, 1, 0) views of the slice providers.
+    Supports indices and step 1 slices, the result is a NumPy array.
+    """
+    def __init__(self, store, level=1):
+        self.store = store
+        self.level = level
+        self.shape = tuple(reversed(store.shape(level)))
+        self.dtype = store.dtype
+        self.ndim = 3
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        region = np.asarray(self.store.read_region(key[2], key[1], key[0], self.level)).transpose(2, 1, 0)
+        # Integer indices drop their axis, like NumPy
+        return region[tuple(0 if not isinstance(k, slice) else slice(None) for k in key)]
+
+
+if __name__ == "__main__":
+    import time
+
+    for source_file, labels in [("data/L1.mhd", False), ("data/liver_57_multilabel.nii.gz", True)]:
+        start_time = time.time()
+        path = convert_volume(source_file, labels=labels)
+        print("%s: convert --- %s seconds ---" % (source_file, time.time() - start_time))
+        reference = image_to_numpy(read_source(source_file))
+        store = open_volume(source_file, labels=labels)
+        print("  stored %d bytes (%d raw), levels %s" % (store.compressed_bytes, reference.nbytes, store.factors))
+
+        start_time = time.time()
+        shape = store.shape()
+        middle = store.read_slice(0, shape[2] // 2)
+        print("  sagittal slice --- %s seconds ---, %.1f%% of the level 1 bytes read, same: %s" % (
+            time.time() - start_time, 100.0 * store.bytes_read / (store.levels[1]["offsets"][-1] - store.levels[1]["offsets"][0]),
+            np.array_equal(middle, reference[:, :, shape[2] // 2:shape[2] // 2 + 1])))
+
+        start_time = time.time()
+        image = store.level_image(8)
+        print("  level 8 %s --- %s seconds ---" % (image.GetDimensions(), time.time() - start_time))
+        print("  whole level 1 same:", np.array_equal(image_to_numpy(store.level_image()), reference))
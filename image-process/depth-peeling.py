@@ -1,4 +1,5 @@
 import vtkmodules.all as vtk
+from raw_cache import mhd_producer
 
 # useing depth peeling to handle multi-translucent actor
 # if there is volume in the scene, SetUseDepthPeelingForVolumes(1) must be set
@@ -37,10 +38,7 @@ def create_cylinder_actor():
 
 
 def read_mhd(directory):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(directory)
-    reader.Update()
-    return reader
+    return mhd_producer(directory)
 
 path = "data/origin.mhd"
 reader = read_mhd(path)
@@ -1,87 +1,185 @@
-from numba import njit
+from numba import njit, prange, get_num_threads
 import numpy as np
 import vtk
-from vtk.util import numpy_support
+from image_array import image_to_numpy
 
 '''
-    Find bounding boxes for all labels in a single pass by looping over pixels.
+    Find bounding boxes for all labels in a single parallel pass over the mask.
+    The mask is walked in memory order (z, y, x), split into z-slabs across threads.
+    Every thread fills its own partial table, the tables are merged at the end.
+    Compiled kernels are cached on disk, so only the first process start pays JIT cost.
 '''
 
-@njit
-def find_label_bounds_sequential(scalars):
+# Label ids below this value use a dense table indexed by label directly
+DENSE_LABEL_LIMIT = 65536
+# Above this label value the presence array would be too large, fall back to np.unique
+PRESENCE_LABEL_LIMIT = 1 << 26
+
+# Columns of the bounds table
+MIN_X, MAX_X, MIN_Y, MAX_Y, MIN_Z, MAX_Z, COUNT = range(7)
+
+
+@njit(parallel=True, cache=True)
+def mark_present_labels(scalars, max_label):
+    """
+    Marks which label ids occur in the mask.
+
+    Args:
+        scalars: 3D NumPy array of the mask ordered (z, y, x).
+        max_label: Largest label value in the mask.
+
+    Returns:
+        Boolean array of length max_label + 1.
+    """
+    present = np.zeros(max_label + 1, dtype=np.bool_)
+    nz, ny, nx = scalars.shape
+    # Concurrent writes all store True, so no per-thread copy is needed
+    for z in prange(nz):
+        for y in range(ny):
+            for x in range(nx):
+                present[scalars[z, y, x]] = True
+    return present
+
+
+@njit(parallel=True, cache=True)
+def find_label_bounds_parallel(scalars, lut, num_labels, num_slabs):
+    """
+    Finds bounding boxes and voxel counts for all labels in a single pass.
+
+    Args:
+        scalars: 3D NumPy array of the mask ordered (z, y, x), C-contiguous.
+        lut: Maps a label value to its row in the bounds table, -1 to skip (background).
+        num_labels: Number of rows in the bounds table.
+        num_slabs: Number of z-slabs, usually the number of threads.
+
+    Returns:
+        Int64 array (num_labels, 7) with [min_x, max_x, min_y, max_y, min_z, max_z, count].
+    """
+    nz, ny, nx = scalars.shape
+    num_slabs = max(1, min(num_slabs, nz))
+    slab_size = (nz + num_slabs - 1) // num_slabs
+
+    # One partial table per slab, so the threads never write to shared rows
+    partial = np.empty((num_slabs, num_labels, 7), dtype=np.int64)
+    for s in prange(num_slabs):
+        table = partial[s]
+        for row in range(num_labels):
+            table[row, MIN_X] = nx
+            table[row, MAX_X] = -1
+            table[row, MIN_Y] = ny
+            table[row, MAX_Y] = -1
+            table[row, MIN_Z] = nz
+            table[row, MAX_Z] = -1
+            table[row, COUNT] = 0
+
+        z_begin = s * slab_size
+        z_end = min(z_begin + slab_size, nz)
+        # x innermost matches the C-contiguous layout of the VTK scalars
+        for z in range(z_begin, z_end):
+            for y in range(ny):
+                for x in range(nx):
+                    row = lut[scalars[z, y, x]]
+                    if row < 0:
+                        continue
+                    bounds = table[row]
+                    if x < bounds[MIN_X]:
+                        bounds[MIN_X] = x
+                    if x > bounds[MAX_X]:
+                        bounds[MAX_X] = x
+                    if y < bounds[MIN_Y]:
+                        bounds[MIN_Y] = y
+                    if y > bounds[MAX_Y]:
+                        bounds[MAX_Y] = y
+                    if z < bounds[MIN_Z]:
+                        bounds[MIN_Z] = z
+                    if z > bounds[MAX_Z]:
+                        bounds[MAX_Z] = z
+                    bounds[COUNT] += 1
+
+    # Merge the partial tables
+    merged = partial[0].copy()
+    for s in range(1, num_slabs):
+        for row in range(num_labels):
+            other = partial[s, row]
+            if other[COUNT] == 0:
+                continue
+            bounds = merged[row]
+            bounds[MIN_X] = min(bounds[MIN_X], other[MIN_X])
+            bounds[MAX_X] = max(bounds[MAX_X], other[MAX_X])
+            bounds[MIN_Y] = min(bounds[MIN_Y], other[MIN_Y])
+            bounds[MAX_Y] = max(bounds[MAX_Y], other[MAX_Y])
+            bounds[MIN_Z] = min(bounds[MIN_Z], other[MIN_Z])
+            bounds[MAX_Z] = max(bounds[MAX_Z], other[MAX_Z])
+            bounds[COUNT] += other[COUNT]
+    return merged
+
+
+def build_label_lookup(scalars, background=0):
     """
-    Finds bounding boxes for all labels in a single pass by looping over pixels.
-    
+    Sizes the label table from the actual label range.
+    Small label ranges index the table directly, sparse instance ids are compacted.
+
     Args:
-        scalars: 3D NumPy array of the mask.
-    
+        scalars: 3D NumPy array of the mask ordered (z, y, x).
+        background: Label value that is skipped.
+
     Returns:
-        Dictionary-like structure (array) with bounds for each label.
+        Tuple (labels, lut, scalars): the label value of every table row, the label-to-row
+        lookup and the mask the lookup applies to (remapped only for huge label ids).
     """
-    dims = scalars.shape
-    # Temporary storage: {label: [min_x, max_x, min_y, max_y, min_z, max_z, count]}
-    # Use a large enough array to hold all possible labels (adjust based on data)
-    max_labels = 1000  # Adjust based on your max label value
-    bounds_array = np.full((max_labels, 7), np.inf, dtype=np.float64)
-    bounds_array[:, 1] = -np.inf  # max_x
-    bounds_array[:, 3] = -np.inf  # max_y
-    bounds_array[:, 5] = -np.inf  # max_z
-    bounds_array[:, 6] = 0       # count (to track if label exists)
-
-    # Single pass over all pixels
-    for z in range(dims[2]):
-        for y in range(dims[1]):
-            for x in range(dims[0]):
-                label = int(scalars[x, y, z])
-                if label == 0 or label >= max_labels:
-                    continue  # Skip background or out-of-range labels
-                bounds = bounds_array[label]
-                bounds[0] = min(bounds[0], x)  # min_x
-                bounds[1] = max(bounds[1], x)  # max_x
-                bounds[2] = min(bounds[2], y)  # min_y
-                bounds[3] = max(bounds[3], y)  # max_y
-                bounds[4] = min(bounds[4], z)  # min_z
-                bounds[5] = max(bounds[5], z)  # max_z
-                bounds[6] += 1                  # Increment count
-
-    # Filter and convert to dictionary-like output
-    valid_bounds = []
-    for label in range(max_labels):
-        if bounds_array[label, 6] > 0:  # If label exists (count > 0)
-            valid_bounds.append([
-                label,
-                bounds_array[label, 0],  # min_x
-                bounds_array[label, 1],  # max_x
-                bounds_array[label, 2],  # min_y
-                bounds_array[label, 3],  # max_y
-                bounds_array[label, 4],  # min_z
-                bounds_array[label, 5]   # max_z
-            ])
-
-    return np.array(valid_bounds, dtype=np.float64)
-
-def get_label_bounds_sequential_wrapper(image_data):
+    if scalars.min() < 0:
+        raise ValueError("Label values must be non-negative integers!")
+    max_label = int(scalars.max())
+
+    if max_label < PRESENCE_LABEL_LIMIT:
+        if max_label < DENSE_LABEL_LIMIT:
+            labels = np.arange(max_label + 1, dtype=np.int64)
+        else:
+            labels = np.flatnonzero(mark_present_labels(scalars, max_label)).astype(np.int64)
+        lut = np.full(max_label + 1, -1, dtype=np.int64)
+        lut[labels] = np.arange(len(labels))
+        if background <= max_label:
+            lut[background] = -1  # Background is never reported
+    else:
+        # Huge ids: remap the mask to compact ids so the kernel can keep a flat lookup
+        labels = np.unique(scalars).astype(np.int64)
+        scalars = np.searchsorted(labels, scalars)
+        lut = np.arange(len(labels), dtype=np.int64)
+        lut[labels == background] = -1
+    return labels, lut, scalars
+
+
+def get_label_bounds_wrapper(image_data, return_counts=False):
     """
     Wrapper function to interface with VTK.
-    
+
     Args:
         image_data: vtkImageData representing the mask.
-    
+        return_counts: Also return the voxel count of every label.
+
     Returns:
-        Dictionary of label bounds.
+        Dictionary of label bounds (min_x, max_x, min_y, max_y, min_z, max_z),
+        plus a dictionary of voxel counts if return_counts is set.
     """
-    dims = image_data.GetDimensions()
-    scalars = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
-    scalars = scalars.reshape(dims[2], dims[1], dims[0]).transpose(2, 1, 0)
+    # Zero-copy view in memory order, no transpose
+    scalars = np.asarray(image_to_numpy(image_data))
+    if scalars.dtype.kind == 'f':
+        scalars = scalars.astype(np.int64)
+
+    labels, lut, scalars = build_label_lookup(scalars)
+    bounds_array = find_label_bounds_parallel(scalars, lut, len(labels), get_num_threads())
 
-    bounds_array = find_label_bounds_sequential(scalars)
-    
     # Convert to dictionary
     label_bounds = {}
-    for row in bounds_array:
-        label = int(row[0])
-        label_bounds[label] = (int(row[1]), int(row[2]), int(row[3]), int(row[4]), int(row[5]), int(row[6]))
+    label_counts = {}
+    for label, row in zip(labels, bounds_array):
+        if row[COUNT] == 0:
+            continue
+        label_bounds[int(label)] = tuple(int(v) for v in row[:COUNT])
+        label_counts[int(label)] = int(row[COUNT])
 
+    if return_counts:
+        return label_bounds, label_counts
     return label_bounds
 
 # Example usage
@@ -92,6 +190,6 @@ if __name__ == "__main__":
     reader_mask.Update()
 
     # Get bounds
-    bounds_dict = get_label_bounds_sequential_wrapper(reader_mask.GetOutput())
+    bounds_dict = get_label_bounds_wrapper(reader_mask.GetOutput())
     for label, bounds in bounds_dict.items():
-        print(f"Label {label}: {bounds}")
\ No newline at end of file
+        print(f"Label {label}: {bounds}")
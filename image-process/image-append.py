@@ -1,4 +1,5 @@
 import vtkmodules.all as vtk
+from raw_cache import mhd_producer
 # If the two image have intersection, do not use the class
 # Append image along z-axis
 
@@ -37,10 +38,7 @@ def create_cylinder_actor():
 
 
 def read_mhd(directory):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(directory)
-    reader.Update()
-    return reader
+    return mhd_producer(directory)
 
 path_1 = "data/L1.mhd"
 path_2 = "data/L2.mhd"
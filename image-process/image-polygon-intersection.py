@@ -1,12 +1,10 @@
 import vtkmodules.all as vtk
 import os
+from raw_cache import load_mhd
 
 # Function to read DICOM files from a directory
 def read_mhd(directory):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(directory)
-    reader.Update()
-    return reader.GetOutput()
+    return load_mhd(directory)
 
 def set_volume_properties_default(volume_property):
     # Create transfer functions
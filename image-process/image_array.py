@@ -0,0 +1,185 @@
+import numpy as np
+import vtkmodules.all as vtk
+from vtkmodules.util import numpy_support
+
+'''
+Zero-copy bridge between vtkImageData and NumPy.
+image_to_numpy() views the scalars of an image as a (z, y, x) array, (z, y, x, components)
+for multi-component scalars, that is the memory order of VTK, so no transpose and no copy.
+The view is an ImageArray carrying the spacing, origin and direction of the image, and maps
+voxel indices to world positions and back for whole arrays at once.
+numpy_to_image() goes the other way: the image's scalars point into the array's buffer and
+the image keeps the array alive. Every per-voxel loop over GetScalarComponent /
+SetScalarComponentFromDouble / GetPoint can be written as NumPy on these views.
+'''
+
+class ImageArray(np.ndarray):
+    """
+    NumPy array (z, y, x[, components]) with the geometry of a vtkImageData.
+    Results with the same shape and memory layout (arithmetic, comparisons, copies) keep the
+    geometry; slices, transposes and reductions drop it, their voxels are no longer the image's.
+    """
+
+    def __new__(cls, array, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0), direction=None):
+        view = np.asarray(array).view(cls)
+        view.spacing = np.asarray(spacing, dtype=np.float64)
+        view.origin = np.asarray(origin, dtype=np.float64)
+        view.direction = np.eye(3) if direction is None else np.asarray(direction, dtype=np.float64).reshape(3, 3)
+        return view
+
+    def __array_finalize__(self, obj):
+        # Same shape is not enough, a transposed cube has the shape but not the axes
+        keep = (obj is not None and getattr(obj, "shape", None) == self.shape
+                and [s // obj.itemsize for s in obj.strides] == [s // self.itemsize for s in self.strides])
+        self.spacing = getattr(obj, "spacing", None) if keep else None
+        self.origin = getattr(obj, "origin", None) if keep else None
+        self.direction = getattr(obj, "direction", None) if keep else None
+
+    def drop_geometry(self):
+        self.spacing = self.origin = self.direction = None
+        return self
+
+    # NumPy finalizes a transposed view before swapping its strides, so the axis reorders
+    # are caught here instead of in __array_finalize__
+    def transpose(self, *axes):
+        view = super().transpose(*axes)
+        order = axes[0] if len(axes) == 1 and axes[0] is not None and not isinstance(axes[0], int) else axes
+        if list(order) != list(range(self.ndim)):
+            view.drop_geometry()
+        return view
+
+    def swapaxes(self, axis1, axis2):
+        view = super().swapaxes(axis1, axis2)
+        return view.drop_geometry() if axis1 % self.ndim != axis2 % self.ndim else view
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    @property
+    def dimensions(self):
+        """
+        VTK (x, y, z) dimensions.
+        """
+        return self.shape[2], self.shape[1], self.shape[0]
+
+    def index_to_world(self, indices):
+        """
+        World positions of (..., 3) continuous voxel indices in (x, y, z) order.
+        """
+        indices = np.asarray(indices, dtype=np.float64)
+        return (indices * self.spacing) @ self.direction.T + self.origin
+
+    def world_to_index(self, points):
+        """
+        Continuous (x, y, z) voxel indices of (..., 3) world positions.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        return ((points - self.origin) @ self.direction) / self.spacing
+
+    def world_coordinates(self):
+        """
+        World position of every voxel, (z, y, x, 3) in (x, y, z) order.
+        """
+        z, y, x = np.meshgrid(*(np.arange(n, dtype=np.float64) for n in self.shape[:3]), indexing="ij")
+        return self.index_to_world(np.stack([x, y, z], axis=-1))
+
+
+def image_direction(image_data):
+    matrix = image_data.GetDirectionMatrix()
+    return np.array([[matrix.GetElement(i, j) for j in range(3)] for i in range(3)])
+
+
+def image_to_numpy(image_data, array_name=None):
+    """
+    Views the scalars of a vtkImageData as an ImageArray without copying.
+
+    Args:
+        image_data: vtkImageData.
+        array_name: Point data array to view, the active scalars if None.
+
+    Returns:
+        ImageArray (z, y, x) or (z, y, x, components), sharing memory with the VTK array.
+        Writes to it change the image, call image_data.Modified() afterwards.
+        Its origin is the world position of the first voxel, so an extent that does not start
+        at 0 (vtkExtractVOI output) is folded into it.
+    """
+    point_data = image_data.GetPointData()
+    vtk_array = point_data.GetScalars() if array_name is None else point_data.GetArray(array_name)
+    if vtk_array is None:
+        raise ValueError("Image has no scalars!")
+    dims = image_data.GetDimensions()
+    shape = (dims[2], dims[1], dims[0])
+    if vtk_array.GetNumberOfComponents() > 1:
+        shape += (vtk_array.GetNumberOfComponents(),)
+    # vtk_to_numpy views the buffer and keeps the VTK array referenced
+    scalars = numpy_support.vtk_to_numpy(vtk_array).reshape(shape)
+    direction = image_direction(image_data)
+    extent = image_data.GetExtent()
+    origin = np.array(image_data.GetOrigin()) + direction @ (np.array(extent[::2]) * np.array(image_data.GetSpacing()))
+    return ImageArray(scalars, image_data.GetSpacing(), origin, direction)
+
+
+def numpy_to_image(array, spacing=None, origin=None, direction=None, name=None):
+    """
+    Wraps a (z, y, x) or (z, y, x, components) array as vtkImageData without copying.
+    Non-contiguous arrays are copied once, boolean arrays are viewed as uint8.
+
+    Args:
+        array: NumPy array, an ImageArray brings its own geometry.
+        spacing, origin: Image geometry, taken from an ImageArray or (1, 1, 1) / (0, 0, 0) if None.
+        direction: 3x3 direction matrix, identity if None.
+        name: Name of the scalar array.
+
+    Returns:
+        vtkImageData sharing memory with the array, which it keeps referenced.
+    """
+    if spacing is None:
+        spacing = getattr(array, "spacing", None)
+    if origin is None:
+        origin = getattr(array, "origin", None)
+    if direction is None:
+        direction = getattr(array, "direction", None)
+    array = np.ascontiguousarray(np.asarray(array))
+    if array.dtype == np.bool_:
+        array = array.view(np.uint8)
+    if array.ndim not in (3, 4):
+        raise ValueError("Expected a (z, y, x) or (z, y, x, components) array!")
+    components = array.shape[3] if array.ndim == 4 else 1
+
+    image = vtk.vtkImageData()
+    image.SetDimensions(array.shape[2], array.shape[1], array.shape[0])
+    image.SetSpacing(*(spacing if spacing is not None else (1.0, 1.0, 1.0)))
+    image.SetOrigin(*(origin if origin is not None else (0.0, 0.0, 0.0)))
+    if direction is not None:
+        image.SetDirectionMatrix(*np.asarray(direction, dtype=np.float64).ravel())
+    scalars = numpy_support.numpy_to_vtk(array.reshape(-1, components) if components > 1 else array.reshape(-1), deep=False)
+    if name is not None:
+        scalars.SetName(name)
+    image.GetPointData().SetScalars(scalars)
+    # numpy_to_vtk does not own the buffer, keep the array referenced
+    image._numpy_reference = array
+    return image
+
+
+if __name__ == "__main__":
+    import time
+
+    reader = vtk.vtkMetaImageReader()
+    reader.SetFileName("data/L1.mhd")
+    reader.Update()
+    image_data = reader.GetOutput()
+
+    start_time = time.time()
+    volume = image_to_numpy(image_data)
+    print("view %s %s --- %s seconds ---" % (volume.shape, volume.dtype, time.time() - start_time))
+    x, y, z = 10, 20, 30
+    print("same voxel:", volume[z, y, x] == image_data.GetScalarComponentAsDouble(x, y, z, 0))
+    print("same memory:", np.shares_memory(volume, numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())))
+    physical = [0.0, 0.0, 0.0]
+    image_data.TransformIndexToPhysicalPoint(x, y, z, physical)
+    print("voxel (10, 20, 30) at", volume.index_to_world([x, y, z]), physical)
+
+    start_time = time.time()
+    bone = numpy_to_image(volume > 300)
+    print("wrap mask --- %s seconds ---, origin %s" % (time.time() - start_time, bone.GetOrigin()))
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import vtkmodules.all as vtk
+from label_statistics import compute_label_statistics, group_voxels_by_label, mask_to_numpy
+
+'''
+Persistent label index stored next to a multi-label mask (<mask>.labelindex.npz).
+It holds the label list, per-label extents, voxel counts, centroids and optionally
+run-length encoded voxel lists, so later runs do not decompress and rescan the mask.
+The index is keyed by size, mtime and SHA-256 of the mask file(s). If size or mtime
+change, the hash decides whether the mask really changed and the index is rebuilt.
+'''
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".labelindex.npz"
+
+# Read once at import, os.umask() can only be queried by setting it
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+def read_mask(mask_file):
+    """
+    Reads a NIfTI or MetaImage mask.
+    """
+    if mask_file.endswith(".mhd") or mask_file.endswith(".mha"):
+        reader = vtk.vtkMetaImageReader()
+    else:
+        reader = vtk.vtkNIFTIImageReader()
+    reader.SetFileName(mask_file)
+    reader.Update()
+    return reader.GetOutput()
+
+
+def source_files(mask_file):
+    """
+    Files the mask content depends on: the mask itself, plus the data file of a .mhd header.
+    """
+    files = [mask_file]
+    if mask_file.endswith(".mhd"):
+        with open(mask_file, "r", errors="ignore") as header:
+            for line in header:
+                key, _, value = line.partition("=")
+                if key.strip() == "ElementDataFile" and value.strip() != "LOCAL":
+                    files.append(os.path.join(os.path.dirname(mask_file), value.strip()))
+    return files
+
+
+def file_stamps(files):
+    return [[os.path.getsize(f), os.stat(f).st_mtime_ns] for f in files]
+
+
+def file_hash(files, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    for f in files:
+        with open(f, "rb") as stream:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def encode_runs(indices):
+    """
+    Run-length encodes sorted flat voxel indices.
+
+    Returns:
+        Tuple (starts, lengths) of the runs of consecutive indices.
+    """
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    starts = indices[np.r_[0, breaks]]
+    lengths = np.diff(np.r_[0, breaks, len(indices)])
+    return starts, lengths
+
+
+def expand_runs(starts, lengths):
+    """
+    Expands (starts, lengths) runs back to sorted flat voxel indices.
+    """
+    offsets = np.repeat(starts - np.cumsum(np.r_[0, lengths[:-1]]), lengths)
+    return offsets + np.arange(int(lengths.sum()))
+
+
+def index_path(mask_file):
+    return mask_file + INDEX_SUFFIX
+
+
+def write_index(path, arrays):
+    # Write to a unique temporary file first, readers never see a half-written index and
+    # processes rebuilding the same index at once do not write into each other's file
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp.npz", delete=False) as temporary:
+        try:
+            np.savez(temporary, **arrays)
+        except BaseException:
+            temporary.close()
+            os.remove(temporary.name)
+            raise
+    publish_file(temporary.name, path)
+
+
+def publish_file(temporary, path):
+    """
+    Moves a finished temporary file onto path with the permissions open() would have given it.
+    NamedTemporaryFile creates files readable by the owner only and os.replace() keeps the mode.
+    """
+    try:
+        os.chmod(temporary, 0o666 & ~UMASK)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def build_label_index(mask_file, mask_data=None, with_runs=False):
+    """
+    Scans the mask and writes the sidecar index.
+
+    Args:
+        mask_file: Path of the mask.
+        mask_data: Already loaded vtkImageData of the mask, read from mask_file if None.
+        with_runs: Also store run-length encoded voxel lists.
+
+    Returns:
+        Label index dictionary, see load_label_index.
+    """
+    files = source_files(mask_file)
+    stamps = file_stamps(files)
+    digest = file_hash(files)
+    if mask_data is None:
+        mask_data = read_mask(mask_file)
+
+    mask = mask_to_numpy(mask_data)
+    statistics = compute_label_statistics(mask)
+    labels = np.array(sorted(statistics), dtype=np.int64)
+    arrays = {
+        "labels": labels,
+        "bounds": np.array([statistics[l]["bounds"] for l in labels], dtype=np.int64).reshape(-1, 6),
+        "counts": np.array([statistics[l]["count"] for l in labels], dtype=np.int64),
+        "centroids": np.array([statistics[l]["centroid"] for l in labels], dtype=np.float64).reshape(-1, 3),
+    }
+
+    runs = None
+    if with_runs:
+        runs = {}
+        run_starts, run_lengths, run_offsets = [], [], [0]
+        for label, indices in group_voxels_by_label(mask).items():
+            starts, lengths = encode_runs(indices)
+            runs[label] = (starts, lengths)
+        for label in labels:
+            starts, lengths = runs[int(label)]
+            run_starts.append(starts)
+            run_lengths.append(lengths)
+            run_offsets.append(run_offsets[-1] + len(starts))
+        arrays["run_starts"] = np.concatenate(run_starts) if run_starts else np.zeros(0, np.int64)
+        arrays["run_lengths"] = np.concatenate(run_lengths) if run_lengths else np.zeros(0, np.int64)
+        arrays["run_offsets"] = np.array(run_offsets, dtype=np.int64)
+
+    meta = {
+        "version": INDEX_VERSION,
+        "files": [os.path.basename(f) for f in files],
+        "stamps": stamps,
+        "sha256": digest,
+        "dims": list(mask_data.GetDimensions()),
+    }
+    arrays["meta"] = np.array(json.dumps(meta))
+
+    write_index(index_path(mask_file), arrays)
+
+    return {"labels": [int(l) for l in labels], "statistics": statistics, "runs": runs, "dims": tuple(meta["dims"])}
+
+
+def load_label_index(mask_file, mask_data=None, with_runs=False):
+    """
+    Loads the sidecar index of a mask, rebuilding it when missing or stale.
+
+    Args:
+        mask_file: Path of the mask.
+        mask_data: Already loaded vtkImageData of the mask, only used when rebuilding.
+        with_runs: Require run-length encoded voxel lists.
+
+    Returns:
+        Dictionary {"labels": [label], "statistics": {label: {"bounds", "count", "centroid"}},
+                    "runs": {label: (starts, lengths)} or None, "dims": (x, y, z)}.
+    """
+    path = index_path(mask_file)
+    if not os.path.exists(path):
+        return build_label_index(mask_file, mask_data, with_runs)
+
+    try:
+        with np.load(path, allow_pickle=False) as index:
+            meta = json.loads(str(index["meta"]))
+            files = source_files(mask_file)
+            stale = meta.get("version") != INDEX_VERSION or (with_runs and "run_starts" not in index)
+            touched = not stale and file_stamps(files) != meta["stamps"]
+            if touched:
+                # Touched but maybe unchanged, the hash decides
+                stale = file_hash(files) != meta["sha256"]
+            if stale:
+                return build_label_index(mask_file, mask_data, with_runs)
+            arrays = {key: index[key] for key in index.files}
+    except (OSError, ValueError, KeyError):
+        return build_label_index(mask_file, mask_data, with_runs)
+
+    if touched:
+        # Same content, refresh the stamps so the next load skips hashing
+        meta["stamps"] = file_stamps(files)
+        arrays["meta"] = np.array(json.dumps(meta))
+        write_index(path, arrays)
+
+    labels = [int(l) for l in arrays["labels"]]
+    statistics = {}
+    for i, label in enumerate(labels):
+        statistics[label] = {
+            "bounds": tuple(int(v) for v in arrays["bounds"][i]),
+            "count": int(arrays["counts"][i]),
+            "centroid": tuple(float(v) for v in arrays["centroids"][i]),
+        }
+
+    runs = None
+    if "run_starts" in arrays:
+        offsets = arrays["run_offsets"]
+        runs = {label: (arrays["run_starts"][offsets[i]:offsets[i + 1]],
+                        arrays["run_lengths"][offsets[i]:offsets[i + 1]])
+                for i, label in enumerate(labels)}
+    return {"labels": labels, "statistics": statistics, "runs": runs, "dims": tuple(meta["dims"])}
+
+
+if __name__ == "__main__":
+    index = load_label_index("data/liver_57_multilabel.nii.gz", with_runs=True)
+    for label in index["labels"]:
+        stats = index["statistics"][label]
+        print(f"Label {label}: bounds {stats['bounds']}, count {stats['count']}, runs {len(index['runs'][label][0])}")
@@ -0,0 +1,119 @@
+import numpy as np
+import vtkmodules.all as vtk
+from vtkmodules.util import numpy_support
+from distinct_colors import distinct_colors
+
+'''
+Single-pass label-to-RGBA compositor for multi-label overlays.
+The label slice indexes an RGBA table built from distinct_colors, the intensity slice shades it,
+and the result is written in place into one RGBA vtkImageData.
+A whole multi-label overlay is one actor and one texture upload per slice.
+'''
+
+class LabelCompositor:
+    def __init__(self, num_labels=None, colors=distinct_colors, opacity=1.0, intensity_range=None):
+        """
+        Args:
+            num_labels: Highest label that gets a color, defaults to the size of the color table.
+            colors: RGB colors of labels 1..num_labels, reused cyclically if shorter.
+            opacity: Default opacity of every label.
+            intensity_range: (low, high) intensities mapped to dark..full color, None disables shading.
+        """
+        if num_labels is None:
+            num_labels = len(colors)
+        self.num_labels = num_labels
+        self.intensity_range = intensity_range
+
+        # Row 0 is the transparent background
+        self.colors = np.zeros((num_labels + 1, 3), dtype=np.float32)
+        for label in range(1, num_labels + 1):
+            self.colors[label] = colors[(label - 1) % len(colors)]
+        self.opacity = np.full(num_labels + 1, opacity, dtype=np.float32)
+        self.opacity[0] = 0.0
+        self.visible = np.ones(num_labels + 1, dtype=bool)
+        self.visible[0] = False
+
+        self.table = None
+        self.output = vtk.vtkImageData()
+        self.rebuild_table()
+
+    def rebuild_table(self):
+        # Hidden and out-of-table labels share the transparent last row
+        table = np.zeros((self.num_labels + 2, 4), dtype=np.float32)
+        table[:-1, :3] = self.colors * 255.0
+        table[:-1, 3] = np.where(self.visible, self.opacity, 0.0) * 255.0
+        self.table = table
+
+    def set_label_visibility(self, label, visible):
+        self.visible[label] = visible
+        self.rebuild_table()
+
+    def set_label_opacity(self, label, opacity):
+        self.opacity[label] = opacity
+        self.rebuild_table()
+
+    def set_visible_labels(self, labels):
+        self.visible[:] = False
+        self.visible[[label for label in labels if 0 < label <= self.num_labels]] = True
+        self.rebuild_table()
+
+    def composite_array(self, label_slice, intensity_slice=None, out=None):
+        """
+        Maps a label slice (and optional intensity slice) to RGBA in one vectorized pass.
+
+        Args:
+            label_slice: Integer NumPy array of labels.
+            intensity_slice: NumPy array of intensities with the same shape, shades the label colors.
+            out: Optional uint8 array of shape label_slice.shape + (4,) to write into.
+
+        Returns:
+            uint8 RGBA array.
+        """
+        rows = label_slice.astype(np.intp, copy=False)
+        rows = np.where((rows < 0) | (rows > self.num_labels), self.num_labels + 1, rows)
+        rgba = self.table[rows]
+        if intensity_slice is not None and self.intensity_range is not None:
+            low, high = self.intensity_range
+            shade = np.clip((intensity_slice - low) / max(high - low, 1e-6), 0.0, 1.0)
+            rgba[..., :3] *= shade[..., None]
+        if out is None:
+            out = np.empty(rgba.shape, dtype=np.uint8)
+        np.copyto(out, rgba, casting="unsafe")
+        return out
+
+    def composite(self, label_image, intensity_image=None):
+        """
+        Composites VTK slices into the shared RGBA output image, updated in place.
+
+        Args:
+            label_image: vtkImageData of the resliced mask.
+            intensity_image: vtkImageData of the resliced image with the same structure, or None.
+
+        Returns:
+            The RGBA vtkImageData, feed it to a single vtkImageActor.
+        """
+        if (self.output.GetExtent() != label_image.GetExtent() or
+                self.output.GetPointData().GetScalars() is None):
+            self.output.CopyStructure(label_image)
+            self.output.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 4)
+        else:
+            self.output.SetOrigin(label_image.GetOrigin())
+            self.output.SetSpacing(label_image.GetSpacing())
+
+        labels = numpy_support.vtk_to_numpy(label_image.GetPointData().GetScalars())
+        intensities = None
+        if intensity_image is not None:
+            intensities = numpy_support.vtk_to_numpy(intensity_image.GetPointData().GetScalars())
+        out = numpy_support.vtk_to_numpy(self.output.GetPointData().GetScalars())
+        self.composite_array(labels, intensities, out=out)
+        self.output.Modified()
+        return self.output
+
+
+if __name__ == "__main__":
+    compositor = LabelCompositor(intensity_range=(-200, 300))
+    compositor.set_label_opacity(2, 0.5)
+    compositor.set_label_visibility(3, False)
+    labels = np.array([[0, 1, 2], [3, 40, 1]])
+    intensities = np.array([[0, 300, 300], [300, 300, 50]], dtype=np.float32)
+    print(compositor.composite_array(labels, intensities))
@@ -0,0 +1,181 @@
+import numpy as np
+import vtkmodules.all as vtk
+from image_array import image_to_numpy
+
+'''
+Per-label statistics (extent, voxel count, centroid) for multi-label masks.
+The mask scalars are wrapped as a zero-copy NumPy view and scanned slab by slab.
+Each slab is reduced with one bincount per axis, so there is no per-voxel Python loop.
+'''
+
+def mask_to_numpy(image_data):
+    """
+    Wraps the scalars of a vtkImageData as a NumPy array without copying.
+
+    Args:
+        image_data: vtkImageData with a single-component scalar array.
+
+    Returns:
+        NumPy view of shape (z, y, x), sharing memory with the VTK array.
+    """
+    return np.asarray(image_to_numpy(image_data))
+
+
+def compute_label_statistics(mask, slab_size=16, background=0, max_dense_labels=4096):
+    """
+    Computes extent, voxel count and centroid for every label in a single pass.
+
+    Args:
+        mask: vtkImageData or 3D NumPy array ordered (z, y, x).
+        slab_size: Number of z slices reduced at once, bounds the temporary memory.
+        background: Label value that is skipped.
+        max_dense_labels: Above this label value the ids are compacted before the scan.
+
+    Returns:
+        Dictionary {label: {"bounds": (min_x, max_x, min_y, max_y, min_z, max_z),
+                            "count": int, "centroid": (x, y, z)}} in voxel index space.
+    """
+    if isinstance(mask, vtk.vtkImageData):
+        mask = mask_to_numpy(mask)
+    nz, ny, nx = mask.shape
+    if mask.size == 0:
+        return {}
+    if mask.min() < 0:
+        raise ValueError("Label values must be non-negative integers!")
+
+    # Dense tables for small label ranges; compact sparse (instance) ids so the
+    # per-axis tables only hold labels that actually occur
+    max_label = int(mask.max())
+    if max_label < max_dense_labels:
+        present = np.arange(max_label + 1)
+        to_rows = lambda slab: slab
+    elif max_label < 1 << 26:
+        occurrences = np.zeros(max_label + 1, dtype=np.int64)
+        for z0 in range(0, nz, slab_size):
+            slab = mask[z0:z0 + slab_size].astype(np.intp, copy=False)
+            occurrences += np.bincount(slab.ravel(), minlength=max_label + 1)
+        present = np.flatnonzero(occurrences)
+        lut = np.zeros(max_label + 1, dtype=np.intp)
+        lut[present] = np.arange(len(present))
+        to_rows = lambda slab: lut[slab]
+    else:
+        # Ids too large for a lookup table, map them by binary search
+        present = np.unique(mask)
+        to_rows = lambda slab: np.searchsorted(present, slab)
+    num_labels = len(present)
+
+    hist_x = np.zeros((nx, num_labels), dtype=np.int64)
+    hist_y = np.zeros((ny, num_labels), dtype=np.int64)
+    hist_z = np.zeros((nz, num_labels), dtype=np.int64)
+    y_index = np.arange(ny, dtype=np.intp)[None, :, None] * num_labels
+    x_index = np.arange(nx, dtype=np.intp)[None, None, :] * num_labels
+
+    for z0 in range(0, nz, slab_size):
+        slab = to_rows(mask[z0:z0 + slab_size].astype(np.intp, copy=False))
+        dz = slab.shape[0]
+        z_index = np.arange(dz, dtype=np.intp)[:, None, None] * num_labels
+        hist_z[z0:z0 + dz] += np.bincount((slab + z_index).ravel(), minlength=dz * num_labels).reshape(dz, num_labels)
+        hist_y += np.bincount((slab + y_index).ravel(), minlength=ny * num_labels).reshape(ny, num_labels)
+        hist_x += np.bincount((slab + x_index).ravel(), minlength=nx * num_labels).reshape(nx, num_labels)
+
+    counts = hist_z.sum(axis=0)
+    statistics = {}
+    axis_stats = []
+    for hist in (hist_x, hist_y, hist_z):
+        occupied = hist > 0
+        first = occupied.argmax(axis=0)
+        last = hist.shape[0] - 1 - occupied[::-1].argmax(axis=0)
+        weighted = np.arange(hist.shape[0], dtype=np.float64) @ hist
+        axis_stats.append((first, last, weighted / np.maximum(counts, 1)))
+
+    for i, label in enumerate(present):
+        label = int(label)
+        if label == background or counts[i] == 0:
+            continue
+        (x0, x1, cx), (y0, y1, cy), (z0, z1, cz) = [(s[0][i], s[1][i], s[2][i]) for s in axis_stats]
+        statistics[label] = {
+            "bounds": (int(x0), int(x1), int(y0), int(y1), int(z0), int(z1)),
+            "count": int(counts[i]),
+            "centroid": (float(cx), float(cy), float(cz)),
+        }
+    return statistics
+
+
+def find_label_bounds(mask, background=0):
+    """
+    Finds bounding boxes for all labels, the bounds-only view of compute_label_statistics.
+
+    Args:
+        mask: vtkImageData or 3D NumPy array ordered (z, y, x).
+
+    Returns:
+        Dictionary of label bounds (min_x, max_x, min_y, max_y, min_z, max_z) in voxel index space.
+    """
+    statistics = compute_label_statistics(mask, background=background)
+    return {label: stats["bounds"] for label, stats in statistics.items()}
+
+
+def estimate_label_statistics(pyramid, max_voxels=1 << 24, background=0):
+    """
+    Approximate label statistics from the finest level of a label VolumePyramid
+    with at most max_voxels voxels, mapped back to full-resolution voxel indices.
+
+    Args:
+        pyramid: VolumePyramid built with labels=True.
+        max_voxels: Voxel budget of the scanned level.
+        background: Label value that is skipped.
+
+    Returns:
+        Dictionary like compute_label_statistics, counts and bounds are accurate to one block.
+    """
+    factor = pyramid.factor_for_voxels(max_voxels)
+    statistics = compute_label_statistics(pyramid.arrays[factor], background=background)
+    if factor == 1:
+        return statistics
+    nz, ny, nx = pyramid.arrays[1].shape
+    limits = (nx - 1, ny - 1, nz - 1)
+    for stats in statistics.values():
+        bounds = stats["bounds"]
+        stats["bounds"] = tuple(bounds[i] * factor if i % 2 == 0 else min((bounds[i] + 1) * factor - 1, limits[i // 2])
+                                for i in range(6))
+        stats["count"] = stats["count"] * factor ** 3
+        # A level voxel covers factor source voxels, its index maps to the block center
+        stats["centroid"] = tuple(c * factor + (factor - 1) / 2 for c in stats["centroid"])
+    return statistics
+
+
+def group_voxels_by_label(mask, background=0):
+    """
+    Groups the flat voxel indices of every label with one sort over the foreground.
+
+    Args:
+        mask: vtkImageData or 3D NumPy array ordered (z, y, x).
+        background: Label value that is skipped.
+
+    Returns:
+        Dictionary {label: sorted flat voxel indices into the (z, y, x) array}.
+    """
+    if isinstance(mask, vtk.vtkImageData):
+        mask = mask_to_numpy(mask)
+    flat = mask.ravel()
+    foreground = np.flatnonzero(flat != background)
+    labels = flat[foreground]
+    if len(labels) == 0:
+        return {}
+    order = np.argsort(labels, kind="stable")
+    labels = labels[order]
+    foreground = foreground[order]
+
+    # Label runs in the sorted order, each run keeps ascending voxel order
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:], len(labels)]
+    return {int(labels[s]): foreground[s:e] for s, e in zip(starts, ends)}
+
+
+if __name__ == "__main__":
+    reader_mask = vtk.vtkNIFTIImageReader()
+    reader_mask.SetFileName("data/liver_57_multilabel.nii.gz")
+    reader_mask.Update()
+
+    for label, stats in compute_label_statistics(reader_mask.GetOutput()).items():
+        print(f"Label {label}: bounds {stats['bounds']}, count {stats['count']}, centroid {stats['centroid']}")
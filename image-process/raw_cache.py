@@ -0,0 +1,256 @@
+import json
+import os
+import tempfile
+import zlib
+import numpy as np
+import vtkmodules.all as vtk
+from image_array import image_to_numpy, numpy_to_image
+from label_index import source_files, file_stamps, file_hash, publish_file
+
+'''
+Memory-mapped raw cache for MetaImage volumes (.mhd + .zraw).
+vtkMetaImageReader inflates the whole .zraw into RAM on every open. convert_mhd() inflates it
+once, in a stream, into <file>.mhd.rawcache.npy next to the header; load_mhd() memory-maps that
+file read-only and wraps the pages as vtkImageData without copying. A second open costs a header
+parse, and several viewer processes share the same page cache pages.
+Uncompressed data files need no cache, they are mapped directly at their data offset.
+The cache is keyed by size, mtime and SHA-256 of the header and data file, like the label index.
+'''
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".rawcache.npy"
+META_SUFFIX = ".rawcache.json"
+
+# MetaIO element types with a fixed size, MET_LONG depends on the writer's platform
+ELEMENT_TYPES = {
+    "MET_CHAR": "i1", "MET_UCHAR": "u1", "MET_SHORT": "i2", "MET_USHORT": "u2",
+    "MET_INT": "i4", "MET_UINT": "u4", "MET_LONG_LONG": "i8", "MET_ULONG_LONG": "u8",
+    "MET_FLOAT": "f4", "MET_DOUBLE": "f8",
+}
+
+
+def read_header(mhd_file):
+    """
+    Fields of a MetaImage header as strings, up to ElementDataFile (the last header field).
+
+    Returns:
+        Tuple (fields, header size in bytes).
+    """
+    fields = {}
+    size = 0
+    with open(mhd_file, "rb") as header:
+        for line in header:
+            size += len(line)
+            key, _, value = line.decode("latin-1").partition("=")
+            fields[key.strip()] = value.strip()
+            if key.strip() == "ElementDataFile":
+                break
+    return fields, size
+
+
+def header_layout(mhd_file):
+    """
+    Shape, dtype and geometry of a MetaImage file, None if the cache does not support it
+    (file lists, 2D/4D images, platform-sized types, explicit header sizes).
+    """
+    fields, header_size = read_header(mhd_file)
+    data_file = fields.get("ElementDataFile", "")
+    element_type = ELEMENT_TYPES.get(fields.get("ElementType"))
+    if (element_type is None or int(fields.get("NDims", 0)) != 3 or data_file.startswith("LIST")
+            or "%" in data_file or fields.get("HeaderSize", "0") not in ("0", "")):
+        return None
+
+    dims = [int(v) for v in fields["DimSize"].split()]
+    channels = int(fields.get("ElementNumberOfChannels", 1))
+    shape = (dims[2], dims[1], dims[0]) + ((channels,) if channels > 1 else ())
+    spacing = [float(v) for v in fields.get("ElementSpacing", fields.get("ElementSize", "1 1 1")).split()]
+    origin = [float(v) for v in fields.get("Offset", fields.get("Position", fields.get("Origin", "0 0 0"))).split()]
+    matrix = fields.get("TransformMatrix", fields.get("Rotation", fields.get("Orientation", "1 0 0 0 1 0 0 0 1")))
+    msb = fields.get("BinaryDataByteOrderMSB", fields.get("ElementByteOrderMSB", "False")).lower() == "true"
+    local = data_file == "LOCAL"
+    return {
+        "shape": shape,
+        "dtype": np.dtype(element_type).newbyteorder(">" if msb else "<").str,
+        "spacing": spacing,
+        "origin": origin,
+        "direction": [float(v) for v in matrix.split()],
+        "compressed": fields.get("CompressedData", "False").lower() == "true",
+        "data_file": mhd_file if local else os.path.join(os.path.dirname(mhd_file), data_file),
+        "offset": header_size if local else 0,
+    }
+
+
+def cache_paths(mhd_file):
+    return mhd_file + CACHE_SUFFIX, mhd_file + META_SUFFIX
+
+
+def decode_to_file(layout, path, chunk_size=1 << 22):
+    """
+    Streams the data file into a .npy file in native byte order, at most chunk_size file bytes at a time.
+    Compressed data is inflated, uncompressed data (here only if byte-swapped) is copied.
+    """
+    dtype = np.dtype(layout["dtype"])
+    array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype.newbyteorder("="), shape=tuple(layout["shape"]))
+    flat = array.reshape(-1).view(np.uint8)
+    position = 0
+    inflater = zlib.decompressobj() if layout["compressed"] else None
+    with open(layout["data_file"], "rb") as stream:
+        stream.seek(layout["offset"])
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            pending = chunk
+            while pending and position < len(flat):
+                if inflater is None:
+                    data, pending = pending[:len(flat) - position], b""
+                else:
+                    data = inflater.decompress(pending, len(flat) - position)
+                    pending = inflater.unconsumed_tail
+                flat[position:position + len(data)] = np.frombuffer(data, dtype=np.uint8)
+                position += len(data)
+            if position >= len(flat):
+                break
+    if position != len(flat):
+        raise ValueError("Data file is shorter than the image: " + layout["data_file"])
+    if not dtype.isnative:
+        # Swap slab by slab, the file keeps native order
+        for z in range(array.shape[0]):
+            array[z].byteswap(inplace=True)
+    array.flush()
+    del array
+
+
+def convert_mhd(mhd_file):
+    """
+    Builds the raw cache of a MetaImage file: decodes the data once into <file>.mhd.rawcache.npy.
+    Headers the stream decoder does not support are read with vtkMetaImageReader.
+
+    Returns:
+        Path of the cache file.
+    """
+    path, meta_path = cache_paths(mhd_file)
+    files = source_files(mhd_file)
+    layout = header_layout(mhd_file)
+    # A unique temporary file, processes converting the same header at once do not collide.
+    # It is only reserved here, the decoder and np.save() write it by name
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp.npy", delete=False) as temporary:
+        pass
+    try:
+        if layout is not None:
+            decode_to_file(layout, temporary.name)
+            geometry = {key: layout[key] for key in ("spacing", "origin", "direction")}
+        else:
+            reader = vtk.vtkMetaImageReader()
+            reader.SetFileName(mhd_file)
+            reader.Update()
+            array = image_to_numpy(reader.GetOutput())
+            np.save(temporary.name, np.asarray(array))
+            geometry = {"spacing": array.spacing.tolist(), "origin": array.origin.tolist(),
+                        "direction": array.direction.ravel().tolist()}
+    except BaseException:
+        os.remove(temporary.name)
+        raise
+    publish_file(temporary.name, path)
+
+    meta = {"version": CACHE_VERSION, "stamps": file_stamps(files), "sha256": file_hash(files), **geometry}
+    write_meta(meta_path, meta)
+    return path
+
+
+def write_meta(meta_path, meta):
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(meta_path)), suffix=".tmp",
+                                     delete=False) as meta_file:
+        try:
+            json.dump(meta, meta_file)
+        except BaseException:
+            meta_file.close()
+            os.remove(meta_file.name)
+            raise
+    publish_file(meta_file.name, meta_path)
+
+
+def cached_meta(mhd_file):
+    """
+    Metadata of a valid cache, None when the cache is missing or stale.
+    """
+    path, meta_path = cache_paths(mhd_file)
+    if not (os.path.exists(path) and os.path.exists(meta_path)):
+        return None
+    try:
+        with open(meta_path, "r") as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+    files = source_files(mhd_file)
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    if file_stamps(files) != meta["stamps"]:
+        # Touched but maybe unchanged, the hash decides
+        if file_hash(files) != meta["sha256"]:
+            return None
+        meta["stamps"] = file_stamps(files)
+        write_meta(meta_path, meta)
+    return meta
+
+
+def load_mhd(mhd_file, build=True):
+    """
+    Opens a MetaImage file as vtkImageData backed by a read-only memory map.
+    Compressed data goes through the raw cache, built on first use; uncompressed data is mapped in place.
+    The image shares the mapped pages, filters read it as usual but must not write into its scalars.
+
+    Args:
+        mhd_file: .mhd header.
+        build: Build a missing or stale cache, otherwise fall back to vtkMetaImageReader.
+
+    Returns:
+        vtkImageData.
+    """
+    layout = header_layout(mhd_file)
+    if layout is not None and not layout["compressed"]:
+        dtype = np.dtype(layout["dtype"])
+        if dtype.isnative:
+            array = np.memmap(layout["data_file"], dtype=dtype, mode="r", offset=layout["offset"], shape=tuple(layout["shape"]))
+            return numpy_to_image(array, layout["spacing"], layout["origin"], layout["direction"], name="MetaImage")
+
+    meta = cached_meta(mhd_file)
+    if meta is None and build:
+        convert_mhd(mhd_file)
+        meta = cached_meta(mhd_file)
+    if meta is None:
+        reader = vtk.vtkMetaImageReader()
+        reader.SetFileName(mhd_file)
+        reader.Update()
+        return reader.GetOutput()
+    array = np.load(cache_paths(mhd_file)[0], mmap_mode="r")
+    return numpy_to_image(array, meta["spacing"], meta["origin"], meta["direction"], name="MetaImage")
+
+
+def mhd_producer(mhd_file):
+    """
+    load_mhd() behind a vtkTrivialProducer, a drop-in for a vtkMetaImageReader:
+    GetOutput() and GetOutputPort() work as on the reader.
+    """
+    producer = vtk.vtkTrivialProducer()
+    producer.SetOutput(load_mhd(mhd_file))
+    return producer
+
+
+if __name__ == "__main__":
+    import time
+
+    for mhd_file in ["data/L1.mhd", "data/L2.mhd", "data/decompressionvolume.mhd"]:
+        start_time = time.time()
+        reader = vtk.vtkMetaImageReader()
+        reader.SetFileName(mhd_file)
+        reader.Update()
+        reader_time = time.time() - start_time
+
+        start_time = time.time()
+        image = load_mhd(mhd_file)
+        first_time = time.time() - start_time
+        start_time = time.time()
+        image = load_mhd(mhd_file)
+        second_time = time.time() - start_time
+        same = np.array_equal(image_to_numpy(image), image_to_numpy(reader.GetOutput())) \
+            and image.GetOrigin() == reader.GetOutput().GetOrigin() and image.GetSpacing() == reader.GetOutput().GetSpacing()
+        print(f"{mhd_file}: vtkMetaImageReader {reader_time:.4f} s, first open {first_time:.4f} s, "
+              f"second open {second_time:.4f} s, same image: {same}")
@@ -1,55 +1,224 @@
 import vtk
 import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+from image_array import image_to_numpy, numpy_to_image
+from label_index import load_label_index
+from chunked_volume import ChunkedVolume, open_volume
 
 '''
 This script demonstrates how to extract and save a volume of interest (VOI) for each label in a mask.
-First, segment the original image using a multi-label mask.
-Second, extract the VOI for each segmented label to reduce the image size.
+First, extract the VOI of each label from the original image and the mask.
+Second, segment the label inside the VOI, so a small organ costs only its own box.
 The VOI is saved as a separate MHD file for each label.
+With num_workers > 1 the labels are exported by a process pool. The decoded image and mask
+are placed in shared memory once, the workers wrap them as vtkImageData without copying.
+With chunked=True image and mask are read from their chunked stores (chunked_volume.py):
+each label decodes only the chunks its VOI crosses, the full volumes are never decompressed,
+and the workers open the stores themselves instead of sharing memory.
 '''
 
-def find_label_bounds_vtk_sequential(image_data):
+def export_label_voi(image_data, mask_data, label, voi_extent, output_dir, masked_value):
     """
-    Finds bounding boxes for all labels in a single pass using VTK.
-    
+    Segment one label and save its VOI as MHD.
+    """
+    # Crop image and mask to the label's extent first,
+    # so thresholding and masking only touch the label's box
+    extract_voi = vtk.vtkExtractVOI()
+    extract_voi.SetInputData(image_data)
+    extract_voi.SetVOI(voi_extent)
+
+    extract_mask = vtk.vtkExtractVOI()
+    extract_mask.SetInputData(mask_data)
+    extract_mask.SetVOI(voi_extent)
+    return write_label_voi(extract_voi.GetOutputPort(), extract_mask.GetOutputPort(), label, output_dir, masked_value)
+
+
+def export_label_voi_chunked(image_store, mask_store, label, voi_extent, output_dir, masked_value):
+    """
+    Segment one label and save its VOI as MHD, reading only the VOI from the chunked stores.
+    """
+    image_voi = vtk.vtkTrivialProducer()
+    image_voi.SetOutput(image_store.read_voi(voi_extent))
+    mask_voi = vtk.vtkTrivialProducer()
+    mask_voi.SetOutput(mask_store.read_voi(voi_extent))
+    return write_label_voi(image_voi.GetOutputPort(), mask_voi.GetOutputPort(), label, output_dir, masked_value)
+
+
+def write_label_voi(image_port, mask_port, label, output_dir, masked_value):
+    """
+    Mask the image VOI with the label and save it as MHD.
+    """
+    # Threshold mask VOI for this label
+    threshold = vtk.vtkImageThreshold()
+    threshold.SetInputConnection(mask_port)
+    threshold.ThresholdBetween(label, label)
+    threshold.SetInValue(1)
+    threshold.SetOutValue(0)
+
+    # Apply mask to extracted image
+    image_mask = vtk.vtkImageMask()
+    image_mask.SetInputConnection(0, image_port)
+    image_mask.SetInputConnection(1, threshold.GetOutputPort())
+    image_mask.SetMaskedOutputValue(masked_value)
+
+    # Save output
+    output_file = f"{output_dir}/label_{label}_voi.mhd"
+    writer = vtk.vtkMetaImageWriter()
+    writer.SetFileName(output_file)
+    writer.SetInputConnection(image_mask.GetOutputPort())
+    writer.Write()
+    return output_file
+
+
+def copy_to_shared_memory(image_data):
+    """
+    Copy the scalars of a vtkImageData into a new shared memory block.
+
+    Returns:
+        Tuple (shared memory block, description used by the workers to attach).
+    """
+    scalars = np.asarray(image_to_numpy(image_data))
+    shm = shared_memory.SharedMemory(create=True, size=max(scalars.nbytes, 1))
+    np.ndarray(scalars.shape, dtype=scalars.dtype, buffer=shm.buf)[:] = scalars
+    description = {
+        "name": shm.name,
+        "dtype": scalars.dtype.str,
+        "shape": scalars.shape,
+        "origin": image_data.GetOrigin(),
+        "spacing": image_data.GetSpacing(),
+    }
+    return shm, description
+
+
+def attach_shared_image(description):
+    """
+    Wrap a shared memory block as vtkImageData without copying.
+
+    Returns:
+        Tuple (shared memory handle, vtkImageData). Keep the handle alive while the image is used.
+    """
+    shm = shared_memory.SharedMemory(name=description["name"])
+    array = np.ndarray(description["shape"], dtype=np.dtype(description["dtype"]), buffer=shm.buf)
+    return shm, numpy_to_image(array, description["spacing"], description["origin"])
+
+
+# Per-worker state, set once by init_worker
+_worker_state = {}
+
+
+def init_worker(image_description, mask_description):
+    _worker_state["image"] = attach_shared_image(image_description)
+    _worker_state["mask"] = attach_shared_image(mask_description)
+
+
+def init_chunked_worker(image_path, mask_path):
+    _worker_state["image_store"] = ChunkedVolume(image_path)
+    _worker_state["mask_store"] = ChunkedVolume(mask_path)
+
+
+def export_label_voi_worker(label, voi_extent, output_dir, masked_value):
+    image_data = _worker_state["image"][1]
+    mask_data = _worker_state["mask"][1]
+    return label, export_label_voi(image_data, mask_data, label, voi_extent, output_dir, masked_value)
+
+
+def export_label_voi_chunked_worker(label, voi_extent, output_dir, masked_value):
+    stores = (_worker_state["image_store"], _worker_state["mask_store"])
+    bytes_read = sum(store.bytes_read for store in stores)
+    output_file = export_label_voi_chunked(*stores, label, voi_extent, output_dir, masked_value)
+    # Compressed bytes this label read, the counters are per worker process
+    return label, output_file, sum(store.bytes_read for store in stores) - bytes_read
+
+
+def run_export_pool(jobs, worker, initializer, initargs, output_dir, masked_value, num_workers, max_in_flight=None):
+    """
+    Run worker(label, voi_extent, output_dir, masked_value) for every job in a process pool.
+    A worker returns (label, output file, ...).
+
     Args:
-        image_data: vtkImageData representing the mask.
-    
+        jobs: List of (label, voi_extent).
+        num_workers: Number of worker processes.
+        max_in_flight: Maximum number of submitted but unfinished labels, defaults to 2 * num_workers.
+
     Returns:
-        Dictionary of label bounds in voxel index space.
+        List of the worker results.
     """
-    dims = image_data.GetDimensions()
-    scalars = image_data.GetPointData().GetScalars()
-    num_points = scalars.GetNumberOfTuples()
+    if max_in_flight is None:
+        max_in_flight = 2 * num_workers
 
-    label_bounds_temp = {}
-    for idx in range(num_points):
-        label = int(scalars.GetTuple1(idx))
-        if label == 0:  # Skip background
-            continue
+    results = []
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=initializer, initargs=initargs) as executor:
+        pending = set()
+        for label, voi_extent in jobs:
+            # Bound the number of labels in flight, each one holds its VOI-sized temporaries and result
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.append(future.result())
+                    print("Saved label {} to {}".format(*results[-1]))
+            pending.add(executor.submit(worker, label, voi_extent, output_dir, masked_value))
+        for future in wait(pending).done:
+            results.append(future.result())
+            print("Saved label {} to {}".format(*results[-1]))
+    return results
 
-        z = idx // (dims[0] * dims[1])
-        y = (idx % (dims[0] * dims[1])) // dims[0]
-        x = idx % dims[0]
 
-        if label not in label_bounds_temp:
-            label_bounds_temp[label] = [x, x, y, y, z, z]
-        else:
-            bounds = label_bounds_temp[label]
-            bounds[0] = min(bounds[0], x)
-            bounds[1] = max(bounds[1], x)
-            bounds[2] = min(bounds[2], y)
-            bounds[3] = max(bounds[3], y)
-            bounds[4] = min(bounds[4], z)
-            bounds[5] = max(bounds[5], z)
+def export_labels_parallel(image_data, mask_data, jobs, output_dir, masked_value, num_workers, max_in_flight=None):
+    """
+    Export the label VOIs with a process pool, image and mask are shared with the workers.
+    """
+    image_shm, image_description = copy_to_shared_memory(image_data)
+    mask_shm, mask_description = copy_to_shared_memory(mask_data)
+    try:
+        run_export_pool(jobs, export_label_voi_worker, init_worker, (image_description, mask_description),
+                        output_dir, masked_value, num_workers, max_in_flight)
+    finally:
+        image_shm.close()
+        image_shm.unlink()
+        mask_shm.close()
+        mask_shm.unlink()
 
-    label_bounds = {label: tuple(bounds) for label, bounds in label_bounds_temp.items()}
-    return label_bounds
 
-def process_image_and_mask(image_file, mask_file, output_dir):
+def process_image_and_mask_chunked(image_file, mask_file, output_dir, num_workers=1, max_in_flight=None):
+    """
+    process_image_and_mask() on the chunked stores of image and mask, built on first use.
+    """
+    image_store = open_volume(image_file)
+    mask_store = open_volume(mask_file, labels=True)
+    dims = tuple(reversed(image_store.shape()))
+    print(f"Image origin: {image_store.origin()}, spacing: {image_store.spacing()}, dims: {dims}")
+    if tuple(reversed(mask_store.shape())) != dims:
+        raise ValueError("Image and mask dimensions do not match!")
+
+    # The mask is only decoded when its label index is missing or stale
+    label_index = load_label_index(mask_file)
+    jobs = [(label, list(stats["bounds"])) for label, stats in label_index["statistics"].items()]
+
+    masked_value = image_store.header["range"][0]
+    if num_workers > 1:
+        results = run_export_pool(jobs, export_label_voi_chunked_worker, init_chunked_worker,
+                                  (image_store.path, mask_store.path), output_dir, masked_value, num_workers, max_in_flight)
+        bytes_read = sum(result[2] for result in results)
+    else:
+        for label, voi_extent in jobs:
+            output_file = export_label_voi_chunked(image_store, mask_store, label, voi_extent, output_dir, masked_value)
+            print(f"Saved label {label} to {output_file}")
+        bytes_read = image_store.bytes_read + mask_store.bytes_read
+    print(f"Read {bytes_read} of {image_store.compressed_bytes + mask_store.compressed_bytes} compressed bytes")
+
+
+def process_image_and_mask(image_file, mask_file, output_dir, num_workers=1, max_in_flight=None, chunked=False):
     """
     Process image and mask to extract and save VOI for each label.
+    With num_workers > 1 the labels are exported in parallel, at most max_in_flight at a time.
+    With chunked=True only the VOIs are decoded, from the chunked stores of image and mask.
     """
+    if chunked:
+        process_image_and_mask_chunked(image_file, mask_file, output_dir, num_workers, max_in_flight)
+        return
+
     # Read image
     reader_image = vtk.vtkNIFTIImageReader()
     reader_image.SetFileName(image_file)
@@ -72,18 +241,20 @@ def process_image_and_mask(image_file, mask_file, output_dir):
     if dims != mask_dims:
         raise ValueError("Image and mask dimensions do not match!")
 
-    # Find bounds
-    print("Begin find_label_bounds_vtk_sequential")
-    bounds_dict = find_label_bounds_vtk_sequential(mask_data)
-    print("End find_label_bounds_vtk_sequential")
+    # Find bounds, cached in the mask's label index sidecar
+    print("Begin load_label_index")
+    label_index = load_label_index(mask_file, mask_data)
+    bounds_dict = {label: stats["bounds"] for label, stats in label_index["statistics"].items()}
+    print("End load_label_index")
 
+    jobs = []
     for label, bounds in bounds_dict.items():
         min_x, max_x, min_y, max_y, min_z, max_z = bounds
         print(f"Label {label}: bounds (voxel indices) {bounds}")
 
         # Validate bounds against image dimensions
-        if (min_x < 0 or max_x >= dims[0] or 
-            min_y < 0 or max_y >= dims[1] or 
+        if (min_x < 0 or max_x >= dims[0] or
+            min_y < 0 or max_y >= dims[1] or
             min_z < 0 or max_z >= dims[2]):
             print(f"Skipping label {label}: Bounds out of range")
             continue
@@ -91,38 +262,21 @@ def process_image_and_mask(image_file, mask_file, output_dir):
         # Use bounds directly as VOI (no conversion needed)
         voi_extent = [min_x, max_x, min_y, max_y, min_z, max_z]
         print(f"Label {label}: VOI extent {voi_extent}")
+        jobs.append((label, voi_extent))
+
+    masked_value = image_data.GetScalarRange()[0]
+    if num_workers > 1:
+        export_labels_parallel(image_data, mask_data, jobs, output_dir, masked_value, num_workers, max_in_flight)
+        return
 
-        # Threshold mask for this label
-        threshold = vtk.vtkImageThreshold()
-        threshold.SetInputConnection(reader_mask.GetOutputPort())
-        threshold.ThresholdBetween(label, label)
-        threshold.SetInValue(1)
-        threshold.SetOutValue(0)
-        threshold.Update()
-
-        # Apply mask to extracted image
-        image_mask = vtk.vtkImageMask()
-        image_mask.SetInputConnection(0, reader_image.GetOutputPort())
-        image_mask.SetInputConnection(1, threshold.GetOutputPort())
-        image_mask.SetMaskedOutputValue(image_data.GetScalarRange()[0])
-        image_mask.Update()
-
-        # Extract VOI from image
-        extract_voi = vtk.vtkExtractVOI()
-        extract_voi.SetInputConnection(image_mask.GetOutputPort())
-        extract_voi.SetVOI(voi_extent)
-        extract_voi.Update()
-
-        # Save output
-        output_file = f"{output_dir}/label_{label}_voi.mhd"
-        writer = vtk.vtkMetaImageWriter()
-        writer.SetFileName(output_file)
-        writer.SetInputConnection(extract_voi.GetOutputPort())
-        writer.Write()
+    for label, voi_extent in jobs:
+        output_file = export_label_voi(image_data, mask_data, label, voi_extent, output_dir, masked_value)
         print(f"Saved label {label} to {output_file}")
 
 if __name__ == "__main__":
     output_dir = "output"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    process_image_and_mask("data/liver_57.nii.gz", "data/liver_57_multilabel.nii.gz", output_dir)
\ No newline at end of file
+    # num_workers=os.cpu_count() exports the labels with a process pool,
+    # chunked=True reads only the label VOIs from the .cvol stores (built next to the files on first use)
+    process_image_and_mask("data/liver_57.nii.gz", "data/liver_57_multilabel.nii.gz", output_dir)
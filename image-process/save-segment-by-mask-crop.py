@@ -1,5 +1,6 @@
 import vtk
 import os
+from label_index import load_label_index
 
 '''
 This script demonstrates how to extract and save a volume of interest (VOI) for each label in a mask.
@@ -8,44 +9,6 @@ Second, segment the each label using image voi and mask voi.
 The VOI is saved as a separate MHD file for each label.
 '''
 
-def find_label_bounds_vtk_sequential(image_data):
-    """
-    Finds bounding boxes for all labels in a single pass using VTK.
-    
-    Args:
-        image_data: vtkImageData representing the mask.
-    
-    Returns:
-        Dictionary of label bounds in voxel index space.
-    """
-    dims = image_data.GetDimensions()
-    scalars = image_data.GetPointData().GetScalars()
-    num_points = scalars.GetNumberOfTuples()
-
-    label_bounds_temp = {}
-    for idx in range(num_points):
-        label = int(scalars.GetTuple1(idx))
-        if label == 0:  # Skip background
-            continue
-
-        z = idx // (dims[0] * dims[1])
-        y = (idx % (dims[0] * dims[1])) // dims[0]
-        x = idx % dims[0]
-
-        if label not in label_bounds_temp:
-            label_bounds_temp[label] = [x, x, y, y, z, z]
-        else:
-            bounds = label_bounds_temp[label]
-            bounds[0] = min(bounds[0], x)
-            bounds[1] = max(bounds[1], x)
-            bounds[2] = min(bounds[2], y)
-            bounds[3] = max(bounds[3], y)
-            bounds[4] = min(bounds[4], z)
-            bounds[5] = max(bounds[5], z)
-
-    label_bounds = {label: tuple(bounds) for label, bounds in label_bounds_temp.items()}
-    return label_bounds
-
 def process_image_and_mask(image_file, mask_file, output_dir):
     """
     Process image and mask to extract and save VOI for each label.
@@ -72,11 +35,13 @@ def process_image_and_mask(image_file, mask_file, output_dir):
     if dims != mask_dims:
         raise ValueError("Image and mask dimensions do not match!")
 
-    # Find bounds
-    print("Begin find_label_bounds_vtk_sequential")
-    bounds_dict = find_label_bounds_vtk_sequential(mask_data)
-    print("End find_label_bounds_vtk_sequential")
+    # Find bounds, cached in the mask's label index sidecar
+    print("Begin load_label_index")
+    label_index = load_label_index(mask_file, mask_data)
+    bounds_dict = {label: stats["bounds"] for label, stats in label_index["statistics"].items()}
+    print("End load_label_index")
 
+    masked_value = image_data.GetScalarRange()[0]
     for label, bounds in bounds_dict.items():
         min_x, max_x, min_y, max_y, min_z, max_z = bounds
         print(f"Label {label}: bounds (voxel indices) {bounds}")
@@ -96,27 +61,24 @@ def process_image_and_mask(image_file, mask_file, output_dir):
         extract_voi = vtk.vtkExtractVOI()
         extract_voi.SetInputConnection(reader_image.GetOutputPort())
         extract_voi.SetVOI(voi_extent)
-        extract_voi.Update()
 
-        # Threshold mask for this label
+        # Extract same VOI from mask
+        extract_mask = vtk.vtkExtractVOI()
+        extract_mask.SetInputConnection(reader_mask.GetOutputPort())
+        extract_mask.SetVOI(voi_extent)
+
+        # Threshold mask VOI for this label, only the label's box is scanned
         threshold = vtk.vtkImageThreshold()
-        threshold.SetInputConnection(reader_mask.GetOutputPort())
+        threshold.SetInputConnection(extract_mask.GetOutputPort())
         threshold.ThresholdBetween(label, label)
         threshold.SetInValue(1)
         threshold.SetOutValue(0)
-        threshold.Update()
-
-        # Extract same VOI from thresholded mask
-        extract_mask = vtk.vtkExtractVOI()
-        extract_mask.SetInputConnection(threshold.GetOutputPort())
-        extract_mask.SetVOI(voi_extent)
-        extract_mask.Update()
 
         # Apply mask to extracted image
         image_mask = vtk.vtkImageMask()
         image_mask.SetInputConnection(0, extract_voi.GetOutputPort())
-        image_mask.SetInputConnection(1, extract_mask.GetOutputPort())
-        image_mask.SetMaskedOutputValue(image_data.GetScalarRange()[0])
+        image_mask.SetInputConnection(1, threshold.GetOutputPort())
+        image_mask.SetMaskedOutputValue(masked_value)
         image_mask.Update()
 
         # Save output
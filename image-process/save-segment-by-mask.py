@@ -1,68 +1,88 @@
+import os
+import numpy as np
 import vtkmodules.all as vtk
+from image_array import numpy_to_image
+from label_statistics import group_voxels_by_label, mask_to_numpy
+from label_index import load_label_index, expand_runs
 
 '''
 This script demonstrates how to segment a 3D image using a multi-label mask.
-The mask image is used to segment the original image.
-The segmented image is saved as a separate MHD file for each label in the mask.
+The image and the mask are read once, and the voxels are grouped by label in one sort pass.
+Each label is written as its own cropped MHD file, so only one label crop is in memory at a time.
 '''
 
-# Read the original NIFTI file (.nii.gz)
-reader_image = vtk.vtkNIFTIImageReader()
-reader_image.SetFileName("data/liver_57.nii.gz")
-reader_image.Update()
+def export_label_segments(image_data, mask_data, output_pattern, runs=None):
+    """
+    Writes the cropped, masked sub-volume of every label in the mask.
 
-#  get minimal pixel value
-image_data = reader_image.GetOutput()
-scalar_range = image_data.GetScalarRange()
-min_pixel_value = scalar_range[0]
-max_pixel_value = scalar_range[1]
+    Args:
+        image_data: vtkImageData of the original image.
+        mask_data: vtkImageData of the multi-label mask, same dimensions as the image.
+        output_pattern: Output filename with a {label} placeholder.
+        runs: Optional run-length encoded voxel lists {label: (starts, lengths)} from the
+              label index, replaces the sort pass over the mask.
 
-# Read the mask NIFTI file (.nii.gz)
-reader_mask = vtk.vtkNIFTIImageReader()
-reader_mask.SetFileName("data/liver_57_multilabel.nii.gz")
-reader_mask.Update()
+    Returns:
+        List of written filenames.
+    """
+    if image_data.GetDimensions() != mask_data.GetDimensions():
+        raise ValueError("Image and mask dimensions do not match!")
 
-# Get the unique labels from the 3D mask
-mask_data = reader_mask.GetOutput()
-mask_range = mask_data.GetScalarRange()
-min_label, max_label = int(mask_range[0]), int(mask_range[1])
+    image = mask_to_numpy(image_data)
+    # set mask default value as min_pixel_value
+    min_pixel_value = image_data.GetScalarRange()[0]
+    origin = np.array(image_data.GetOrigin())
+    spacing = np.array(image_data.GetSpacing())
 
-print(f"Segmenting labels from {min_label} to {max_label}...")
+    written = []
+    if runs is not None:
+        # Expanded lazily, one label's voxel list at a time
+        groups = {label: (lambda r=r: expand_runs(*r)) for label, r in runs.items()}
+    else:
+        groups = {label: (lambda i=i: i) for label, i in group_voxels_by_label(mask_data).items()}
+    print(f"Segmenting {len(groups)} labels...")
+    for label, voxels in groups.items():
+        indices = voxels()
+        # Indices are sorted, so z is monotonic and only x, y need a reduction
+        z, y, x = np.unravel_index(indices, image.shape)
+        z0, z1 = int(z[0]), int(z[-1])
+        y0, y1 = int(y.min()), int(y.max())
+        x0, x1 = int(x.min()), int(x.max())
 
-for label in range(min_label, max_label + 1):
-    if label == 0:
-        continue  # Skip background
-    # if label != 19:
-    #     continue
+        crop = np.full((z1 - z0 + 1, y1 - y0 + 1, x1 - x0 + 1), min_pixel_value, dtype=image.dtype)
+        crop[z - z0, y - y0, x - x0] = image.ravel()[indices]
 
-    # Threshold to extract only the current label
-    threshold = vtk.vtkImageThreshold()
-    threshold.SetInputConnection(reader_mask.GetOutputPort())  # Use full 3D mask
-    threshold.ThresholdBetween(label, label)  # Isolate this label
-    threshold.SetInValue(1)  # Set label region to 1
-    threshold.SetOutValue(0)
-    threshold.Update()
+        crop_origin = origin + spacing * (x0, y0, z0)
+        # The image keeps the crop alive, it shares its memory
+        segment = numpy_to_image(crop, spacing, crop_origin)
 
-    # Check if the mask exists
-    mask_exists = threshold.GetOutput().GetScalarRange()[1] > 0
-    if not mask_exists:
-        continue
-    
-    print("threshold scaler range: ", threshold.GetOutput().GetScalarRange())
-    image_mask = vtk.vtkImageMask()
-    # set mask default value as min_pixel_value
-    image_mask.SetMaskedOutputValue(min_pixel_value)
-    image_mask.SetInputConnection(0, reader_image.GetOutputPort())
-    image_mask.SetInputConnection(1, threshold.GetOutputPort())
-    image_mask.Update()
-    print("image_mask scaler range: ", image_mask.GetOutput().GetScalarRange())
-    
-    # Save the segmented mask for the current label
-    mhd_writer = vtk.vtkMetaImageWriter()
-    mhd_writer.SetFileName(f"output/liver_57_label_{label}.mhd")  # Output filename
-    mhd_writer.SetInputConnection(image_mask.GetOutputPort())  # Save full 3D mask
-    mhd_writer.Write()
+        # Save the segmented image for the current label
+        filename = output_pattern.format(label=label)
+        mhd_writer = vtk.vtkMetaImageWriter()
+        mhd_writer.SetFileName(filename)
+        mhd_writer.SetInputData(segment)
+        mhd_writer.Write()
+        written.append(filename)
+        print(f"Saved segmented image for label {label} as MHD, extent {(x0, x1, y0, y1, z0, z1)}.")
+
+    return written
+
+
+if __name__ == "__main__":
+    # Read the original NIFTI file (.nii.gz)
+    reader_image = vtk.vtkNIFTIImageReader()
+    reader_image.SetFileName("data/liver_57.nii.gz")
+    reader_image.Update()
+
+    # Read the mask NIFTI file (.nii.gz)
+    reader_mask = vtk.vtkNIFTIImageReader()
+    reader_mask.SetFileName("data/liver_57_multilabel.nii.gz")
+    reader_mask.Update()
 
-    print(f"Saved segmented mask for label {label} as MHD.")
+    # Voxel lists are cached in the mask's label index sidecar
+    label_index = load_label_index("data/liver_57_multilabel.nii.gz", reader_mask.GetOutput(), with_runs=True)
 
-print("All labels segmented and saved successfully.")
+    os.makedirs("output", exist_ok=True)
+    export_label_segments(reader_image.GetOutput(), reader_mask.GetOutput(), "output/liver_57_label_{label}.mhd",
+                          runs=label_index["runs"])
+    print("All labels segmented and saved successfully.")
@@ -0,0 +1,388 @@
+import threading
+import queue
+from collections import OrderedDict
+import numpy as np
+import vtkmodules.all as vtk
+from vtkmodules.util import numpy_support
+from label_statistics import mask_to_numpy
+
+'''
+Slice provider for the w/s scroll path of the reslice viewers.
+For axis-aligned reslice axes a slice is a NumPy view into the volume, no resampling; axial
+slices are wrapped without copying, sagittal and coronal ones are copied once into the cache.
+Oblique slices are resliced once and kept in an LRU cache with a budget in MB.
+Neighbouring slices in the scroll direction are prefetched on a background thread.
+Connect get_output_port() where the vtkImageReslice output port was used before.
+PairedSliceProvider serves an image and its mask from one sampling grid per slice.
+from_store() serves axis-aligned slices from a chunked volume store, only the chunks a slice
+crosses are decoded; oblique slices decode the whole level once.
+'''
+
+
+def axis_permutation(rotation):
+    """
+    Image axis of each slice axis if the 3x3 rotation is a signed permutation, None if oblique.
+
+    Returns:
+        Tuple (permutation, signs) or None.
+    """
+    if np.allclose(np.abs(rotation), np.round(np.abs(rotation))) and \
+            np.allclose(np.abs(rotation).sum(axis=0), 1) and \
+            np.allclose(np.abs(rotation).sum(axis=1), 1):
+        permutation = [int(np.argmax(np.abs(rotation[:, j]))) for j in range(3)]
+        return permutation, [float(np.sign(rotation[permutation[j], j])) for j in range(3)]
+    return None
+
+
+def matrix_rotation(matrix):
+    return np.array([[matrix.GetElement(i, j) for j in range(3)] for i in range(3)])
+
+
+class SliceProvider:
+    def __init__(self, image_data, reslice_axes, origin=None, interpolation="linear",
+                 cache_mb=128, prefetch_count=2, volume=None):
+        """
+        Args:
+            image_data: vtkImageData volume.
+            reslice_axes: vtkMatrix4x4 whose columns are the slice x, y and normal axes.
+            origin: Initial slice origin in world coordinates, defaults to the volume center.
+            interpolation: "linear", "cubic" or "nearest", used for oblique slices.
+            cache_mb: Budget of the slice cache in MB.
+            prefetch_count: Number of slices prefetched ahead in the scroll direction.
+            volume: (x, y, z) voxels of image_data, a view of its scalars if None.
+        """
+        self.image_data = image_data
+        self.volume = mask_to_numpy(image_data).transpose(2, 1, 0) if volume is None else volume  # (x, y, z) view
+        self.axes = np.array([[reslice_axes.GetElement(i, j) for j in range(4)] for i in range(4)])
+        self.rotation = self.axes[:3, :3]
+        self.normal = self.rotation[:, 2]
+        self.interpolation = interpolation
+        self.cache_bytes = int(cache_mb * 1024 * 1024)
+        self.prefetch_count = prefetch_count
+
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+
+        # Axis-aligned: the rotation is a signed permutation of the image axes
+        self.permutation = None
+        aligned = axis_permutation(self.rotation)
+        if aligned is not None:
+            self.permutation, self.signs = aligned
+        spacing = image_data.GetSpacing()
+        if self.permutation is not None:
+            self.slice_step = spacing[self.permutation[2]]
+        else:
+            self.slice_step = min(spacing)
+
+        self.reslice = self.create_reslice()
+        self.producer = vtk.vtkTrivialProducer()
+
+        self.requests = queue.Queue()
+        self.prefetch_thread = None
+        self.origin = np.array(image_data.GetCenter() if origin is None else origin, dtype=np.float64)
+        self.origin = self.snap(self.origin)
+        self.set_origin(self.origin)
+
+    @classmethod
+    def from_store(cls, store, reslice_axes, level=1, **kwargs):
+        """
+        Slice provider on a level of a ChunkedVolume (chunked_volume.py).
+        Axis-aligned slices decode only the chunks they cross, an oblique provider loads the level.
+        """
+        if axis_permutation(matrix_rotation(reslice_axes)) is None:
+            return cls(store.level_image(level), reslice_axes, **kwargs)
+        return cls(store.geometry_image(level), reslice_axes, volume=store.array(level), **kwargs)
+
+    def create_reslice(self, image_data=None):
+        reslice = vtk.vtkImageReslice()
+        reslice.SetInputData(self.image_data if image_data is None else image_data)
+        reslice.SetOutputDimensionality(2)
+        if self.interpolation == "nearest":
+            reslice.SetInterpolationModeToNearestNeighbor()
+        elif self.interpolation == "cubic":
+            reslice.SetInterpolationModeToCubic()
+        else:
+            reslice.SetInterpolationModeToLinear()
+        return reslice
+
+    def snap(self, origin):
+        """
+        Moves an axis-aligned slice origin onto the nearest voxel plane.
+        """
+        if self.permutation is None:
+            return origin
+        axis = self.permutation[2]
+        image_origin = self.image_data.GetOrigin()[axis]
+        spacing = self.image_data.GetSpacing()[axis]
+        origin = origin.copy()
+        origin[axis] = image_origin + round((origin[axis] - image_origin) / spacing) * spacing
+        return origin
+
+    def slice_key(self, origin):
+        return round(float(np.dot(self.normal, origin)) / self.slice_step * 1000)
+
+    def get_output_port(self):
+        return self.producer.GetOutputPort()
+
+    def get_output(self):
+        return self.producer.GetOutputDataObject(0)
+
+    def scroll(self, steps):
+        """
+        Moves the slice by a number of slice steps along the normal and prefetches ahead.
+        """
+        self.set_origin(self.origin + steps * self.slice_step * self.normal)
+        self.prefetch(1 if steps > 0 else -1)
+
+    def set_origin(self, origin):
+        self.origin = self.snap(np.asarray(origin, dtype=np.float64))
+        self.producer.SetOutput(self.slice_at(self.origin))
+        self.producer.Modified()
+
+    def slice_at(self, origin):
+        """
+        Returns the slice through origin as vtkImageData, from the cache when possible.
+        """
+        key = self.slice_key(origin)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        image = self.compute_slice(origin, self.reslice)
+        self.store(key, image)
+        return image
+
+    def slice_array(self, origin, volume=None):
+        """
+        Axis-aligned slice through origin as a zero-copy NumPy view (rows = slice y, cols = slice x).
+        volume defaults to the provider's volume, any (x, y, z) view with the same geometry works.
+
+        Returns:
+            Tuple (view, world position of view[0, 0]), or None outside the volume.
+        """
+        x_axis, y_axis, normal_axis = self.permutation
+        if volume is None:
+            volume = self.volume
+        image_origin = np.array(self.image_data.GetOrigin())
+        spacing = np.array(self.image_data.GetSpacing())
+        index = int(round((origin[normal_axis] - image_origin[normal_axis]) / spacing[normal_axis]))
+        if index < 0 or index >= volume.shape[normal_axis]:
+            return None
+
+        selection = [slice(None)] * 3
+        selection[normal_axis] = index
+        view = volume[tuple(selection)]
+        remaining = [axis for axis in range(3) if axis != normal_axis]
+        if remaining != [y_axis, x_axis]:
+            view = view.T
+        corner = image_origin.copy()
+        corner[normal_axis] += index * spacing[normal_axis]
+        if self.signs[0] < 0:
+            view = view[:, ::-1]
+            corner[x_axis] += (view.shape[1] - 1) * spacing[x_axis]
+        if self.signs[1] < 0:
+            view = view[::-1, :]
+            corner[y_axis] += (view.shape[0] - 1) * spacing[y_axis]
+        return view, corner
+
+    def reslice_axes_at(self, origin):
+        axes = vtk.vtkMatrix4x4()
+        for i in range(4):
+            for j in range(4):
+                axes.SetElement(i, j, self.axes[i, j])
+        for i in range(3):
+            axes.SetElement(i, 3, origin[i])
+        return axes
+
+    def compute_slice(self, origin, reslice):
+        if self.permutation is not None:
+            return self.aligned_slice(origin)
+        reslice.SetResliceAxes(self.reslice_axes_at(origin))
+        reslice.Update()
+        image = vtk.vtkImageData()
+        image.DeepCopy(reslice.GetOutput())
+        return image
+
+    def aligned_slice(self, origin, volume=None):
+        """
+        Axis-aligned slice through origin as vtkImageData.
+        Axial slices wrap a view of the volume without copying. Sagittal and coronal views are
+        strided, VTK needs contiguous scalars, so they are copied once per slice (then cached).
+        """
+        if volume is None:
+            volume = self.volume
+        x_axis, y_axis, _ = self.permutation
+        spacing = self.image_data.GetSpacing()
+        image = vtk.vtkImageData()
+        image.SetSpacing(spacing[x_axis], spacing[y_axis], spacing[self.permutation[2]])
+
+        result = self.slice_array(origin, volume)
+        if result is None:
+            # Outside the volume, vtkImageReslice would return background
+            image.SetDimensions(1, 1, 1)
+            image.AllocateScalars(numpy_support.get_vtk_array_type(volume.dtype), 1)
+            image.GetPointData().GetScalars().Fill(0)
+            return image
+        view, corner = result
+
+        # Same coordinates as the vtkImageReslice output: slice frame relative to the axes origin
+        slice_origin = self.rotation.T @ (corner - origin)
+        image.SetOrigin(slice_origin[0], slice_origin[1], 0.0)
+        image.SetDimensions(view.shape[1], view.shape[0], 1)
+        # Contiguous views (axial) are wrapped as they are, other orientations need one copy
+        data = np.ascontiguousarray(view).ravel()
+        scalars = numpy_support.numpy_to_vtk(data, deep=False)
+        image.GetPointData().SetScalars(scalars)
+        image._numpy_reference = data
+        return image
+
+    def slice_nbytes(self, image):
+        scalars = image.GetPointData().GetScalars()
+        return scalars.GetNumberOfValues() * scalars.GetDataTypeSize() if scalars is not None else 0
+
+    def store(self, key, image):
+        size = self.slice_nbytes(image)
+        with self.lock:
+            if key in self.cache:
+                return
+            self.cache[key] = image
+            self.cached_bytes += size
+            # Evict least recently used slices beyond the budget, always keep the newest
+            while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                self.cached_bytes -= self.slice_nbytes(evicted)
+
+    def prefetch(self, direction):
+        """
+        Queues the next prefetch_count slices in the scroll direction (+1 or -1).
+        """
+        if self.prefetch_count <= 0:
+            return
+        # Drop requests for the previous position, only the latest scroll direction matters
+        while not self.requests.empty():
+            try:
+                self.requests.get_nowait()
+            except queue.Empty:
+                break
+        for k in range(1, self.prefetch_count + 1):
+            self.requests.put(self.origin + direction * k * self.slice_step * self.normal)
+        if self.prefetch_thread is None:
+            self.prefetch_thread = threading.Thread(target=self.prefetch_loop, daemon=True)
+            self.prefetch_thread.start()
+
+    def prefetch_loop(self):
+        # The worker thread has its own reslice filter on its own data object (sharing the scalars),
+        # so its pipeline updates never run on the display reslice's input
+        image_data = vtk.vtkImageData()
+        image_data.ShallowCopy(self.image_data)
+        reslice = self.create_reslice(image_data)
+        while True:
+            origin = self.requests.get()
+            key = self.slice_key(origin)
+            with self.lock:
+                cached = key in self.cache
+            if not cached:
+                self.store(key, self.compute_slice(origin, reslice))
+
+
+class PairedSliceProvider(SliceProvider):
+    """
+    Slice provider for an image and a label mask on the same grid.
+    The plane sampling grid is computed once per slice and applied to both volumes,
+    linear interpolation for the intensities and nearest neighbour for the labels,
+    so the two layers always come from the same coordinates. Oblique slices are resampled
+    by two vtkImageReslice filters, the mask one reuses the image's output grid.
+    """
+    def __init__(self, image_data, mask_data, reslice_axes, origin=None, cache_mb=128, prefetch_count=2,
+                 volume=None, mask_volume=None):
+        if (image_data.GetDimensions() != mask_data.GetDimensions() or
+                not np.allclose(image_data.GetSpacing(), mask_data.GetSpacing()) or
+                not np.allclose(image_data.GetOrigin(), mask_data.GetOrigin())):
+            raise ValueError("Image and mask geometry do not match!")
+        self.mask_data = mask_data
+        self.mask_volume = mask_to_numpy(mask_data).transpose(2, 1, 0) if mask_volume is None else mask_volume
+        self.mask_producer = vtk.vtkTrivialProducer()
+        super().__init__(image_data, reslice_axes, origin, "linear", cache_mb, prefetch_count, volume)
+
+    @classmethod
+    def from_store(cls, store, mask_store, reslice_axes, level=1, **kwargs):
+        """
+        Paired provider on the same level of an image and a mask ChunkedVolume.
+        """
+        if axis_permutation(matrix_rotation(reslice_axes)) is None:
+            return cls(store.level_image(level), mask_store.level_image(level), reslice_axes, **kwargs)
+        return cls(store.geometry_image(level), mask_store.geometry_image(level), reslice_axes,
+                   volume=store.array(level), mask_volume=mask_store.array(level), **kwargs)
+
+    def get_mask_output_port(self):
+        return self.mask_producer.GetOutputPort()
+
+    def get_mask_output(self):
+        return self.mask_producer.GetOutputDataObject(0)
+
+    def set_origin(self, origin):
+        self.origin = self.snap(np.asarray(origin, dtype=np.float64))
+        image, mask = self.slice_at(self.origin)
+        self.producer.SetOutput(image)
+        self.producer.Modified()
+        self.mask_producer.SetOutput(mask)
+        self.mask_producer.Modified()
+
+    def slice_nbytes(self, pair):
+        return sum(SliceProvider.slice_nbytes(self, image) for image in pair)
+
+    def create_reslice(self, image_data=None):
+        """
+        Linear reslice of the image and nearest neighbour reslice of the mask.
+        A copy of image_data (the prefetch thread's) gets its own copy of the mask as well.
+        """
+        mask_data = self.mask_data
+        if image_data is not None:
+            mask_data = vtk.vtkImageData()
+            mask_data.ShallowCopy(self.mask_data)
+        reslice = SliceProvider.create_reslice(self, image_data)
+        mask_reslice = vtk.vtkImageReslice()
+        mask_reslice.SetInputData(mask_data)
+        mask_reslice.SetOutputDimensionality(2)
+        mask_reslice.SetInterpolationModeToNearestNeighbor()
+        return reslice, mask_reslice
+
+    def compute_slice(self, origin, reslice):
+        if self.permutation is not None:
+            return self.aligned_slice(origin), self.aligned_slice(origin, self.mask_volume)
+
+        reslice, mask_reslice = reslice
+        axes = self.reslice_axes_at(origin)
+        reslice.SetResliceAxes(axes)
+        reslice.Update()
+        image = vtk.vtkImageData()
+        image.DeepCopy(reslice.GetOutput())
+
+        # The mask is sampled on the image's output grid, it does not compute its own
+        mask_reslice.SetResliceAxes(axes)
+        mask_reslice.SetOutputExtent(image.GetExtent())
+        mask_reslice.SetOutputSpacing(image.GetSpacing())
+        mask_reslice.SetOutputOrigin(image.GetOrigin())
+        mask_reslice.Update()
+        mask = vtk.vtkImageData()
+        mask.DeepCopy(mask_reslice.GetOutput())
+        return image, mask
+
+
+if __name__ == "__main__":
+    import time
+    reader = vtk.vtkNIFTIImageReader()
+    reader.SetFileName("data/liver_57.nii.gz")
+    reader.Update()
+
+    sagittal = vtk.vtkMatrix4x4()
+    sagittal.DeepCopy((0, 0, 1, 0,
+                       1, 0, 0, 0,
+                       0, 1, 0, 0,
+                       0, 0, 0, 1))
+    provider = SliceProvider(reader.GetOutput(), sagittal)
+    start_time = time.time()
+    for _ in range(50):
+        provider.scroll(1)
+    print("50 slices --- %s seconds ---" % (time.time() - start_time))
@@ -1,5 +1,6 @@
 import vtkmodules.all as vtk
 from distinct_colors import distinct_colors
+from slice_provider import PairedSliceProvider
 
 '''
 This script demonstrates how to overlay a mask on top of an image using the vtkImageActor class.
@@ -25,8 +26,8 @@ def setup_lookup_table():
     return lut
 
 class ResliceCallback:
-    def __init__(self, reslice, image_actor, max_slices):
-        self.reslice = reslice
+    def __init__(self, providers, image_actor, max_slices):
+        self.providers = providers
         self.image_actor = image_actor
         self.slice = 0
         self.max_slices = max_slices
@@ -43,12 +44,10 @@ class ResliceCallback:
         self.update_slice()
 
     def update_slice(self):
-        offset = [0, 0, self.slice, 1]
-        # using reslice axes to translate the image
-        self.reslice.GetResliceAxes().MultiplyPoint(offset, offset)
-        # print("Offset:", offset)
-        self.reslice.SetResliceAxesOrigin(offset[0], offset[1], offset[2])
-        self.reslice.Update()
+        # scroll image and mask together, axis-aligned slices are views into the volumes,
+        # oblique ones come from the providers' caches and prefetching
+        for provider in self.providers:
+            provider.scroll(self.slice)
         self.image_actor.GetMapper().Update()
 
 
@@ -97,25 +96,12 @@ resliceAxes.DeepCopy((0, 0, 1, 0,
                       0, 1, 0, 0,
                       0, 0, 0, 1))
 
-# reslice image and mask share the same reslice axes
-reslice_image = vtk.vtkImageReslice()
-reslice_image.SetInputConnection(reader_image.GetOutputPort())
-reslice_image.SetOutputDimensionality(2)
-reslice_image.SetResliceAxes(resliceAxes)
-reslice_image.SetResliceAxesOrigin(reader_image.GetOutput().GetCenter())
-reslice_image.SetInterpolationModeToCubic()  # Cubic for image data
-reslice_image.Update()
-
-reslice_mask = vtk.vtkImageReslice()
-reslice_mask.SetInputConnection(image_mask.GetOutputPort())
-reslice_mask.SetOutputDimensionality(2)
-reslice_mask.SetResliceAxes(resliceAxes)
-reslice_mask.SetResliceAxesOrigin(reader_mask.GetOutput().GetCenter())
-reslice_mask.SetInterpolationModeToNearestNeighbor()  # Nearest neighbor for mask data
-reslice_mask.Update()
+# image and mask share the same reslice axes and one cached slice provider
+# one sampling grid per slice for both: linear for the image, nearest neighbor for the mask
+slice_provider = PairedSliceProvider(reader_image.GetOutput(), image_mask.GetOutput(), resliceAxes)
 
 # print reslice mask pixel values
-# mask_image = reslice_mask.GetOutput()
+# mask_image = slice_provider.get_mask_output()
 # dimensions = mask_image.GetDimensions()
 # for i in range(dimensions[0]):
 #     for j in range(dimensions[1]):
@@ -131,7 +117,7 @@ max_slices = dimensions[2]
 
 # Apply the lookup table to map scalar values to colors for the mask
 color_map = vtk.vtkImageMapToColors()
-color_map.SetInputConnection(reslice_mask.GetOutputPort())
+color_map.SetInputConnection(slice_provider.get_mask_output_port())
 color_map.SetLookupTable(setup_lookup_table())
 color_map.PassAlphaToOutputOn()
 color_map.SetOutputFormatToRGBA()
@@ -144,7 +130,7 @@ mask_actor.SetOpacity(0.7)
 
 # Set up the image actor for the original image
 image_actor = vtk.vtkImageActor()
-image_actor.GetMapper().SetInputConnection(reslice_image.GetOutputPort())
+image_actor.GetMapper().SetInputConnection(slice_provider.get_output_port())
 
 # Set up the renderer, render window, and interactor
 renderer = vtk.vtkRenderer()
@@ -161,7 +147,7 @@ renderer.AddActor(mask_actor)
 renderer.SetBackground(0.1, 0.1, 0.1)
 
 # Initialize the reslice callback for mouse scroll events
-reslice_callback_image = ResliceCallback(reslice_image, image_actor, max_slices)
+reslice_callback_image = ResliceCallback([slice_provider], image_actor, max_slices)
 
 # Attach the callback to the interactor
 interactor.AddObserver("KeyPressEvent", reslice_callback_image.execute)
@@ -1,7 +1,10 @@
 import vtkmodules.all as vtk
+from volume_pyramid import VolumePyramid
 
 '''
 This script demonstrates how to visualize a NIFTI image volume using the vtkSmartVolumeMapper class.
+A vtkLODProp3D holds one mapper per pyramid level, so the renderer can fall back to a coarser level
+while the camera is moving and the full resolution renders when it stops.
 '''
 
 # Read the NIFTI file (.nii.gz)
@@ -12,9 +15,8 @@ reader = vtk.vtkMetaImageReader()
 reader.SetFileName(filename)
 reader.Update()
 
-# Set up the volume mapper
-volume_mapper = vtk.vtkSmartVolumeMapper()
-volume_mapper.SetInputConnection(reader.GetOutputPort())
+# Build the 2x, 4x, 8x levels once
+pyramid = VolumePyramid(reader.GetOutput())
 
 # Set up the volume property
 volume_property = vtk.vtkVolumeProperty()
@@ -37,10 +39,12 @@ opacity_func.AddPoint(1150, 0.85)
 volume_property.SetColor(color_func)
 volume_property.SetScalarOpacity(opacity_func)
 
-# Set up the volume actor
-volume = vtk.vtkVolume()
-volume.SetMapper(volume_mapper)
-volume.SetProperty(volume_property)
+# Set up the volume actor, one volume mapper per pyramid level
+volume = vtk.vtkLODProp3D()
+for factor in pyramid.factors:
+    volume_mapper = vtk.vtkSmartVolumeMapper()
+    volume_mapper.SetInputData(pyramid.level(factor))
+    volume.AddLOD(volume_mapper, volume_property, 0.0)
 
 # Set up the renderer, render window, and interactor
 renderer = vtk.vtkRenderer()
@@ -50,7 +54,7 @@ interactor = vtk.vtkRenderWindowInteractor()
 interactor.SetRenderWindow(render_window)
 
 # Add the volume to the renderer
-renderer.AddVolume(volume)
+renderer.AddViewProp(volume)
 renderer.SetBackground(0, 0, 0)  # Set the background color to black
 
 # add axes to the renderer
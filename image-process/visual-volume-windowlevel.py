@@ -1,4 +1,5 @@
 import vtkmodules.all as vtk
+from raw_cache import mhd_producer
 
 '''
 This script demonstrates how to adjust the window width and level of a volume rendering.
@@ -61,10 +62,7 @@ def adjust_volume_opacity(volume_property, opacity):
     return volume_property
 
 def read_mhd(directory):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(directory)
-    reader.Update()
-    return reader
+    return mhd_producer(directory)
 
 def read_nii(directory):
     reader = vtk.vtkNIFTIImageReader()
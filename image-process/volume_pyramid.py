@@ -0,0 +1,200 @@
+import json
+import os
+import numpy as np
+import vtkmodules.all as vtk
+from image_array import image_direction, numpy_to_image
+from label_statistics import mask_to_numpy
+
+'''
+Multi-resolution pyramid of a volume, built once at load time.
+Every level halves the previous one: 2x, 4x and 8x by default. Intensity volumes are
+reduced by 2x2x2 block averaging, label masks by the block mode, so no new labels appear.
+Levels are vtkImageData sharing the pyramid's NumPy buffers, they can be saved to a
+directory and memory-mapped back, so reslicers, volume mappers and label statistics can
+ask for the level that matches their spacing or voxel budget.
+'''
+
+PYRAMID_META = "pyramid.json"
+
+
+def level_file(factor):
+    return f"level_{factor}.npy"
+
+
+def downsample_mean(volume, slab_size=32):
+    """
+    Halves a (z, y, x) volume by averaging 2x2x2 blocks, partial edge blocks average the voxels they have.
+
+    Args:
+        volume: 3D NumPy array ordered (z, y, x).
+        slab_size: Number of output z-slices reduced at a time, bounds the temporary memory.
+
+    Returns:
+        Downsampled array with the dtype of volume.
+    """
+    shape = volume.shape
+    out_shape = tuple((n + 1) // 2 for n in shape)
+    result = np.empty(out_shape, dtype=volume.dtype)
+    starts = [np.arange(0, n, 2) for n in shape]
+    counts = [np.diff(np.r_[s, n]) for s, n in zip(starts, shape)]
+    weights = (counts[1][:, None] * counts[2][None, :]).astype(np.float32)
+
+    for z0 in range(0, out_shape[0], slab_size):
+        z1 = min(z0 + slab_size, out_shape[0])
+        block = volume[2 * z0:2 * z1].astype(np.float32)
+        block = np.add.reduceat(block, np.arange(0, block.shape[0], 2), axis=0)
+        block = np.add.reduceat(block, starts[1], axis=1)
+        block = np.add.reduceat(block, starts[2], axis=2)
+        block /= counts[0][z0:z1, None, None] * weights
+        if np.issubdtype(volume.dtype, np.integer):
+            block = np.rint(block)
+        result[z0:z1] = block
+    return result
+
+
+def downsample_mode(labels, slab_size=16):
+    """
+    Halves a (z, y, x) label volume by taking the most frequent label of every 2x2x2 block.
+    Ties go to the first voxel of the block in memory order. Edge blocks repeat their last voxels.
+
+    Args:
+        labels: 3D integer NumPy array ordered (z, y, x).
+        slab_size: Number of output z-slices reduced at a time, bounds the temporary memory.
+
+    Returns:
+        Downsampled label array with the dtype of labels.
+    """
+    shape = labels.shape
+    out_shape = tuple((n + 1) // 2 for n in shape)
+    result = np.empty(out_shape, dtype=labels.dtype)
+    # Index of the two source voxels of every output voxel along each axis, clamped at the edge
+    pairs = [np.minimum(np.arange(2 * m).reshape(m, 2), n - 1) for m, n in zip(out_shape, shape)]
+
+    for z0 in range(0, out_shape[0], slab_size):
+        z1 = min(z0 + slab_size, out_shape[0])
+        block = labels[pairs[0][z0:z1].reshape(-1)]
+        block = block[:, pairs[1].reshape(-1)][:, :, pairs[2].reshape(-1)]
+        nz, ny, nx = z1 - z0, out_shape[1], out_shape[2]
+        # (nz, 2, ny, 2, nx, 2) -> (nz, ny, nx, 8) candidates per output voxel
+        candidates = block.reshape(nz, 2, ny, 2, nx, 2).transpose(0, 2, 4, 1, 3, 5).reshape(nz, ny, nx, 8)
+        votes = np.zeros(candidates.shape, dtype=np.uint8)
+        for j in range(8):
+            votes += candidates == candidates[..., j:j + 1]
+        winner = np.argmax(votes, axis=-1)
+        result[z0:z1] = np.take_along_axis(candidates, winner[..., None], axis=-1)[..., 0]
+    return result
+
+
+class VolumePyramid:
+    def __init__(self, image_data, factors=(2, 4, 8), labels=False, directory=None):
+        """
+        Args:
+            image_data: Full-resolution vtkImageData, level 1 of the pyramid.
+            factors: Downsampling factors to build, powers of two.
+            labels: Reduce by block mode instead of block mean (label masks).
+            directory: Optional directory to save the levels to.
+        """
+        self.labels = labels
+        self.levels = {1: image_data}
+        self.arrays = {1: mask_to_numpy(image_data)}
+        if factors:
+            self.build(factors)
+        if directory is not None:
+            self.save(directory)
+
+    def build(self, factors):
+        reduce = downsample_mode if self.labels else downsample_mean
+        direction = image_direction(self.levels[1])
+        # Every level is reduced from the previous one, so intermediate levels are built too
+        previous = 1
+        for factor in [1 << k for k in range(1, int(np.log2(max(factors))) + 1)]:
+            source = self.levels[previous]
+            array = reduce(self.arrays[previous])
+            spacing = np.array(source.GetSpacing()) * 2
+            # A block's sample sits at the center of its two source voxels, along the image axes
+            origin = np.array(source.GetOrigin()) + direction @ (0.5 * np.array(source.GetSpacing()))
+            self.arrays[factor] = array
+            self.levels[factor] = numpy_to_image(array, spacing, origin, direction)
+            previous = factor
+        # Keep only the requested levels (and level 1)
+        for factor in list(self.levels):
+            if factor != 1 and factor not in factors:
+                del self.levels[factor]
+                del self.arrays[factor]
+
+    @property
+    def factors(self):
+        return sorted(self.levels)
+
+    def level(self, factor):
+        return self.levels[factor]
+
+    def factor_for_spacing(self, spacing):
+        """
+        Coarsest level whose finest voxel spacing is not coarser than the requested spacing.
+        """
+        factor = 1
+        for candidate in self.factors:
+            if min(self.levels[candidate].GetSpacing()) <= spacing * (1 + 1e-6):
+                factor = candidate
+        return factor
+
+    def factor_for_voxels(self, max_voxels):
+        """
+        Finest level with at most max_voxels voxels, the coarsest level if none fits.
+        """
+        for factor in self.factors:
+            if self.arrays[factor].size <= max_voxels:
+                return factor
+        return self.factors[-1]
+
+    def level_for_spacing(self, spacing):
+        return self.levels[self.factor_for_spacing(spacing)]
+
+    def level_for_voxels(self, max_voxels):
+        return self.levels[self.factor_for_voxels(max_voxels)]
+
+    def save(self, directory):
+        """
+        Writes every level except level 1 as .npy plus a JSON description.
+        """
+        os.makedirs(directory, exist_ok=True)
+        meta = {"labels": self.labels, "levels": {}}
+        for factor in self.factors:
+            if factor == 1:
+                continue
+            np.save(os.path.join(directory, level_file(factor)), self.arrays[factor])
+            image = self.levels[factor]
+            meta["levels"][str(factor)] = {"spacing": image.GetSpacing(), "origin": image.GetOrigin(),
+                                           "direction": image_direction(image).ravel().tolist()}
+        with open(os.path.join(directory, PYRAMID_META), "w") as meta_file:
+            json.dump(meta, meta_file)
+
+    @classmethod
+    def load(cls, directory, image_data):
+        """
+        Memory-maps the levels saved by save(), image_data is the full-resolution level 1.
+        """
+        with open(os.path.join(directory, PYRAMID_META), "r") as meta_file:
+            meta = json.load(meta_file)
+        pyramid = cls(image_data, factors=(), labels=meta["labels"])
+        for key, level in meta["levels"].items():
+            array = np.load(os.path.join(directory, level_file(int(key))), mmap_mode="r")
+            pyramid.arrays[int(key)] = array
+            pyramid.levels[int(key)] = numpy_to_image(array, level["spacing"], level["origin"], level.get("direction"))
+        return pyramid
+
+
+if __name__ == "__main__":
+    import time
+    reader = vtk.vtkNIFTIImageReader()
+    reader.SetFileName("data/liver_57.nii.gz")
+    reader.Update()
+
+    start_time = time.time()
+    pyramid = VolumePyramid(reader.GetOutput())
+    print("Build --- %s seconds ---" % (time.time() - start_time))
+    for factor in pyramid.factors:
+        level = pyramid.level(factor)
+        print(f"Level {factor}: dims {level.GetDimensions()}, spacing {level.GetSpacing()}")
+    print("Level for 2 mm spacing:", pyramid.factor_for_spacing(2.0))
@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import numpy as np
+import vtkmodules.all as vtk
+from vtkmodules.util import numpy_support
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create-model"))
+from distance_field import SignedDistanceField, load_distance_field, read_surface
+
+'''
+Collision monitoring for an actor dragged with the trackball-actor styles.
+Protected surfaces are signed distance fields, built or loaded from their cache once.
+The moving mesh is sampled at its vertices and triangle centroids, and the samples are grouped
+into spatial clusters with a bounding sphere each (precomputed in the mesh frame).
+Broad phase: one distance lookup per cluster center. A distance field changes by at most the
+distance moved, so a cluster whose center distance minus radius exceeds the best known
+distance cannot hold the minimum and is skipped.
+Narrow phase: lookups at the samples of the remaining clusters.
+'''
+
+def matrix_to_numpy(matrix):
+    return np.array(matrix.GetData(), dtype=np.float64).reshape(4, 4)
+
+
+def surface_samples(polydata):
+    """
+    Vertices and triangle centroids of a mesh, (N, 3).
+    """
+    triangle_filter = vtk.vtkTriangleFilter()
+    triangle_filter.SetInputData(polydata)
+    triangle_filter.PassVertsOff()
+    triangle_filter.PassLinesOff()
+    triangle_filter.Update()
+    surface = triangle_filter.GetOutput()
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).astype(np.float64)
+    triangles = numpy_support.vtk_to_numpy(surface.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    return np.concatenate([points, points[triangles].mean(axis=1)])
+
+
+def cluster_samples(samples, cluster_size=64):
+    """
+    Groups samples by a uniform grid sized for about cluster_size samples per occupied cell.
+
+    Returns:
+        Tuple (samples sorted by cluster, cluster offsets (C + 1,), centers (C, 3), radii (C,)).
+    """
+    lower = samples.min(axis=0)
+    extent = np.maximum(samples.max(axis=0) - lower, 1e-9)
+    # Cells for a surface: the occupied cell count grows with area, about (extent / cell)^2
+    cell = max(np.sqrt(np.sort(extent)[1:].prod() * cluster_size / len(samples)), extent.max() / 256)
+    cells = np.floor((samples - lower) / cell).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 2] * dims[1] + cells[:, 1]) * dims[0] + cells[:, 0]
+    order = np.argsort(keys, kind="stable")
+    samples, keys = samples[order], keys[order]
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    offsets = np.r_[starts, len(samples)]
+    counts = np.diff(offsets)
+    centers = np.add.reduceat(samples, starts, axis=0) / counts[:, None]
+    spread = np.linalg.norm(samples - np.repeat(centers, counts, axis=0), axis=1)
+    radii = np.maximum.reduceat(spread, starts)
+    return samples, offsets, centers, radii
+
+
+class CollisionMonitor:
+    def __init__(self, moving_polydata, cluster_size=64):
+        """
+        Args:
+            moving_polydata: Mesh of the dragged actor, in its own (mapper input) frame.
+            cluster_size: Average number of samples per broad phase cluster.
+        """
+        self.samples, self.offsets, self.centers, self.radii = cluster_samples(surface_samples(moving_polydata), cluster_size)
+        self.surfaces = []
+        self.last_result = None
+
+    def add_surface(self, field, actor=None, name=None):
+        """
+        Protects a surface.
+
+        Args:
+            field: SignedDistanceField of the surface in its mapper frame.
+            actor: Actor showing the surface, its matrix is applied on every check. None for a fixed surface.
+            name: Label used in reports.
+        """
+        self.surfaces.append({"field": field, "actor": actor, "name": name or f"surface {len(self.surfaces)}"})
+
+    def add_surface_file(self, surface_file, actor=None, resolution=128, spacing=None):
+        """
+        Protects a surface file, its distance field is loaded from (or written to) the cache.
+        """
+        field = load_distance_field(surface_file, resolution=resolution, spacing=spacing)
+        self.add_surface(field, actor, os.path.basename(surface_file))
+
+    def add_surface_data(self, polydata, actor=None, name=None, resolution=128, spacing=None):
+        """
+        Protects an in-memory surface, the distance field is built now and not cached.
+        """
+        self.add_surface(SignedDistanceField.build(polydata, resolution, spacing), actor, name)
+
+    def check(self, moving_matrix):
+        """
+        Minimum signed distance between the moving mesh and every protected surface.
+
+        Args:
+            moving_matrix: Current matrix of the moving actor (actor.GetMatrix()).
+
+        Returns:
+            Dictionary {"distance": smallest signed distance in mm (negative = penetration),
+                        "penetrating": bool, "surface": name of the closest surface,
+                        "point": world position of the closest sample, "time": seconds,
+                        "tested": samples looked up}.
+        """
+        start_time = time.perf_counter()
+        moving = matrix_to_numpy(moving_matrix) if isinstance(moving_matrix, vtk.vtkMatrix4x4) else moving_matrix
+        best = {"distance": np.inf, "penetrating": False, "surface": None, "point": None, "tested": 0}
+
+        for surface in self.surfaces:
+            field = surface["field"]
+            # Moving mesh frame -> protected surface frame
+            relative = moving
+            if surface["actor"] is not None:
+                relative = np.linalg.inv(matrix_to_numpy(surface["actor"].GetMatrix())) @ moving
+            rotation, translation = relative[:3, :3], relative[:3, 3]
+
+            # Broad phase: bounding spheres of the clusters
+            center_distance = field.distance(self.centers @ rotation.T + translation)
+            upper = np.min(center_distance + self.radii)
+            candidates = np.flatnonzero(center_distance - self.radii <= min(upper, best["distance"]))
+            if len(candidates) == 0:
+                continue
+
+            # Narrow phase: samples of the clusters that can hold the minimum
+            counts = self.offsets[candidates + 1] - self.offsets[candidates]
+            local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            indices = np.repeat(self.offsets[candidates], counts) + local
+            samples = self.samples[indices]
+            distances = field.distance(samples @ rotation.T + translation)
+            best["tested"] += len(indices)
+            closest = int(np.argmin(distances))
+            if distances[closest] < best["distance"]:
+                point = moving[:3, :3] @ samples[closest] + moving[:3, 3]
+                best.update(distance=float(distances[closest]), surface=surface["name"], point=point)
+
+        best["penetrating"] = best["distance"] < 0
+        best["time"] = time.perf_counter() - start_time
+        self.last_result = best
+        return best
+
+    def report(self, result=None):
+        result = result or self.last_result
+        if result is None or result["surface"] is None:
+            return "no protected surface"
+        state = "PENETRATION %.2f mm" % -result["distance"] if result["penetrating"] else "clearance %.2f mm" % result["distance"]
+        return f"{result['surface']}: {state} ({1000 * result['time']:.2f} ms, {result['tested']} samples)"
+
+
+if __name__ == "__main__":
+    screw = read_surface("data/36924050.stl")
+    # A finer screw mesh to check the frame budget with 100k+ triangles
+    subdivide = vtk.vtkLinearSubdivisionFilter()
+    subdivide.SetInputData(screw)
+    subdivide.SetNumberOfSubdivisions(2)
+    subdivide.Update()
+    print("moving triangles:", subdivide.GetOutput().GetNumberOfCells())
+
+    start_time = time.time()
+    monitor = CollisionMonitor(subdivide.GetOutput())
+    monitor.add_surface_file("data/screw_general.stl", resolution=128)
+    print("setup --- %s seconds ---" % (time.time() - start_time))
+
+    transform = vtk.vtkTransform()
+    transform.PostMultiply()
+    for offset in [40, 20, 10, 8, 5, 0]:
+        transform.Identity()
+        transform.RotateZ(30)
+        transform.Translate(offset, 0, 0)
+        monitor.check(transform.GetMatrix())
+        print(f"offset {offset}: {monitor.report()}")
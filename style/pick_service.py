@@ -0,0 +1,187 @@
+import numpy as np
+import vtkmodules.all as vtk
+
+'''
+Click-to-select picking for the custom trackball styles.
+Only registered actors are candidates, the volume and helper props are never tested.
+A click first goes through a screen-space prefilter: the world bounds of all candidates are
+projected at once with the camera matrix, and only actors whose screen rectangle contains the
+click are picked. A few remaining candidates are ray cast with a persistent vtkCellPicker on
+cell locators built at registration; many overlapping candidates go to one hardware selection
+pass (vtkPropPicker) restricted to them. Both pickers are created once and reused.
+Hardware selection is the default for every click that survives the prefilter, it gives the
+same actor as a plain vtkPropPicker. The locator ray path (ray_candidates > 0) is opt-in: its
+ray can pass between the triangles of a coarse implant mesh and select one hidden behind it.
+'''
+
+# Corners of a (xmin, xmax, ymin, ymax, zmin, zmax) box as indices into the bounds
+BOX_CORNERS = np.array([[x, y, z] for x in (0, 1) for y in (2, 3) for z in (4, 5)])
+
+
+class PickService:
+    def __init__(self, renderer, ray_candidates=0):
+        """
+        Args:
+            renderer: Renderer the clicks are picked in.
+            ray_candidates: At most this many candidates after the prefilter are ray cast on the
+                cell locators instead of using hardware selection, 0 always uses hardware selection.
+        """
+        self.renderer = renderer
+        self.ray_candidates = ray_candidates
+        self.actors = []
+        self.locators = {}
+
+        self.cell_picker = vtk.vtkCellPicker()
+        self.cell_picker.PickFromListOn()
+        self.prop_picker = vtk.vtkPropPicker()
+        self.prop_picker.PickFromListOn()
+        self.last_path = None
+        self.pick_position = None
+
+    @classmethod
+    def from_renderer(cls, renderer, **kwargs):
+        """
+        A service with every pickable actor of the renderer registered.
+        """
+        service = cls(renderer, **kwargs)
+        actors = renderer.GetActors()
+        actors.InitTraversal()
+        for _ in range(actors.GetNumberOfItems()):
+            actor = actors.GetNextActor()
+            if actor.GetPickable():
+                service.add_actor(actor)
+        return service
+
+    def add_actor(self, actor):
+        """
+        Registers an actor as pickable and builds a cell locator for its mapper input.
+        """
+        if actor in self.actors:
+            return
+        self.actors.append(actor)
+        data = actor.GetMapper().GetInput() if actor.GetMapper() is not None else None
+        if isinstance(data, vtk.vtkDataSet) and data.GetNumberOfCells() > 0:
+            locator = vtk.vtkStaticCellLocator()
+            locator.SetDataSet(data)
+            locator.BuildLocator()
+            self.locators[actor] = locator
+            self.cell_picker.AddLocator(locator)
+
+    def remove_actor(self, actor):
+        if actor not in self.actors:
+            return
+        self.actors.remove(actor)
+        locator = self.locators.pop(actor, None)
+        if locator is not None:
+            self.cell_picker.RemoveLocator(locator)
+
+    def screen_candidates(self, x, y):
+        """
+        Registered, visible actors whose projected bounds contain the display position (x, y).
+        """
+        actors = [actor for actor in self.actors if actor.GetVisibility() and actor.GetPickable()]
+        if not actors:
+            return []
+        bounds = np.array([actor.GetBounds() for actor in actors])
+        # (N, 8, 4) homogeneous corners
+        corners = np.concatenate([bounds[:, BOX_CORNERS], np.ones((len(actors), 8, 1))], axis=2)
+
+        camera = self.renderer.GetActiveCamera()
+        matrix = camera.GetCompositeProjectionTransformMatrix(self.renderer.GetTiledAspectRatio(), -1, 1)
+        projection = np.array([[matrix.GetElement(i, j) for j in range(4)] for i in range(4)])
+        clip = corners @ projection.T
+        w = clip[..., 3]
+        # A box reaching behind the camera has no finite screen rectangle, keep it
+        behind = np.any(w <= 1e-12, axis=1)
+        ndc = clip[..., :2] / np.where(w > 1e-12, w, 1.0)[..., None]
+
+        size = np.array(self.renderer.GetSize())
+        origin = np.array(self.renderer.GetOrigin())
+        display = origin + (ndc + 1) * 0.5 * size
+        lower, upper = display.min(axis=1), display.max(axis=1)
+        inside = (lower[:, 0] <= x) & (x <= upper[:, 0]) & (lower[:, 1] <= y) & (y <= upper[:, 1])
+        return [actor for actor, keep in zip(actors, inside | behind) if keep]
+
+    def pick(self, x, y):
+        """
+        Picks the closest registered actor under the display position (x, y).
+
+        Returns:
+            The actor or None.
+        """
+        candidates = self.screen_candidates(x, y)
+        self.last_path = "prefilter"
+        self.pick_position = None
+        if not candidates:
+            return None
+
+        if len(candidates) <= self.ray_candidates:
+            self.last_path = "ray"
+            picker = self.cell_picker
+        else:
+            self.last_path = "hardware"
+            picker = self.prop_picker
+        picker.InitializePickList()
+        for actor in candidates:
+            picker.AddPickList(actor)
+        picker.Pick(x, y, 0, self.renderer)
+        if picker.GetActor() is not None:
+            self.pick_position = picker.GetPickPosition()
+        return picker.GetActor()
+
+
+if __name__ == "__main__":
+    import time
+
+    renderer = vtk.vtkRenderer()
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetSize(800, 600)
+    render_window.AddRenderer(renderer)
+
+    reader = vtk.vtkSTLReader()
+    reader.SetFileName("data/36924050.stl")
+    reader.Update()
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputData(reader.GetOutput())
+
+    # Dozens of implants in a row
+    screws = []
+    for i in range(48):
+        actor = vtk.vtkActor()
+        actor.SetMapper(mapper)
+        actor.SetPosition(20 * (i % 12), 0, 80 * (i // 12))
+        renderer.AddActor(actor)
+        screws.append(actor)
+
+    volume_reader = vtk.vtkMetaImageReader()
+    volume_reader.SetFileName("data/L1.mhd")
+    volume_mapper = vtk.vtkSmartVolumeMapper()
+    volume_mapper.SetInputConnection(volume_reader.GetOutputPort())
+    volume = vtk.vtkVolume()
+    volume.SetMapper(volume_mapper)
+    renderer.AddVolume(volume)
+    renderer.ResetCamera()
+    render_window.Render()
+
+    service = PickService.from_renderer(renderer)
+    clicks = [(int(x), int(y)) for x, y in np.random.default_rng(0).uniform((0, 0), (800, 600), (50, 2))]
+    # Centers of a few screws as hits
+    for actor in screws[::6]:
+        point = [0, 0, 0]
+        vtk.vtkInteractorObserver.ComputeWorldToDisplay(renderer, *actor.GetCenter(), point)
+        clicks.append((int(point[0]), int(point[1])))
+
+    start_time = time.time()
+    old_hits = []
+    for x, y in clicks:
+        picker = vtk.vtkPropPicker()
+        picker.Pick(x, y, 0, renderer)
+        old_hits.append(picker.GetActor())
+    print("new vtkPropPicker per click --- %s seconds ---" % ((time.time() - start_time) / len(clicks)))
+
+    start_time = time.time()
+    new_hits = [service.pick(x, y) for x, y in clicks]
+    print("PickService --- %s seconds ---" % ((time.time() - start_time) / len(clicks)))
+    print("same actors:", sum(a is b for a, b in zip(old_hits, new_hits)), "of", len(clicks),
+          ", hits:", sum(a is not None for a in new_hits))
@@ -13,6 +13,8 @@ from vtkmodules.vtkRenderingCore import (
     vtkRenderWindowInteractor,
     vtkRenderer
 )
+from collision_monitor import CollisionMonitor
+from pick_service import PickService
 
 def set_volume_properties_default(volumeProperty):
     # Create color transfer function
@@ -94,19 +96,41 @@ class myStyleTrackballActor(vtkInteractorStyleTrackballActor):
         # selected actor
         self.selectedActor = None
         self.trackballcam = False
-    
+        # persistent picker over the draggable actors, every pickable actor of the renderer if not set
+        self.pickService = None
+        # optional collision monitoring, CollisionMonitor per draggable actor
+        self.collisionMonitors = {}
+        self.collisionColors = {}
+
+    def AddCollisionMonitor(self, actor, monitor):
+        self.collisionMonitors[actor] = monitor
+        self.collisionColors[actor] = actor.GetProperty().GetColor()
+
+    def CheckCollision(self, actor):
+        monitor = self.collisionMonitors.get(actor)
+        if monitor is None:
+            return None
+        result = monitor.check(actor.GetMatrix())
+        # red while penetrating a protected surface
+        if result["penetrating"]:
+            actor.GetProperty().SetColor(1, 0, 0)
+        else:
+            actor.GetProperty().SetColor(self.collisionColors[actor])
+        print(monitor.report(result))
+        return result
+
     def OnLeftButtonDown(self, obj, event):
-        # pick prop, volume actor can not be picked
-        picker = vtk.vtkPropPicker()
-        picker.Pick(self.GetInteractor().GetEventPosition()[0],
-                    self.GetInteractor().GetEventPosition()[1],
-                    0, self.GetDefaultRenderer())
+        # pick among the registered actors only, volume actor can not be picked
+        if self.pickService is None:
+            self.pickService = PickService.from_renderer(self.GetDefaultRenderer())
+        actor = self.pickService.pick(self.GetInteractor().GetEventPosition()[0],
+                                      self.GetInteractor().GetEventPosition()[1])
         # check if pick actor
-        if picker.GetActor() == None:
+        if actor == None:
             self.selectedActor = None
             self.trackballcam = True
             return
-        self.selectedActor = picker.GetActor()
+        self.selectedActor = actor
         # print("Selected actor:", self.selectedActor)
         self.trackballcam = False
         # print("Left button down")
@@ -168,6 +192,7 @@ class myStyleTrackballActor(vtkInteractorStyleTrackballActor):
             # transform.Translate(x - x0, y - y0, 0)
             transform.Translate(motion_vector[0], motion_vector[1], motion_vector[2])
             self.selectedActor.SetUserTransform(transform)
+            self.CheckCollision(self.selectedActor)
             # render
             self.GetInteractor().GetRenderWindow().Render()
     
@@ -220,6 +245,26 @@ def main():
     volume.PickableOff()
     ren.AddVolume(volume)
 
+    # protect the no-fly zone while dragging the screw
+    noflyzone = vtk.vtkPolyDataReader()
+    noflyzone.SetFileName("data/noflyzone.vtk")
+    noflyzone.Update()
+    noflyzoneMapper = vtkPolyDataMapper()
+    noflyzoneMapper.SetInputData(noflyzone.GetOutput())
+    noflyzoneActor = vtkActor()
+    noflyzoneActor.SetMapper(noflyzoneMapper)
+    noflyzoneActor.GetProperty().SetColor(colors.GetColor3d('SteelBlue'))
+    noflyzoneActor.GetProperty().SetOpacity(0.3)
+    noflyzoneActor.PickableOff()
+    ren.AddActor(noflyzoneActor)
+    monitor = CollisionMonitor(stl)
+    monitor.add_surface_file("data/noflyzone.vtk", noflyzoneActor, resolution=256)
+    style.AddCollisionMonitor(screwActor, monitor)
+
+    # only the screw can be selected
+    style.pickService = PickService(ren)
+    style.pickService.add_actor(screwActor)
+
     # add axes to the renderer
     axes = vtk.vtkAxesActor()
     axes.SetTotalLength(20, 20, 20)
@@ -13,6 +13,7 @@ from vtkmodules.vtkRenderingCore import (
     vtkRenderWindowInteractor,
     vtkRenderer
 )
+from collision_monitor import CollisionMonitor
 
 def readstl(filename):
     reader = vtk.vtkSTLReader()
@@ -89,6 +90,22 @@ def main():
     print("screw actor center:", screwActor.GetCenter())
     ren.AddActor(screwActor)
 
+    # report the screw distance to the sphere and the cone while dragging
+    sphereSource.Update()
+    cone.Update()
+    monitor = CollisionMonitor(stl)
+    monitor.add_surface_data(sphereSource.GetOutput(), actor, "sphere")
+    monitor.add_surface_data(cone.GetOutput(), coneActor, "cone")
+    screwColor = screwActor.GetProperty().GetColor()
+
+    def check_collision(obj, event):
+        result = monitor.check(screwActor.GetMatrix())
+        # red while penetrating
+        screwActor.GetProperty().SetColor((1, 0, 0) if result["penetrating"] else screwColor)
+        print(monitor.report(result))
+
+    style.AddObserver("InteractionEvent", check_collision)
+
     # add axes to the renderer
     axes = vtk.vtkAxesActor()
     axes.SetTotalLength(10, 10, 10)
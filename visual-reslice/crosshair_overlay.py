@@ -0,0 +1,115 @@
+import numpy as np
+import vtkmodules.all as vtk
+from vtkmodules.util import numpy_support
+
+'''
+Persistent crosshair overlay for multi-view reslice viewers.
+The line endpoints of all views live in one preallocated NumPy point buffer shared by
+one vtkPolyData per view, so moving a line only writes coordinates in place.
+commit() marks the buffer modified once per frame, no sources or mappers are recreated.
+'''
+
+class CrosshairOverlay:
+    def __init__(self, num_views, lines_per_view=2, line_width=2):
+        """
+        Args:
+            num_views: Number of views (renderers) showing crosshair lines.
+            lines_per_view: Number of lines in every view.
+            line_width: Line width in pixels.
+        """
+        self.num_views = num_views
+        self.lines_per_view = lines_per_view
+        self.modified = False
+
+        # Two endpoints per line, view-major: point 2 * (view * lines_per_view + line) + {0, 1}
+        self.point_buffer = np.zeros((num_views * lines_per_view * 2, 3), dtype=np.float64)
+        self.points = vtk.vtkPoints()
+        self.points.SetData(numpy_support.numpy_to_vtk(self.point_buffer, deep=False))
+
+        self.color_buffers = []
+        self.actors = []
+        for view in range(num_views):
+            lines = vtk.vtkCellArray()
+            for line in range(lines_per_view):
+                first = self.point_index(view, line)
+                lines.InsertNextCell(2)
+                lines.InsertCellPoint(first)
+                lines.InsertCellPoint(first + 1)
+
+            colors = np.full((lines_per_view, 3), 255, dtype=np.uint8)
+            color_array = numpy_support.numpy_to_vtk(colors, deep=False)
+            color_array.SetName("Colors")
+            self.color_buffers.append((colors, color_array))
+
+            polydata = vtk.vtkPolyData()
+            polydata.SetPoints(self.points)
+            polydata.SetLines(lines)
+            polydata.GetCellData().SetScalars(color_array)
+
+            mapper = vtk.vtkPolyDataMapper()
+            mapper.SetInputData(polydata)
+            mapper.SetColorModeToDirectScalars()
+            mapper.SetScalarModeToUseCellData()
+
+            actor = vtk.vtkActor()
+            actor.SetMapper(mapper)
+            actor.GetProperty().SetLineWidth(line_width)
+            self.actors.append(actor)
+
+    def point_index(self, view, line):
+        return 2 * (view * self.lines_per_view + line)
+
+    def get_actor(self, view):
+        return self.actors[view]
+
+    def set_line_color(self, view, line, color):
+        colors, color_array = self.color_buffers[view]
+        colors[line] = np.round(np.asarray(color) * 255)
+        color_array.Modified()
+
+    def line_points(self, view):
+        """
+        Writable (lines_per_view * 2, 3) view of the endpoints of one view.
+        """
+        first = self.point_index(view, 0)
+        return self.point_buffer[first:first + 2 * self.lines_per_view]
+
+    def set_line(self, view, line, p1, p2):
+        first = self.point_index(view, line)
+        self.point_buffer[first] = p1
+        self.point_buffer[first + 1] = p2
+        self.modified = True
+
+    def set_line_through(self, view, line, center, direction, length):
+        """
+        Places a line of the given half-length through center along direction.
+        """
+        center = np.asarray(center, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        self.set_line(view, line, center - length * direction, center + length * direction)
+
+    def commit(self):
+        """
+        Publishes all line changes since the last commit, call once per frame before rendering.
+        """
+        if self.modified:
+            self.points.Modified()
+            self.modified = False
+
+
+if __name__ == "__main__":
+    overlay = CrosshairOverlay(num_views=1)
+    overlay.set_line_color(0, 0, (1, 0, 0))
+    overlay.set_line_color(0, 1, (0, 1, 0))
+    overlay.set_line_through(0, 0, (0, 0, 0), (1, 0, 0), 100)
+    overlay.set_line_through(0, 1, (0, 0, 0), (0, 1, 0), 100)
+    overlay.commit()
+
+    renderer = vtk.vtkRenderer()
+    renderer.AddActor(overlay.get_actor(0))
+    render_window = vtk.vtkRenderWindow()
+    render_window.AddRenderer(renderer)
+    interactor = vtk.vtkRenderWindowInteractor()
+    interactor.SetRenderWindow(render_window)
+    render_window.Render()
+    interactor.Start()
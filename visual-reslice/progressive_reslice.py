@@ -0,0 +1,115 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from volume_pyramid import VolumePyramid
+
+'''
+Progressive-resolution reslicing for interactive viewers.
+While the user drags or scrolls, the reslices read a block-averaged pyramid level of the volume
+with nearest neighbour sampling and a coarser output spacing. When no interaction happened
+for idle_ms, the viewer is told to refine, and the reslices go back to the full-resolution
+volume with their normal interpolation.
+'''
+
+class ProgressiveReslice:
+    def __init__(self, image_data, reslices, shrink_factor=4, idle_ms=250, output_spacing=None, pyramid=None):
+        """
+        Args:
+            image_data: Full-resolution vtkImageData the reslices read.
+            reslices: vtkImageReslice filters to switch between preview and full resolution.
+            shrink_factor: Downsampling factor of the preview volume along every axis.
+            idle_ms: Time without interaction after which the full resolution is restored.
+            output_spacing: Output spacing the reslices use at full resolution, None for the VTK default.
+            pyramid: VolumePyramid of image_data to take the preview level from, built if None.
+        """
+        self.image_data = image_data
+        self.reslices = list(reslices)
+        self.idle_ms = idle_ms
+        self.output_spacing = output_spacing
+        self.interpolation_modes = [reslice.GetInterpolationMode() for reslice in self.reslices]
+
+        # Block-averaged preview volume, built once
+        if pyramid is None:
+            pyramid = VolumePyramid(image_data, factors=(shrink_factor,))
+        self.pyramid = pyramid
+        self.preview_data = pyramid.level(shrink_factor)
+
+        base_spacing = output_spacing if output_spacing is not None else (min(image_data.GetSpacing()),) * 3
+        self.preview_spacing = tuple(shrink_factor * s for s in base_spacing)
+
+        self.preview = False
+        self.interactor = None
+        self.timer_id = None
+        self.on_idle = None
+
+    def set_preview(self, preview):
+        """
+        Switches all reslices between the preview and the full-resolution volume.
+
+        Returns:
+            True if the mode changed, the reslices must then be updated even if their planes did not move.
+        """
+        if preview == self.preview:
+            return False
+        self.preview = preview
+        for reslice, mode in zip(self.reslices, self.interpolation_modes):
+            if preview:
+                reslice.SetInputData(self.preview_data)
+                reslice.SetInterpolationModeToNearestNeighbor()
+                reslice.SetOutputSpacing(self.preview_spacing)
+            else:
+                reslice.SetInputData(self.image_data)
+                reslice.SetInterpolationMode(mode)
+                if self.output_spacing is not None:
+                    reslice.SetOutputSpacing(self.output_spacing)
+                else:
+                    reslice.SetOutputSpacingToDefault()
+        return True
+
+    def attach(self, interactor, on_idle):
+        """
+        Calls on_idle() once the interaction paused for idle_ms, see touch().
+        """
+        self.interactor = interactor
+        self.on_idle = on_idle
+        interactor.AddObserver("TimerEvent", self.on_timer)
+
+    def touch(self):
+        """
+        Marks an interaction: restarts the idle timer.
+        """
+        if self.interactor is None:
+            return
+        if self.timer_id is not None:
+            self.interactor.DestroyTimer(self.timer_id)
+        self.timer_id = self.interactor.CreateOneShotTimer(self.idle_ms)
+
+    def begin_interaction(self):
+        """
+        Switches to the preview and restarts the idle timer. Without an attached interactor
+        nothing would refine again, so the full resolution is kept.
+
+        Returns:
+            True if the mode changed.
+        """
+        if self.interactor is None:
+            return False
+        self.touch()
+        return self.set_preview(True)
+
+    def end_interaction(self):
+        """
+        Switches back to full resolution, usually from on_idle. Returns True if the mode changed.
+        """
+        if self.timer_id is not None:
+            self.interactor.DestroyTimer(self.timer_id)
+            self.timer_id = None
+        return self.set_preview(False)
+
+    def on_timer(self, obj, event):
+        if self.timer_id is None or obj.GetTimerEventId() != self.timer_id:
+            return
+        self.timer_id = None
+        if self.on_idle is not None:
+            self.on_idle()
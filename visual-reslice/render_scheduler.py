@@ -0,0 +1,134 @@
+import threading
+import time
+
+'''
+Asynchronous update scheduler for the interactive viewers.
+Key presses only post the latest view state, a newer state replaces a pending one,
+so holding a key down never builds a backlog. A worker thread computes the reslices
+of the latest state, and a repeating interactor timer presents the newest finished
+result on the render thread, at most max_fps times per second.
+'''
+
+class RenderScheduler:
+    def __init__(self, compute, present, merge=None, max_fps=30):
+        """
+        Args:
+            compute: Called on the worker thread with a state, returns a result. Must not touch
+                     the rendered pipeline.
+            present: Called on the render thread with a result, updates actors and renders.
+            merge: Optional merge(previous, latest) -> result, used when a finished result is
+                   replaced before it was presented.
+            max_fps: Frame rate cap of the presentation.
+        """
+        self.compute = compute
+        self.present = present
+        self.merge = merge
+        self.interval_ms = max(1, int(round(1000 / max_fps)))
+
+        self.condition = threading.Condition()
+        self.pending_state = None
+        self.pending_time = None
+        self.result = None
+        self.result_time = None
+        self.running = True
+        self.busy = False
+
+        # Statistics
+        self.requests = 0
+        self.computed = 0
+        self.presented = 0
+        self.latency = 0.0  # seconds from the request to the presentation of the last frame
+
+        self.interactor = None
+        self.timer_id = None
+        self.worker = threading.Thread(target=self.work_loop, daemon=True)
+        self.worker.start()
+
+    def attach(self, interactor):
+        """
+        Presents results from a repeating timer of an initialized interactor.
+        """
+        self.interactor = interactor
+        interactor.AddObserver("TimerEvent", self.on_timer)
+        self.timer_id = interactor.CreateRepeatingTimer(self.interval_ms)
+
+    def request(self, state):
+        """
+        Posts a new view state, an older state that was not computed yet is dropped.
+        """
+        with self.condition:
+            if self.pending_time is None:
+                self.pending_time = time.perf_counter()
+            self.pending_state = state
+            self.requests += 1
+            self.condition.notify()
+
+    def work_loop(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending_state is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                state, request_time = self.pending_state, self.pending_time
+                self.pending_state = None
+                self.pending_time = None
+                self.busy = True
+
+            result = self.compute(state)
+
+            with self.condition:
+                if self.result is not None:
+                    # The previous result was never presented
+                    if self.merge is not None:
+                        result = self.merge(self.result, result)
+                    request_time = self.result_time
+                self.result = result
+                self.result_time = request_time
+                self.computed += 1
+                self.busy = False
+
+    def poll(self):
+        """
+        Presents the newest finished result, if any. Returns True if a frame was presented.
+        """
+        with self.condition:
+            result, request_time = self.result, self.result_time
+            self.result = None
+            self.result_time = None
+        if result is None:
+            return False
+        self.present(result)
+        self.presented += 1
+        self.latency = time.perf_counter() - request_time
+        return True
+
+    def on_timer(self, obj, event):
+        self.poll()
+
+    def flush(self, timeout=None):
+        """
+        Waits until all posted states are computed and presents the result.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            with self.condition:
+                idle = self.pending_state is None and not self.busy
+            if idle:
+                break
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            time.sleep(0.001)
+        return self.poll()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.interactor is not None and self.timer_id is not None:
+            self.interactor.DestroyTimer(self.timer_id)
+        self.worker.join()
+
+    def report(self):
+        return (f"{self.requests} requests, {self.computed} computed, {self.presented} presented, "
+                f"last latency {1000 * self.latency:.1f} ms")
@@ -0,0 +1,227 @@
+import time
+import numpy as np
+import vtkmodules.all as vtk
+
+'''
+Three-view oblique reslice engine for the trajectory viewers.
+One implant pose drives the three views, each slicing along one implant axis.
+All three plane matrices are computed in one vectorized NumPy step, written into persistent
+vtkMatrix4x4 objects, and only views whose plane actually changed are resliced.
+Per-view dirty flags and reslice timings are exposed for the viewers.
+frame() snapshots an update, so the engine can run on a worker thread and the
+render thread only swaps in finished images.
+'''
+
+# Implant axes used as slice x, y and normal by the view along implant axis 0, 1 and 2
+VIEW_PERMUTATIONS = np.array([[1, 2, 0],
+                              [2, 0, 1],
+                              [0, 1, 2]])
+
+
+def matrix_to_numpy(matrix):
+    return np.array(matrix.GetData(), dtype=np.float64).reshape(4, 4)
+
+
+def numpy_to_matrix(array, matrix=None):
+    if matrix is None:
+        matrix = vtk.vtkMatrix4x4()
+    matrix.DeepCopy(array.ravel().tolist())
+    return matrix
+
+
+def compute_plane_matrices(pose, slice_offsets):
+    """
+    Computes the reslice axes of all three views at once.
+
+    Args:
+        pose: 4x4 NumPy implant pose.
+        slice_offsets: Offset of each view along its slice normal, in mm.
+
+    Returns:
+        NumPy array (3, 4, 4), one reslice axes matrix per view.
+    """
+    planes = np.zeros((3, 4, 4))
+    planes[:, 3, 3] = 1.0
+    # rotation[:, permutation] has shape (rows, views, columns)
+    planes[:, :3, :3] = pose[:3, :3][:, VIEW_PERMUTATIONS].transpose(1, 0, 2)
+    planes[:, :3, 3] = pose[:3, 3] + np.asarray(slice_offsets, dtype=np.float64)[:, None] * planes[:, :3, 2]
+    return planes
+
+
+def plane_through_implant(plane, pose):
+    """
+    The same plane moved back through the implant position, i.e. without slice offset.
+    """
+    plane = plane.copy()
+    plane[:3, 3] = pose[:3, 3]
+    return plane
+
+
+class ResliceEngine:
+    def __init__(self, image_data, implant_transform, interpolation="linear", output_spacing=None):
+        """
+        Args:
+            image_data: vtkImageData volume.
+            implant_transform: vtkTransform of the implant pose, shared with the viewer.
+            interpolation: "linear", "cubic" or "nearest".
+            output_spacing: Optional output spacing of the reslices.
+        """
+        self.image_data = image_data
+        self.implant_transform = implant_transform
+        self.slice_offsets = np.zeros(3)
+
+        self.axes = [vtk.vtkMatrix4x4() for _ in range(3)]
+        self.reslices = []
+        for axes in self.axes:
+            reslice = vtk.vtkImageReslice()
+            reslice.SetInputData(image_data)
+            reslice.SetOutputDimensionality(2)
+            if interpolation == "cubic":
+                reslice.SetInterpolationModeToCubic()
+            elif interpolation == "nearest":
+                reslice.SetInterpolationModeToNearestNeighbor()
+            else:
+                reslice.SetInterpolationModeToLinear()
+            if output_spacing is not None:
+                reslice.SetOutputSpacing(output_spacing)
+            # The matrix object is kept, updates only rewrite its elements
+            reslice.SetResliceAxes(axes)
+            self.reslices.append(reslice)
+
+        self.pose = None
+        self.planes = None
+        self.implant_in_planes = None
+        self.dirty = [True, True, True]
+        self.timings = [0.0, 0.0, 0.0]  # seconds spent reslicing each view in the last update
+        self.update_time = 0.0  # seconds spent in the last update
+
+    def get_output_port(self, axis):
+        return self.reslices[axis].GetOutputPort()
+
+    def set_slice_offset(self, axis, offset):
+        self.slice_offsets[axis] = offset
+
+    def update(self, force=False, pose=None):
+        """
+        Recomputes the three planes from the current implant pose and slice offsets,
+        and reslices the views whose plane changed.
+
+        Args:
+            force: Reslice all views.
+            pose: 4x4 NumPy implant pose snapshot, read from implant_transform if None.
+                  Pass a snapshot when updating from a worker thread.
+
+        Returns:
+            List of per-view dirty flags, True where the view was resliced.
+        """
+        start_time = time.perf_counter()
+        if pose is None:
+            pose = matrix_to_numpy(self.implant_transform.GetMatrix())
+        planes = compute_plane_matrices(pose, self.slice_offsets)
+        if force or self.planes is None:
+            changed = np.ones(3, dtype=bool)
+        else:
+            changed = np.any(planes != self.planes, axis=(1, 2))
+        if force or self.pose is None or np.any(pose != self.pose):
+            # The implant moved, its pose in every plane changes even if a plane did not
+            self.implant_in_planes = np.linalg.inv(planes) @ pose
+        elif changed.any():
+            self.implant_in_planes[changed] = np.linalg.inv(planes[changed]) @ pose
+        self.pose = pose
+        self.planes = planes
+
+        self.timings = [0.0, 0.0, 0.0]
+        for axis in np.flatnonzero(changed):
+            reslice_start = time.perf_counter()
+            numpy_to_matrix(planes[axis], self.axes[axis])
+            self.reslices[axis].Update()
+            self.timings[axis] = time.perf_counter() - reslice_start
+        self.dirty = changed.tolist()
+        self.update_time = time.perf_counter() - start_time
+        return self.dirty
+
+    def reslice_matrix(self, axis):
+        """
+        Current reslice axes of a view, including its slice offset.
+        """
+        return self.axes[axis]
+
+    def base_matrix(self, axis):
+        """
+        Reslice axes of a view through the implant position, without slice offset.
+        """
+        return numpy_to_matrix(plane_through_implant(self.planes[axis], self.pose))
+
+    def implant_matrix(self, axis):
+        """
+        Implant pose in the plane coordinates of a view, the user matrix of its implant actor.
+        """
+        return numpy_to_matrix(self.implant_in_planes[axis])
+
+    def timing_report(self):
+        views = ", ".join(f"view {axis}: {1000 * t:.2f} ms" for axis, t in enumerate(self.timings) if self.dirty[axis])
+        return f"update {1000 * self.update_time:.2f} ms ({views or 'no view changed'})"
+
+    def frame(self):
+        """
+        Snapshot of the last update, see ResliceFrame.
+        """
+        return ResliceFrame(self)
+
+
+class ResliceFrame:
+    """
+    Result of one engine update that can be handed from a worker thread to the render thread.
+    Holds copies of the planes and the resliced images of the views that changed.
+    """
+    def __init__(self, engine):
+        self.pose = engine.pose.copy()
+        self.planes = engine.planes.copy()
+        self.implant_in_planes = engine.implant_in_planes.copy()
+        self.slice_offsets = engine.slice_offsets.copy()
+        self.dirty = list(engine.dirty)
+        self.timings = list(engine.timings)
+        self.update_time = engine.update_time
+        self.images = [None, None, None]
+        for axis in np.flatnonzero(self.dirty):
+            image = vtk.vtkImageData()
+            image.DeepCopy(engine.reslices[axis].GetOutput())
+            self.images[axis] = image
+
+    def merge_unpresented(self, previous):
+        """
+        Takes over the images of an older frame that was never presented.
+        A view not resliced in this frame has the same plane as in the older one.
+        """
+        for axis in range(3):
+            if previous.dirty[axis] and not self.dirty[axis]:
+                self.images[axis] = previous.images[axis]
+                self.dirty[axis] = True
+        return self
+
+    def reslice_matrix(self, axis):
+        return numpy_to_matrix(self.planes[axis])
+
+    def base_matrix(self, axis):
+        return numpy_to_matrix(plane_through_implant(self.planes[axis], self.pose))
+
+    def implant_matrix(self, axis):
+        return numpy_to_matrix(self.implant_in_planes[axis])
+
+
+if __name__ == "__main__":
+    reader = vtk.vtkMetaImageReader()
+    reader.SetFileName("data/L1.mhd")
+    reader.Update()
+
+    implant_transform = vtk.vtkTransform()
+    implant_transform.PostMultiply()
+    implant_transform.Translate(reader.GetOutput().GetCenter())
+    engine = ResliceEngine(reader.GetOutput(), implant_transform)
+    print(engine.update(), engine.timing_report())
+
+    engine.set_slice_offset(2, 1.0)
+    print(engine.update(), engine.timing_report())
+
+    implant_transform.RotateWXYZ(5, 0, 0, 1)
+    print(engine.update(), engine.timing_report())
@@ -1,11 +1,13 @@
+import os
+import sys
 import vtkmodules.all as vtk
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from raw_cache import load_mhd
+
 # Load the MHD file using VTK
 def load_mhd_file(file_path):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(file_path)
-    reader.Update()
-    return reader.GetOutput()
+    return load_mhd(file_path)
 
 # Configure the image reslice for viewing slices
 def create_reslice(image_data):
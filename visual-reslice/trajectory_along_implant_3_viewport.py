@@ -1,41 +1,20 @@
+import os
+import sys
 import vtkmodules.all as vtk
+from reslice_engine import ResliceEngine
+from progressive_reslice import ProgressiveReslice
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from raw_cache import load_mhd
 
 
 def load_mhd_file(file_path):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(file_path)
-    reader.Update()
-    return reader.GetOutput()
-
-
-def create_reslice_matrix_from_transform(transform, axis):
-    m = transform.GetMatrix()
-    axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            axes.SetElement(i, j, m.GetElement(i, j))
-        axes.SetElement(i, 3, m.GetElement(i, 3))
-
-    permute = [0, 1, 2]
-    if axis == 0:
-        permute = [1, 2, 0]
-    elif axis == 1:
-        permute = [2, 0, 1]
-    elif axis == 2:
-        permute = [0, 1, 2]
-
-    new_axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            new_axes.SetElement(i, j, axes.GetElement(i, permute[j]))
-        new_axes.SetElement(i, 3, axes.GetElement(i, 3))
-
-    return new_axes
-
-
-def apply_window_level(reslice_output, window, level):
+    return load_mhd(file_path)
+
+
+def apply_window_level(output_port, window, level):
     color_map = vtk.vtkImageMapToWindowLevelColors()
-    color_map.SetInputConnection(reslice_output.GetOutputPort())
+    color_map.SetInputConnection(output_port)
     color_map.SetWindow(window)
     color_map.SetLevel(level)
     return color_map
@@ -57,30 +36,15 @@ def create_cylinder_actor():
     return actor
 
 
-def apply_reslice_transform_to_actor(actor, reslice_matrix, implant_matrix):
-    inverse_reslice = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Invert(reslice_matrix, inverse_reslice)
-
-    final_matrix = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Multiply4x4(inverse_reslice, implant_matrix, final_matrix)
-
-    actor.SetUserMatrix(final_matrix)
-
-
 class View:
-    def __init__(self, image_data, implant_transform, axis, viewport, render_window):
-        self.image_data = image_data
-        self.implant_transform = implant_transform
+    def __init__(self, engine, axis, viewport, render_window):
+        self.engine = engine
+        self.implant_transform = engine.implant_transform
         self.axis = axis
         self.viewport = viewport
         self.render_window = render_window
 
-        self.reslice = vtk.vtkImageReslice()
-        self.reslice.SetInputData(image_data)
-        self.reslice.SetOutputDimensionality(2)
-        self.reslice.SetInterpolationModeToLinear()
-
-        self.color_map = apply_window_level(self.reslice, window=400, level=40)
+        self.color_map = apply_window_level(engine.get_output_port(axis), window=400, level=40)
 
         self.image_actor = vtk.vtkImageActor()
         self.image_actor.GetMapper().SetInputConnection(self.color_map.GetOutputPort())
@@ -100,15 +64,10 @@ class View:
         self.renderer.ResetCamera()
 
     def update_reslice(self):
-        new_reslice_matrix = create_reslice_matrix_from_transform(self.implant_transform, self.axis)
-        self.reslice.SetResliceAxes(new_reslice_matrix)
-        self.reslice.Update()
-        self.color_map.Update()
-        apply_reslice_transform_to_actor(
-            self.implant_actor,
-            new_reslice_matrix,
-            self.implant_transform.GetMatrix()
-        )
+        # The engine already resliced this view, skip the image work when its plane did not change
+        if self.engine.dirty[self.axis]:
+            self.color_map.Update()
+            self.implant_actor.SetUserMatrix(self.engine.implant_matrix(self.axis))
         self.renderer.ResetCamera()
 
 
@@ -125,14 +84,21 @@ class ViewManager:
         self.interactor = vtk.vtkRenderWindowInteractor()
         self.interactor.SetRenderWindow(self.render_window)
 
+        # One engine reslices all three views from the shared implant pose
+        self.engine = ResliceEngine(image_data, self.implant_transform)
+        self.engine.update()
         self.views = [
-            View(image_data, self.implant_transform, 0, (0.0, 0.0, 0.33, 1.0), self.render_window),
-            View(image_data, self.implant_transform, 1, (0.33, 0.0, 0.66, 1.0), self.render_window),
-            View(image_data, self.implant_transform, 2, (0.66, 0.0, 1.0, 1.0), self.render_window),
+            View(self.engine, 0, (0.0, 0.0, 0.33, 1.0), self.render_window),
+            View(self.engine, 1, (0.33, 0.0, 0.66, 1.0), self.render_window),
+            View(self.engine, 2, (0.66, 0.0, 1.0, 1.0), self.render_window),
         ]
 
         self.interactor.AddObserver("KeyPressEvent", self.keypress_callback)
 
+        # Coarse nearest-neighbour preview while keys are pressed, full resolution after a short pause
+        self.progressive = ProgressiveReslice(image_data, self.engine.reslices)
+        self.progressive.attach(self.interactor, self.refine)
+
     def keypress_callback(self, obj, event):
         key = obj.GetKeySym()
         ctrl = obj.GetControlKey()
@@ -159,11 +125,23 @@ class ViewManager:
             self.implant_transform.Translate(-center[0], -center[1], -center[2])
             self.implant_transform.RotateWXYZ(angle, *axis)
             self.implant_transform.Translate(center[0], center[1], center[2])
+        else:
+            # Unrelated key, keep the current views at full resolution
+            return
 
+        # Switching to the preview changes every view, even those whose plane did not move
+        self.engine.update(force=self.progressive.begin_interaction())
         for view in self.views:
             view.update_reslice()
         self.render_window.Render()
 
+    def refine(self):
+        if self.progressive.end_interaction():
+            self.engine.update(force=True)
+            for view in self.views:
+                view.update_reslice()
+            self.render_window.Render()
+
     def start(self):
         self.render_window.Render()
         self.interactor.Start()
@@ -1,41 +1,19 @@
+import os
+import sys
 import vtkmodules.all as vtk
+from reslice_engine import ResliceEngine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from raw_cache import load_mhd
 
 
 def load_mhd_file(file_path):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(file_path)
-    reader.Update()
-    return reader.GetOutput()
-
-
-def create_reslice_matrix_from_transform(transform, axis):
-    m = transform.GetMatrix()
-    axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            axes.SetElement(i, j, m.GetElement(i, j))
-        axes.SetElement(i, 3, m.GetElement(i, 3))
-
-    permute = [0, 1, 2]
-    if axis == 0:
-        permute = [1, 2, 0]
-    elif axis == 1:
-        permute = [2, 0, 1]
-    elif axis == 2:
-        permute = [0, 1, 2]
-
-    new_axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            new_axes.SetElement(i, j, axes.GetElement(i, permute[j]))
-        new_axes.SetElement(i, 3, axes.GetElement(i, 3))
-
-    return new_axes
-
-
-def apply_window_level(reslice_output, window, level):
+    return load_mhd(file_path)
+
+
+def apply_window_level(output_port, window, level):
     color_map = vtk.vtkImageMapToWindowLevelColors()
-    color_map.SetInputConnection(reslice_output.GetOutputPort())
+    color_map.SetInputConnection(output_port)
     color_map.SetWindow(window)
     color_map.SetLevel(level)
     return color_map
@@ -57,30 +35,15 @@ def create_cylinder_actor():
     return actor
 
 
-def apply_reslice_transform_to_actor(actor, reslice_matrix, implant_matrix):
-    inverse_reslice = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Invert(reslice_matrix, inverse_reslice)
-
-    final_matrix = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Multiply4x4(inverse_reslice, implant_matrix, final_matrix)
-
-    actor.SetUserMatrix(final_matrix)
-
-
 class View:
-    def __init__(self, image_data, implant_transform, axis, viewport, render_window):
-        self.image_data = image_data
-        self.implant_transform = implant_transform
+    def __init__(self, engine, axis, viewport, render_window):
+        self.engine = engine
+        self.implant_transform = engine.implant_transform
         self.axis = axis
         self.viewport = viewport
         self.render_window = render_window
 
-        self.reslice = vtk.vtkImageReslice()
-        self.reslice.SetInputData(image_data)
-        self.reslice.SetOutputDimensionality(2)
-        self.reslice.SetInterpolationModeToLinear()
-
-        self.color_map = apply_window_level(self.reslice, window=400, level=40)
+        self.color_map = apply_window_level(engine.get_output_port(axis), window=400, level=40)
 
         self.image_actor = vtk.vtkImageActor()
         self.image_actor.GetMapper().SetInputConnection(self.color_map.GetOutputPort())
@@ -153,23 +116,19 @@ class View:
             actor.SetMapper(mapper)
             return actor
 
-        new_reslice_matrix = create_reslice_matrix_from_transform(self.implant_transform, self.axis)
-        self.reslice.SetResliceAxes(new_reslice_matrix)
-        self.reslice.Update()
-        self.color_map.Update()
-        apply_reslice_transform_to_actor(
-            self.implant_actor,
-            new_reslice_matrix,
-            self.implant_transform.GetMatrix()
-        )
+        # The engine already resliced this view, skip the image and crosshair work when its plane did not change
+        if self.engine.dirty[self.axis]:
+            new_reslice_matrix = self.engine.reslice_matrix(self.axis)
+            self.color_map.Update()
+            self.implant_actor.SetUserMatrix(self.engine.implant_matrix(self.axis))
 
-        center_world = self.implant_transform.GetPosition()
-        center_reslice = transform_point_to_reslice_space(center_world, new_reslice_matrix)
-        v1, v2 = get_in_plane_vectors(self.implant_transform.GetMatrix(), new_reslice_matrix, self.axis)
-        # print("axis:", self.axis, "center:", center_reslice, "v1:", v1, "v2:", v2)
+            center_world = self.implant_transform.GetPosition()
+            center_reslice = transform_point_to_reslice_space(center_world, new_reslice_matrix)
+            v1, v2 = get_in_plane_vectors(self.implant_transform.GetMatrix(), new_reslice_matrix, self.axis)
+            # print("axis:", self.axis, "center:", center_reslice, "v1:", v1, "v2:", v2)
 
-        self.crosshair_lines[0].SetMapper(build_line_actor(center_reslice, v1).GetMapper())
-        self.crosshair_lines[1].SetMapper(build_line_actor(center_reslice, v2).GetMapper())
+            self.crosshair_lines[0].SetMapper(build_line_actor(center_reslice, v1).GetMapper())
+            self.crosshair_lines[1].SetMapper(build_line_actor(center_reslice, v2).GetMapper())
 
 
 class ViewManager:
@@ -185,10 +144,13 @@ class ViewManager:
         self.interactor = vtk.vtkRenderWindowInteractor()
         self.interactor.SetRenderWindow(self.render_window)
 
+        # One engine reslices all three views from the shared implant pose
+        self.engine = ResliceEngine(image_data, self.implant_transform)
+        self.engine.update()
         self.views = [
-            View(image_data, self.implant_transform, 0, (0.0, 0.0, 0.33, 1.0), self.render_window),
-            View(image_data, self.implant_transform, 1, (0.33, 0.0, 0.66, 1.0), self.render_window),
-            View(image_data, self.implant_transform, 2, (0.66, 0.0, 1.0, 1.0), self.render_window),
+            View(self.engine, 0, (0.0, 0.0, 0.33, 1.0), self.render_window),
+            View(self.engine, 1, (0.33, 0.0, 0.66, 1.0), self.render_window),
+            View(self.engine, 2, (0.66, 0.0, 1.0, 1.0), self.render_window),
         ]
 
         self.interactor.AddObserver("KeyPressEvent", self.keypress_callback)
@@ -218,6 +180,7 @@ class ViewManager:
             self.implant_transform.RotateWXYZ(angle, *axis)
             self.implant_transform.Translate(center[0], center[1], center[2])
 
+        self.engine.update()
         for view in self.views:
             view.update_reslice()
         self.render_window.Render()
@@ -1,41 +1,19 @@
+import os
+import sys
 import vtkmodules.all as vtk
+from reslice_engine import ResliceEngine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from raw_cache import load_mhd
 '''This script implements a multi-view reslice viewer for medical imaging data, real-time crosshair lines update'''
 
 def load_mhd_file(file_path):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(file_path)
-    reader.Update()
-    return reader.GetOutput()
-
-
-def create_reslice_matrix_from_transform(transform, axis):
-    m = transform.GetMatrix()
-    axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            axes.SetElement(i, j, m.GetElement(i, j))
-        axes.SetElement(i, 3, m.GetElement(i, 3))
-
-    permute = [0, 1, 2]
-    if axis == 0:
-        permute = [1, 2, 0]
-    elif axis == 1:
-        permute = [2, 0, 1]
-    elif axis == 2:
-        permute = [0, 1, 2]
-
-    new_axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            new_axes.SetElement(i, j, axes.GetElement(i, permute[j]))
-        new_axes.SetElement(i, 3, axes.GetElement(i, 3))
-
-    return new_axes
-
-
-def apply_window_level(reslice_output, window, level):
+    return load_mhd(file_path)
+
+
+def apply_window_level(output_port, window, level):
     color_map = vtk.vtkImageMapToWindowLevelColors()
-    color_map.SetInputConnection(reslice_output.GetOutputPort())
+    color_map.SetInputConnection(output_port)
     color_map.SetWindow(window)
     color_map.SetLevel(level)
     return color_map
@@ -57,16 +35,6 @@ def create_cylinder_actor():
     return actor
 
 
-def apply_reslice_transform_to_actor(actor, reslice_matrix, implant_matrix):
-    inverse_reslice = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Invert(reslice_matrix, inverse_reslice)
-
-    final_matrix = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Multiply4x4(inverse_reslice, implant_matrix, final_matrix)
-
-    actor.SetUserMatrix(final_matrix)
-
-
 def build_line_actor(p1, p2, color=(1, 1, 1), linewidth=2):
     line = vtk.vtkLineSource()
     line.SetPoint1(p1)
@@ -82,21 +50,14 @@ def build_line_actor(p1, p2, color=(1, 1, 1), linewidth=2):
 
 
 class View:
-    def __init__(self, image_data, implant_transform, axis, viewport, render_window):
-        self.image_data = image_data
-        self.implant_transform = implant_transform
+    def __init__(self, engine, axis, viewport, render_window):
+        self.engine = engine
+        self.implant_transform = engine.implant_transform
         self.axis = axis
         self.viewport = viewport
         self.render_window = render_window
 
-        self.slice_offset = 0.0  # slice offset along implant axis
-
-        self.reslice = vtk.vtkImageReslice()
-        self.reslice.SetInputData(image_data)
-        self.reslice.SetOutputDimensionality(2)
-        self.reslice.SetInterpolationModeToLinear()
-
-        self.color_map = apply_window_level(self.reslice, window=400, level=40)
+        self.color_map = apply_window_level(engine.get_output_port(axis), window=400, level=40)
 
         self.image_actor = vtk.vtkImageActor()
         self.image_actor.GetMapper().SetInputConnection(self.color_map.GetOutputPort())
@@ -124,30 +85,14 @@ class View:
         self.renderer.ResetCamera()
 
     def update_reslice(self):
-        # Build the reslice axes matrix with offset for slice scrolling
-        base_reslice_matrix = create_reslice_matrix_from_transform(self.implant_transform, self.axis)
-
-        # Modify the origin along the slice axis to apply the slice offset:
-        # The slice axis in the reslice matrix corresponds to the 3rd column (index 2)
-        origin = [base_reslice_matrix.GetElement(i, 3) for i in range(3)]
-        axis_vector = [base_reslice_matrix.GetElement(i, 2) for i in range(3)]
-        # Add offset along the normal direction of the reslice plane:
-        offset = [self.slice_offset * v for v in axis_vector]
-        new_origin = [origin[i] + offset[i] for i in range(3)]
-
-        for i in range(3):
-            base_reslice_matrix.SetElement(i, 3, new_origin[i])
-
-        self.reslice.SetResliceAxes(base_reslice_matrix)
-        self.reslice.Update()
+        # The engine already resliced this view with its slice offset, skip it when its plane did not change
+        if not self.engine.dirty[self.axis]:
+            return
+        base_reslice_matrix = self.engine.reslice_matrix(self.axis)
         self.color_map.Update()
 
         # Update implant actor position & orientation relative to reslice plane
-        apply_reslice_transform_to_actor(
-            self.implant_actor,
-            base_reslice_matrix,
-            self.implant_transform.GetMatrix()
-        )
+        self.implant_actor.SetUserMatrix(self.engine.implant_matrix(self.axis))
 
         # Update crosshair lines in this view based on implant transform and slice offset
         self.update_crosshair_lines(base_reslice_matrix)
@@ -160,7 +105,7 @@ class View:
         # Center in world coordinates = implant position translated along slice offset axis
         implant_pos = self.implant_transform.GetPosition()
         axis_vec = [reslice_matrix.GetElement(i, 2) for i in range(3)]
-        center_world = [implant_pos[i] + self.slice_offset * axis_vec[i] for i in range(3)]
+        center_world = [implant_pos[i] + self.engine.slice_offsets[self.axis] * axis_vec[i] for i in range(3)]
 
         # Transform center to reslice space
         inverse = vtk.vtkMatrix4x4()
@@ -236,7 +181,7 @@ class View:
         idx = (idx + 1) % 2  # switch to the other line
 
         # Build reslice matrix WITHOUT slice offset on this view (keep own slice offset)
-        base_reslice_matrix = create_reslice_matrix_from_transform(self.implant_transform, self.axis)
+        base_reslice_matrix = self.engine.base_matrix(self.axis)
 
         # Calculate world coordinate of crosshair line center using slice_offset along 'axis'
         implant_pos = self.implant_transform.GetPosition()
@@ -274,11 +219,13 @@ class ViewManager:
         # Slice offsets for each implant axis
         self.slice_offsets = [0.0, 0.0, 0.0]
 
-        # Three views, each reslicing along one implant axis
+        # Three views, each reslicing along one implant axis, driven by one engine
+        self.engine = ResliceEngine(image_data, self.implant_transform)
+        self.engine.update()
         self.views = [
-            View(image_data, self.implant_transform, axis=0, viewport=(0, 0, 1 / 3, 1), render_window=self.render_window),
-            View(image_data, self.implant_transform, axis=1, viewport=(1 / 3, 0, 2 / 3, 1), render_window=self.render_window),
-            View(image_data, self.implant_transform, axis=2, viewport=(2 / 3, 0, 1, 1), render_window=self.render_window)
+            View(self.engine, axis=0, viewport=(0, 0, 1 / 3, 1), render_window=self.render_window),
+            View(self.engine, axis=1, viewport=(1 / 3, 0, 2 / 3, 1), render_window=self.render_window),
+            View(self.engine, axis=2, viewport=(2 / 3, 0, 1, 1), render_window=self.render_window)
         ]
 
         self.active_axis = 2  # along cylinder axis is y
@@ -307,7 +254,8 @@ class ViewManager:
 
     def update_views(self):
         # Update main view along active_axis
-        self.views[self.active_axis].slice_offset = self.slice_offsets[self.active_axis]
+        self.engine.set_slice_offset(self.active_axis, self.slice_offsets[self.active_axis])
+        self.engine.update()
         self.views[self.active_axis].update_reslice()
 
         # Update crosshair lines in other views
@@ -1,42 +1,22 @@
+import os
+import sys
+import numpy as np
 import vtkmodules.all as vtk
+from reslice_engine import ResliceEngine
+from crosshair_overlay import CrosshairOverlay
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from raw_cache import load_mhd
 
 '''This script implements a multi-view reslice viewer for medical imaging data, use default crosshair positions'''
 
 def load_mhd_file(file_path):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(file_path)
-    reader.Update()
-    return reader.GetOutput()
-
-
-def create_reslice_matrix_from_transform(transform, axis):
-    m = transform.GetMatrix()
-    axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            axes.SetElement(i, j, m.GetElement(i, j))
-        axes.SetElement(i, 3, m.GetElement(i, 3))
-
-    permute = [0, 1, 2]
-    if axis == 0:
-        permute = [1, 2, 0]
-    elif axis == 1:
-        permute = [2, 0, 1]
-    elif axis == 2:
-        permute = [0, 1, 2]
-
-    new_axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            new_axes.SetElement(i, j, axes.GetElement(i, permute[j]))
-        new_axes.SetElement(i, 3, axes.GetElement(i, 3))
-
-    return new_axes
-
-
-def apply_window_level(reslice_output, window, level):
+    return load_mhd(file_path)
+
+
+def apply_window_level(output_port, window, level):
     color_map = vtk.vtkImageMapToWindowLevelColors()
-    color_map.SetInputConnection(reslice_output.GetOutputPort())
+    color_map.SetInputConnection(output_port)
     color_map.SetWindow(window)
     color_map.SetLevel(level)
     return color_map
@@ -58,16 +38,6 @@ def create_cylinder_actor():
     return actor
 
 
-def apply_reslice_transform_to_actor(actor, reslice_matrix, implant_matrix):
-    inverse_reslice = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Invert(reslice_matrix, inverse_reslice)
-
-    final_matrix = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Multiply4x4(inverse_reslice, implant_matrix, final_matrix)
-
-    actor.SetUserMatrix(final_matrix)
-
-
 def build_line_actor(p1, p2, color=(1, 1, 1), linewidth=2):
     line = vtk.vtkLineSource()
     line.SetPoint1(p1)
@@ -83,21 +53,15 @@ def build_line_actor(p1, p2, color=(1, 1, 1), linewidth=2):
 
 
 class View:
-    def __init__(self, image_data, implant_transform, axis, viewport, render_window):
-        self.image_data = image_data
-        self.implant_transform = implant_transform
+    def __init__(self, engine, crosshair, axis, viewport, render_window):
+        self.engine = engine
+        self.crosshair = crosshair
+        self.implant_transform = engine.implant_transform
         self.axis = axis
         self.viewport = viewport
         self.render_window = render_window
 
-        self.slice_offset = 0.0  # slice offset along implant axis
-
-        self.reslice = vtk.vtkImageReslice()
-        self.reslice.SetInputData(image_data)
-        self.reslice.SetOutputDimensionality(2)
-        self.reslice.SetInterpolationModeToLinear()
-
-        self.color_map = apply_window_level(self.reslice, window=400, level=40)
+        self.color_map = apply_window_level(engine.get_output_port(axis), window=400, level=40)
 
         self.image_actor = vtk.vtkImageActor()
         self.image_actor.GetMapper().SetInputConnection(self.color_map.GetOutputPort())
@@ -113,56 +77,34 @@ class View:
 
         self.render_window.AddRenderer(self.renderer)
 
-        # crosshair lines, two per view representing the two implant axes perpendicular to this view axis
-        self.crosshair_lines = [vtk.vtkActor(), vtk.vtkActor()]
-        self.crosshair_default_endpoints = [
+        # crosshair lines, two per view representing the two implant axes perpendicular to this view axis,
+        # kept in the shared crosshair point buffer and moved in place
+        self.crosshair_default_endpoints = np.array([
             [0, 0, -100], [0, 0, 100],  # along (axis+1)%3
             [0, -100, 0], [0, 100, 0]   # along (axis+2)%3
-        ]
+        ], dtype=np.float64)
         colors = [(1, 0, 0), (0, 1, 0), (0, 0, 1)]
-        for i, actor in enumerate(self.crosshair_lines):
-            actor.GetProperty().SetLineWidth(2)
-            actor.GetProperty().SetColor(colors[(self.axis + 1 + i) % 3])
-            self.renderer.AddActor(actor)
+        for i in range(2):
+            self.crosshair.set_line_color(self.axis, i, colors[(self.axis + 1 + i) % 3])
+        self.renderer.AddActor(self.crosshair.get_actor(self.axis))
 
         self.update_reslice()
         self.renderer.ResetCamera()
 
     def update_reslice(self):
-        # Build the reslice axes matrix with offset for slice scrolling
-        base_reslice_matrix = create_reslice_matrix_from_transform(self.implant_transform, self.axis)
-
-        # Modify the origin along the slice axis to apply the slice offset:
-        # The slice axis in the reslice matrix corresponds to the 3rd column (index 2)
-        origin = [base_reslice_matrix.GetElement(i, 3) for i in range(3)]
-        axis_vector = [base_reslice_matrix.GetElement(i, 2) for i in range(3)]
-        # Add offset along the normal direction of the reslice plane:
-        offset = [self.slice_offset * v for v in axis_vector]
-        new_origin = [origin[i] + offset[i] for i in range(3)]
-
-        for i in range(3):
-            base_reslice_matrix.SetElement(i, 3, new_origin[i])
-
-        self.reslice.SetResliceAxes(base_reslice_matrix)
-        self.reslice.Update()
+        # The engine already resliced this view with its slice offset, skip it when its plane did not change
+        if not self.engine.dirty[self.axis]:
+            return
+        base_reslice_matrix = self.engine.reslice_matrix(self.axis)
         self.color_map.Update()
 
         # Update implant actor position & orientation relative to reslice plane
-        apply_reslice_transform_to_actor(
-            self.implant_actor,
-            base_reslice_matrix,
-            self.implant_transform.GetMatrix()
-        )
+        self.implant_actor.SetUserMatrix(self.engine.implant_matrix(self.axis))
 
         # Update crosshair lines in this view based on implant transform and slice offset
         self.update_crosshair_lines(base_reslice_matrix)
-        # Get crosshair lines default endpoints from actor geometry
-        for i, actor in enumerate(self.crosshair_lines):
-            polydata = actor.GetMapper().GetInput()
-            p1 = list(polydata.GetPoint(0))
-            p2 = list(polydata.GetPoint(1))
-            self.crosshair_default_endpoints[i * 2] = p1
-            self.crosshair_default_endpoints[i * 2 + 1] = p2
+        # Remember the lines through the crosshair center, other views' scrolling shifts them from here
+        self.crosshair_default_endpoints[:] = self.crosshair.line_points(self.axis)
 
     def update_crosshair_lines(self, reslice_matrix):
         # The two crosshair lines lie along implant axes perpendicular to this view axis
@@ -172,7 +114,7 @@ class View:
         # Center in world coordinates = implant position translated along slice offset axis
         implant_pos = self.implant_transform.GetPosition()
         axis_vec = [reslice_matrix.GetElement(i, 2) for i in range(3)]
-        center_world = [implant_pos[i] + self.slice_offset * axis_vec[i] for i in range(3)]
+        center_world = [implant_pos[i] + self.engine.slice_offsets[self.axis] * axis_vec[i] for i in range(3)]
 
         # Transform center to reslice space
         inverse = vtk.vtkMatrix4x4()
@@ -194,31 +136,16 @@ class View:
 
         length = 100  # crosshair line half-length in reslice space
 
-        # Update each crosshair line actor with new geometry
-        for actor, direction in zip(self.crosshair_lines, [dir1, dir2]):
-            # define self crosshair default line endpoints for the two directions
-            p1 = [center_reslice[i] - length * direction[i] for i in range(3)]
-            p2 = [center_reslice[i] + length * direction[i] for i in range(3)]
-            line_source = vtk.vtkLineSource()
-            line_source.SetPoint1(p1)
-            line_source.SetPoint2(p2)
-            line_source.Update()
-            actor.SetMapper(vtk.vtkPolyDataMapper())
-            actor.GetMapper().SetInputConnection(line_source.GetOutputPort())
-    
+        # Write the new endpoints of both lines in place
+        for idx, direction in enumerate([dir1, dir2]):
+            self.crosshair.set_line_through(self.axis, idx, center_reslice, direction, length)
+
     def update_one_crosshair_line(self, idx, slice_offset, direction):
+        # Shift the line from its default position by the slice offset, in place
+        shift = slice_offset * np.asarray(direction)
         p1 = self.crosshair_default_endpoints[idx * 2]
         p2 = self.crosshair_default_endpoints[idx * 2 + 1]
-        # Update the crosshair line geometry based on the new slice offset
-        new_p1 = [p1[i] + slice_offset * direction[i] for i in range(3)]
-        new_p2 = [p2[i] + slice_offset * direction[i] for i in range(3)]
-        line_source = vtk.vtkLineSource()
-        line_source.SetPoint1(new_p1)
-        line_source.SetPoint2(new_p2)
-        line_source.Update()
-        mapper = vtk.vtkPolyDataMapper()
-        mapper.SetInputConnection(line_source.GetOutputPort())
-        self.crosshair_lines[idx].SetMapper(mapper)
+        self.crosshair.set_line(self.axis, idx, p1 + shift, p2 + shift)
 
     def update_crosshair_line_for_axis(self, active_axis, slice_offset):
         """
@@ -240,7 +167,7 @@ class View:
         idx = (idx + 1) % 2  # switch to the other line
 
         # Build reslice matrix WITHOUT slice offset on this view (keep own slice offset)
-        base_reslice_matrix = create_reslice_matrix_from_transform(self.implant_transform, self.axis)
+        base_reslice_matrix = self.engine.base_matrix(self.axis)
         # Transform center to reslice space of this view
         inverse = vtk.vtkMatrix4x4()
         vtk.vtkMatrix4x4.Invert(base_reslice_matrix, inverse)
@@ -275,12 +202,17 @@ class ViewManager:
         # Slice offsets for each implant axis
         self.slice_offsets = [0.0, 0.0, 0.0]
 
-        # Three views, each reslicing along one implant axis
+        # Three views, each reslicing along one implant axis, driven by one engine
+        self.engine = ResliceEngine(image_data, self.implant_transform)
+        self.engine.update()
+        # Crosshair lines of all views share one point buffer
+        self.crosshair = CrosshairOverlay(num_views=3)
         self.views = [
-            View(image_data, self.implant_transform, axis=0, viewport=(0, 0, 1 / 3, 1), render_window=self.render_window),
-            View(image_data, self.implant_transform, axis=1, viewport=(1 / 3, 0, 2 / 3, 1), render_window=self.render_window),
-            View(image_data, self.implant_transform, axis=2, viewport=(2 / 3, 0, 1, 1), render_window=self.render_window)
+            View(self.engine, self.crosshair, axis=0, viewport=(0, 0, 1 / 3, 1), render_window=self.render_window),
+            View(self.engine, self.crosshair, axis=1, viewport=(1 / 3, 0, 2 / 3, 1), render_window=self.render_window),
+            View(self.engine, self.crosshair, axis=2, viewport=(2 / 3, 0, 1, 1), render_window=self.render_window)
         ]
+        self.crosshair.commit()
 
         self.active_axis = 2  # along cylinder axis is y
 
@@ -308,7 +240,8 @@ class ViewManager:
 
     def update_views(self):
         # Update main view along active_axis
-        self.views[self.active_axis].slice_offset = self.slice_offsets[self.active_axis]
+        self.engine.set_slice_offset(self.active_axis, self.slice_offsets[self.active_axis])
+        self.engine.update()
         self.views[self.active_axis].update_reslice()
 
         # Update crosshair lines in other views
@@ -317,6 +250,8 @@ class ViewManager:
                 continue
             self.views[i].update_crosshair_line_for_axis(self.active_axis, self.slice_offsets[self.active_axis])
 
+        # One Modified() for all crosshair changes of this frame
+        self.crosshair.commit()
         self.render_window.Render()
 
 
@@ -1,40 +1,25 @@
+import os
+import sys
 import vtkmodules.all as vtk
+from reslice_engine import ResliceEngine, matrix_to_numpy
+from render_scheduler import RenderScheduler
+from progressive_reslice import ProgressiveReslice
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from raw_cache import load_mhd
 
 '''
 This script demonstrates a multi-view reslice viewer using VTK.
 It allows for interactive manipulation of an implant trajectory and scrolling view
 and visualizes the corresponding resliced images in three orthogonal views and crosshair lines.
+Reslicing runs on a worker thread, held keys are coalesced and frames are presented at a capped rate.
 '''
 def load_mhd_file(file_path):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(file_path)
-    reader.Update()
-    return reader.GetOutput()
-
-def create_reslice_matrix_from_transform(transform, axis):
-    m = transform.GetMatrix()
-    axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            axes.SetElement(i, j, m.GetElement(i, j))
-        axes.SetElement(i, 3, m.GetElement(i, 3))
-    permute = [0, 1, 2]
-    if axis == 0:
-        permute = [1, 2, 0]
-    elif axis == 1:
-        permute = [2, 0, 1]
-    elif axis == 2:
-        permute = [0, 1, 2]
-    new_axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            new_axes.SetElement(i, j, axes.GetElement(i, permute[j]))
-        new_axes.SetElement(i, 3, axes.GetElement(i, 3))
-    return new_axes
-
-def apply_window_level(reslice_output, window, level):
+    return load_mhd(file_path)
+
+def apply_window_level(output_port, window, level):
     color_map = vtk.vtkImageMapToWindowLevelColors()
-    color_map.SetInputConnection(reslice_output.GetOutputPort())
+    color_map.SetInputConnection(output_port)
     color_map.SetWindow(window)
     color_map.SetLevel(level)
     return color_map
@@ -52,27 +37,16 @@ def create_cylinder_actor():
     actor.GetProperty().SetColor(0.9, 0.7, 0.3)
     return actor
 
-def apply_reslice_transform_to_actor(actor, reslice_matrix, implant_matrix):
-    inverse_reslice = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Invert(reslice_matrix, inverse_reslice)
-    final_matrix = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Multiply4x4(inverse_reslice, implant_matrix, final_matrix)
-    actor.SetUserMatrix(final_matrix)
-
 class View:
-    def __init__(self, image_data, implant_transform, axis, viewport, render_window):
-        self.image_data = image_data
-        self.implant_transform = implant_transform
+    def __init__(self, frame, axis, viewport, render_window):
+        self.frame = frame
         self.axis = axis
         self.viewport = viewport
         self.render_window = render_window
-        self.slice_offset = 0.0  # slice offset along implant axis
 
-        self.reslice = vtk.vtkImageReslice()
-        self.reslice.SetInputData(image_data)
-        self.reslice.SetOutputDimensionality(2)
-        self.reslice.SetInterpolationModeToLinear()
-        self.color_map = apply_window_level(self.reslice, window=400, level=40)
+        # Resliced images are computed off the render thread and swapped in here
+        self.producer = vtk.vtkTrivialProducer()
+        self.color_map = apply_window_level(self.producer.GetOutputPort(), window=400, level=40)
         self.image_actor = vtk.vtkImageActor()
         self.image_actor.GetMapper().SetInputConnection(self.color_map.GetOutputPort())
         self.implant_actor = create_cylinder_actor()
@@ -90,27 +64,17 @@ class View:
             actor.GetProperty().SetLineWidth(2)
             actor.GetProperty().SetColor(colors[(self.axis + 1 + i) % 3])
             self.renderer.AddActor(actor)
-        self.update_reslice()
-        self.update_crosshair_lines([0.0, 0.0, 0.0])  # Initialize crosshair lines
+        self.update_reslice(frame)
+        self.update_crosshair_lines(list(frame.slice_offsets))  # Initialize crosshair lines
         self.renderer.ResetCamera()
 
-    def update_reslice(self):
-        base_reslice_matrix = create_reslice_matrix_from_transform(self.implant_transform, self.axis)
-        # Modify the origin along the slice axis to apply the slice offset:
-        origin = [base_reslice_matrix.GetElement(i, 3) for i in range(3)]
-        axis_vector = [base_reslice_matrix.GetElement(i, 2) for i in range(3)]
-        offset = [self.slice_offset * v for v in axis_vector]
-        new_origin = [origin[i] + offset[i] for i in range(3)]
-        for i in range(3):
-            base_reslice_matrix.SetElement(i, 3, new_origin[i])
-        self.reslice.SetResliceAxes(base_reslice_matrix)
-        self.reslice.Update()
-        self.color_map.Update()
-        apply_reslice_transform_to_actor(
-            self.implant_actor,
-            base_reslice_matrix,
-            self.implant_transform.GetMatrix()
-        )
+    def update_reslice(self, frame):
+        # The frame carries a new image only for views whose plane changed
+        self.frame = frame
+        if not frame.dirty[self.axis]:
+            return
+        self.producer.SetOutput(frame.images[self.axis])
+        self.implant_actor.SetUserMatrix(frame.implant_matrix(self.axis))
         # set camera clipping range
         # distance = self.renderer.GetActiveCamera().GetDistance()
         # self.renderer.GetActiveCamera().SetClippingRange(distance - 0.5, distance + 0.5)
@@ -133,9 +97,10 @@ class View:
             return
         idx = crosshair_axes.index(active_axis)
         idx = (idx + 1) % 2  # switch to the other line
-        base_reslice_matrix = create_reslice_matrix_from_transform(self.implant_transform, self.axis)
-        implant_pos = self.implant_transform.GetPosition()
-        axis_vec = [self.implant_transform.GetMatrix().GetElement(i, active_axis) for i in range(3)]
+        # Pose of the frame on screen, the live transform may already be ahead of it
+        base_reslice_matrix = self.frame.base_matrix(self.axis)
+        implant_pos = list(self.frame.pose[:3, 3])
+        axis_vec = list(self.frame.pose[:3, active_axis])
         center_world = [implant_pos[i] + active_offset * axis_vec[i] for i in range(3)]
         inverse = vtk.vtkMatrix4x4()
         vtk.vtkMatrix4x4.Invert(base_reslice_matrix, inverse)
@@ -162,18 +127,55 @@ class ViewManager:
         self.interactor = vtk.vtkRenderWindowInteractor()
         self.interactor.SetRenderWindow(self.render_window)
         self.slice_offsets = [0.0, 0.0, 0.0]
+        # One engine reslices all three views from the shared implant pose,
+        # after the first frame it is only used by the scheduler's worker thread
+        self.engine = ResliceEngine(image_data, self.implant_transform)
+        self.engine.update()
+        frame = self.engine.frame()
         self.views = [
-            View(image_data, self.implant_transform, axis=0, viewport=(0, 0, 1 / 3, 1), render_window=self.render_window),
-            View(image_data, self.implant_transform, axis=1, viewport=(1 / 3, 0, 2 / 3, 1), render_window=self.render_window),
-            View(image_data, self.implant_transform, axis=2, viewport=(2 / 3, 0, 1, 1), render_window=self.render_window)
+            View(frame, axis=0, viewport=(0, 0, 1 / 3, 1), render_window=self.render_window),
+            View(frame, axis=1, viewport=(1 / 3, 0, 2 / 3, 1), render_window=self.render_window),
+            View(frame, axis=2, viewport=(2 / 3, 0, 1, 1), render_window=self.render_window)
         ]
+        self.scheduler = RenderScheduler(self.compute_frame, self.present_frame,
+                                         merge=lambda previous, latest: latest.merge_unpresented(previous),
+                                         max_fps=30)
+        # Coarse nearest-neighbour preview while keys are pressed, full resolution after a short pause.
+        # The reslices belong to the worker, so only the worker switches them, driven by the posted state.
+        self.progressive = ProgressiveReslice(image_data, self.engine.reslices)
+        self.progressive.attach(self.interactor, self.refine)
         self.active_axis = 2  # default: along cylinder axis is y
         self.interactor.AddObserver("KeyPressEvent", self.on_key_press)
 
     def render(self):
         self.render_window.Render()
         self.interactor.Initialize()
+        self.scheduler.attach(self.interactor)
         self.interactor.Start()
+        self.scheduler.stop()
+
+    def current_state(self, preview):
+        return matrix_to_numpy(self.implant_transform.GetMatrix()), tuple(self.slice_offsets), preview
+
+    def compute_frame(self, state):
+        # Worker thread: reslice the posted pose and offsets, at preview or full resolution
+        pose, slice_offsets, preview = state
+        for axis, offset in enumerate(slice_offsets):
+            self.engine.set_slice_offset(axis, offset)
+        mode_changed = self.progressive.set_preview(preview)
+        self.engine.update(pose=pose, force=mode_changed)
+        return self.engine.frame()
+
+    def refine(self):
+        self.scheduler.request(self.current_state(preview=False))
+
+    def present_frame(self, frame):
+        # Render thread: swap in the newest frame
+        for view in self.views:
+            view.update_reslice(frame)
+            view.update_crosshair_lines(list(frame.slice_offsets))
+        self.render_window.Render()
+        # print(self.scheduler.report(), frame.update_time)
 
     def on_key_press(self, obj, event):
         print("Active axis:", self.active_axis)
@@ -205,19 +207,20 @@ class ViewManager:
         elif key in ["1", "2", "3"]:
             self.active_axis = int(key) - 1
             print(f"Active axis changed to: {self.active_axis}")
+            # Selection only, neither the pose nor an offset changed
+            return
         elif key == "equal" or key == "plus":
             self.slice_offsets[self.active_axis] += 1
-            self.views[self.active_axis].slice_offset = self.slice_offsets[self.active_axis]
             print(f"Slice offset[{self.active_axis}] = {self.slice_offsets[self.active_axis]}")
         elif key == "minus":
             self.slice_offsets[self.active_axis] -= 1
-            self.views[self.active_axis].slice_offset = self.slice_offsets[self.active_axis]
             print(f"Slice offset[{self.active_axis}] = {self.slice_offsets[self.active_axis]}")
-        # Update all views after any change
-        for view in self.views:
-            view.update_reslice()
-            view.update_crosshair_lines(self.slice_offsets)
-        self.render_window.Render()
+        else:
+            # Unrelated key, keep the current views at full resolution
+            return
+        # Post the new state, the worker reslices only the changed planes of the latest one
+        self.progressive.touch()
+        self.scheduler.request(self.current_state(preview=True))
 
 if __name__ == '__main__':
     image = load_mhd_file("data/L1.mhd")
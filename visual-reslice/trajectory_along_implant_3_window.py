@@ -1,45 +1,21 @@
+import os
+import sys
 import vtkmodules.all as vtk
 import numpy as np
 import threading
+from reslice_engine import ResliceEngine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from raw_cache import load_mhd
 
 
 def load_mhd_file(file_path):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(file_path)
-    reader.Update()
-    return reader.GetOutput()
-
-
-def create_reslice_matrix_from_transform(transform, axis):
-    # Create a reslice axes matrix aligned to the implant's local axes
-    m = transform.GetMatrix()
-    axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            axes.SetElement(i, j, m.GetElement(i, j))
-        axes.SetElement(i, 3, m.GetElement(i, 3))
-
-    # Select which axis to align as view direction (X=0, Y=1, Z=2)
-    permute = [0, 1, 2]
-    if axis == 0:  # X view
-        permute = [1, 2, 0]
-    elif axis == 1:  # Y view
-        permute = [2, 0, 1]
-    elif axis == 2:  # Z view
-        permute = [0, 1, 2]
-
-    # Create new axes with permuted directions
-    new_axes = vtk.vtkMatrix4x4()
-    for i in range(3):
-        for j in range(3):
-            new_axes.SetElement(i, j, axes.GetElement(i, permute[j]))
-        new_axes.SetElement(i, 3, axes.GetElement(i, 3))
-    return new_axes
-
-
-def apply_window_level(reslice_output, window, level):
+    return load_mhd(file_path)
+
+
+def apply_window_level(output_port, window, level):
     color_map = vtk.vtkImageMapToWindowLevelColors()
-    color_map.SetInputConnection(reslice_output.GetOutputPort())
+    color_map.SetInputConnection(output_port)
     color_map.SetWindow(window)
     color_map.SetLevel(level)
     color_map.Update()
@@ -62,31 +38,16 @@ def create_cylinder_actor():
     return actor
 
 
-def apply_reslice_transform_to_actor(actor, reslice_matrix, implant_matrix):
-    inverse_reslice = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Invert(reslice_matrix, inverse_reslice)
-
-    final_matrix = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Multiply4x4(inverse_reslice, implant_matrix, final_matrix)
-
-    actor.SetUserMatrix(final_matrix)
-
-
 class View:
-    def __init__(self, image_data, implant_transform, axis, title):
-        self.image_data = image_data
-        self.implant_transform = implant_transform
+    def __init__(self, engine, axis, title):
+        self.engine = engine
+        self.implant_transform = engine.implant_transform
         self.axis = axis
         self.title = title
-
-        self.reslice = vtk.vtkImageReslice()
-        self.reslice.SetInputData(image_data)
-        self.reslice.SetOutputDimensionality(2)
-        self.reslice.SetInterpolationModeToLinear()
-        self.reslice.SetOutputSpacing(1.0, 1.0, 1.0)
+        self.on_change = None  # called instead of a local update when the implant moves
 
         self.implant_actor = create_cylinder_actor()
-        self.color_map = apply_window_level(self.reslice, window=400, level=40)
+        self.color_map = apply_window_level(engine.get_output_port(axis), window=400, level=40)
 
         self.image_actor = vtk.vtkImageActor()
         self.image_actor.GetMapper().SetInputConnection(self.color_map.GetOutputPort())
@@ -111,15 +72,12 @@ class View:
         self.renderer.ResetCamera()
 
     def update_reslice(self):
-        new_reslice_matrix = create_reslice_matrix_from_transform(self.implant_transform, self.axis)
-        self.reslice.SetResliceAxes(new_reslice_matrix)
-        self.reslice.Update()
+        # The engine already resliced this view, skip it when its plane did not change
+        if not self.engine.dirty[self.axis]:
+            return False
         self.color_map.Update()
-        apply_reslice_transform_to_actor(
-            self.implant_actor,
-            new_reslice_matrix,
-            self.implant_transform.GetMatrix()
-        )
+        self.implant_actor.SetUserMatrix(self.engine.implant_matrix(self.axis))
+        return True
 
     def keypress_callback(self, obj, event):
         key = obj.GetKeySym()
@@ -148,6 +106,10 @@ class View:
             self.implant_transform.RotateWXYZ(angle, *axis)
             self.implant_transform.Translate(center[0], center[1], center[2])
 
+        if self.on_change is not None:
+            self.on_change()
+            return
+        self.engine.update()
         self.update_reslice()
         self.render_window.Render()
 
@@ -162,11 +124,23 @@ class ViewManager:
         self.implant_transform.PostMultiply()
         self.implant_transform.Translate(image_data.GetCenter())
 
+        # One engine reslices all three views from the shared implant pose
+        self.engine = ResliceEngine(image_data, self.implant_transform, output_spacing=(1.0, 1.0, 1.0))
+        self.engine.update()
         self.views = [
-            View(image_data, self.implant_transform, 0, "Trajectory 1 - X"),
-            View(image_data, self.implant_transform, 1, "Trajectory 2 - Y"),
-            View(image_data, self.implant_transform, 2, "Trajectory 3 - Z"),
+            View(self.engine, 0, "Trajectory 1 - X"),
+            View(self.engine, 1, "Trajectory 2 - Y"),
+            View(self.engine, 2, "Trajectory 3 - Z"),
         ]
+        for view in self.views:
+            view.on_change = self.update_views
+
+    def update_views(self):
+        # A key press in any window moves the shared implant, refresh the windows whose plane changed
+        self.engine.update()
+        for view in self.views:
+            if view.update_reslice():
+                view.render_window.Render()
 
     def start_all(self):
         # threads = []
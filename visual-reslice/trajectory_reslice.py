@@ -1,12 +1,15 @@
+import os
+import sys
 import vtkmodules.all as vtk
 import numpy as np
+from progressive_reslice import ProgressiveReslice
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image-process"))
+from raw_cache import load_mhd
 
 # Load the MHD file using VTK
 def load_mhd_file(file_path):
-    reader = vtk.vtkMetaImageReader()
-    reader.SetFileName(file_path)
-    reader.Update()
-    return reader.GetOutput()
+    return load_mhd(file_path)
 
 # Create reslice matrix for reslicing along a trajectory
 def create_reslice_matrix(normal, view_up, center):
@@ -113,6 +116,17 @@ def display_with_interaction(image_data, window, level):
     interactor = vtk.vtkRenderWindowInteractor()
     interactor.SetRenderWindow(render_window)
 
+    # Coarse nearest-neighbour preview while keys are pressed, full resolution after a short pause
+    progressive = ProgressiveReslice(image_data, [reslice], output_spacing=(1.0, 1.0, 1.0))
+
+    def refine():
+        if progressive.end_interaction():
+            reslice.Update()
+            color_map.Update()
+            render_window.Render()
+
+    progressive.attach(interactor, refine)
+
     # Key interaction
     def keypress_callback(obj, event):
         nonlocal current_axis, center, reslice, reslice_matrix, color_map
@@ -134,6 +148,7 @@ def display_with_interaction(image_data, window, level):
             updated = True
 
         if updated:
+            progressive.begin_interaction()
             reslice.SetResliceAxes(create_reslice_matrix(*trajectory_directions[current_axis], center))
             reslice.Update()
             color_map.Update()